@@ -10,8 +10,19 @@ import json
 from pathlib import Path 
 
 from src.choice_loop import ChoiceLoop
+from src.embedder import (
+    can_replace_stored,
+    clear_disk_cache as clear_embedding_disk_cache,
+    embed_many,
+    embedding_backend,
+    embedding_dim,
+    fallback_reason as embedding_fallback_reason,
+    is_available as embedder_available,
+    warm_up as warm_up_embedder,
+)
 from src.llm_runtime import LocalLLM
 from src.prologue import run_prologue
+from src.memory_retrieval import _event_terms
 from src.memory_store import MemoryStore
 from src.state_store import WorldStateStore
 
@@ -49,6 +60,7 @@ def _append_scripted_log(event, index):
 def _reset_runtime_data(state_store, memory_store):
     state_store.reset()
     memory_store.reset()
+    clear_embedding_disk_cache()
     LOG_PATH.unlink(missing_ok=True)
 
 def _start_new_game(state_store, memory_store):
@@ -64,10 +76,16 @@ def _start_new_game(state_store, memory_store):
     )
     state_store.save(world_state)
 
-    for index, event in enumerate(handoff["scripted_events"], start=1):
-        scripted_event = dict(event)
+    scripted_events = [dict(event) for event in handoff["scripted_events"]]
+    # The prologue summaries are embedded in one batch so they can be retrieved semantically like any other turn
+    vectors = embed_many([event.get("memory_summary", "") for event in scripted_events])
+    embedding_indices = memory_store.append_embeddings(vectors) if vectors is not None else []
+    for index, scripted_event in enumerate(scripted_events, start=1):
         scripted_event.setdefault("event_id", f"scripted_{index}")
         scripted_event.setdefault("turn", 0)
+        if index <= len(embedding_indices):
+            scripted_event["embedding_index"] = embedding_indices[index - 1]
+        scripted_event["terms"] = _event_terms(scripted_event)
         memory_store.append_turn(scripted_event)
         memory_store.append_npc_memory(scripted_event.get("current_npc"), scripted_event)
         _append_scripted_log(scripted_event, index)
@@ -80,6 +98,7 @@ def _start_new_game(state_store, memory_store):
     return prologue_summary, initial_player_choice, world_state, False
 
 def main():
+    warm_up_embedder() #Loads the sentence embedder in the background while the LLM loads and the prologue runs
     llm = LocalLLM()
     try:
         llm.load()
@@ -89,12 +108,33 @@ def main():
 
     state_store = WorldStateStore()
     memory_store = MemoryStore()
+    migrated = memory_store.migrate_inline_embeddings() #Older saves kept embeddings inline in the JSONL rows
+    if migrated:
+        print(f"Moved {migrated} stored embeddings into the binary sidecar.")
 
     saved_state = state_store.load() #Continue from the last saved state if it exists
     if saved_state:
         choice = _choose_saved_state_action()
         if choice == "1":
             print("Continuing previous session.")
+            if embedder_available():
+                stored_dim = memory_store.embedding_dim()
+                if can_replace_stored(stored_dim):
+                    #Saved on the hashing fallback before sentence-transformers was installed
+                    reembedded = memory_store.reembed_embeddings(embed_many)
+                    print(f"Embedding model available - re-embedded {reembedded} stored memories.")
+                elif stored_dim is not None and stored_dim != embedding_dim():
+                    #Never downgrade on disk: the stored vectors are kept and retrieval leans on keyword search this session
+                    reason = embedding_fallback_reason()
+                    print(
+                        f"Embedding backend {embedding_backend()} does not match the stored {stored_dim}-dim memories"
+                        + (f" ({reason})" if reason else "")
+                        + " - keeping them and using keyword search this session."
+                    )
+                else: #Rows saved while the embedding model was unavailable
+                    backfilled = memory_store.backfill_embeddings(embed_many)
+                    if backfilled:
+                        print(f"Embedded {backfilled} stored memories that had no embedding.")
             prologue_summary = saved_state.get("prologue_summary", "Prologue summary unavailable.")
             initial_player_choice = {
                 "id": saved_state.get("last_choice_id", "continue_investigation"),
@@ -127,7 +167,10 @@ def main():
         memory_store=memory_store,
         resume_mode=resume_mode,
     )
-    loop.run()
+    try:
+        loop.run()
+    finally:
+        loop.close()
 
 if __name__ == "__main__":
     main()
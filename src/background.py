@@ -0,0 +1,60 @@
+'''
+src/background.py
+
+Tiny single-thread job queue for work that does not need to finish before the player's next choice.
+Jobs run in submission order on one daemon thread, so ordering between them is kept.
+'''
+
+import queue
+import threading
+
+class BackgroundWorker:
+    def __init__(self, name, max_pending=0): #max_pending=0 means no cap
+        self.name = name
+        self.max_pending = max_pending
+        self.last_error = None
+        self._jobs = queue.Queue()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._thread = None
+
+    def pending(self):
+        with self._idle:
+            return self._pending
+
+    def submit(self, fn, *args, **kwargs):
+        #Returns False (and drops the job) when the pending cap is already reached
+        with self._idle:
+            if self.max_pending and self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        self._jobs.put((fn, args, kwargs))
+        return True
+
+    def pop_error(self):
+        #The last job failure, cleared so the same failure is only reported once
+        with self._idle:
+            error, self.last_error = self.last_error, None
+            return error
+
+    def wait(self, timeout=None):
+        #Blocks until every submitted job has finished, returns False on timeout
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout)
+
+    def _run(self):
+        while True:
+            fn, args, kwargs = self._jobs.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception as exc:
+                with self._idle:
+                    self.last_error = exc #Background jobs must never take the game loop down with them
+            finally:
+                with self._idle:
+                    self._pending -= 1
+                    if self._pending == 0:
+                        self._idle.notify_all()
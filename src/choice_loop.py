@@ -9,15 +9,80 @@ retrieval, state mutation, and logging to focused modules.
 import time
 
 from src.choice_formatter import _coerce_choice_list
-from src.config import PLAYER_CHOICE_SPEAK_SECONDS, POST_RESPONSE_PAUSE_SECONDS
+from src.config import (
+    PLAYER_CHOICE_SPEAK_SECONDS,
+    POST_RESPONSE_PAUSE_SECONDS,
+    SPECULATIVE_PREGENERATION,
+    STREAM_TURN_OUTPUT,
+)
+from src.json_grammar import JsonFieldStreamer
 from src.memory_retrieval import _retrieve_memories
-from src.output_validator import OutputValidationExhausted, _generate_valid_json
+from src.output_validator import (
+    GenerationCancelled,
+    OutputValidationExhausted,
+    _generate_valid_json,
+    _line_survives_validation,
+)
 from src.prompt_builder import _build_prompt, _load_prompt_template
+from src.speculation import SpeculativeTurns
 from src.state_manager import StateManager
 from src.story_rules import forced_story_choices, suggest_story_choices
-from src.text_fx import type_line
+from src.text_fx import TypewriterStream, type_line
 from src.turn_logger import _log_failure, _log_turn
 
+class TurnStream:
+    """Types the narrator and reply lines while the model is still generating the rest of the turn.
+
+    Fed the raw completion text through LocalLLM's on_text callback.  Each line is
+    held until its string value closes and check(field, text, speaker) confirms
+    validation would keep it as written, so the player never sees a line that is
+    then rejected.  Once a line is held back nothing after it is streamed either,
+    keeping the lines in order.  shown records the lines typed, in order.
+    """
+
+    def __init__(self, show_marker, default_speaker, story_bridge="", check=None):
+        self.show_marker = show_marker
+        self.default_speaker = default_speaker
+        self.story_bridge = str(story_bridge or "").strip()
+        self.check = check
+        self.typewriter = None
+        self.first_text_at = None
+        self.shown = {}
+        self.held = False
+        self.fields = JsonFieldStreamer({"narrator", "reply"}, on_end=self._on_end)
+
+    def feed(self, chunk):
+        self.fields.feed(chunk)
+
+    def _on_end(self, field):
+        if self.held or field in self.shown:
+            return
+        text = str(self.fields.values.get(field, "")).strip()
+        speaker = str(self.fields.values.get("speaker", "")).strip()
+        if field == "reply" and "narrator" not in self.shown:
+            self.held = True #The validated narrator would have to be typed above it
+            return
+        if not text or (self.check is not None and not self.check(field, text, speaker)):
+            self.held = True
+            return
+        if field == "narrator":
+            #The story bridge is prepended to the narrator after validation, so it is typed first here too
+            bridged = self.story_bridge and self.story_bridge.lower() not in text.lower()
+            line = "Narrator: " + (f"{self.story_bridge} " if bridged else "") + text
+        else:
+            line = f"{speaker or self.default_speaker}: {text}"
+        if self.typewriter is None:
+            self.first_text_at = time.perf_counter()
+            self.show_marker()
+            self.typewriter = TypewriterStream()
+        self.typewriter.write(line)
+        self.typewriter.end_line()
+        self.shown[field] = line
+
+    def close(self):
+        if self.typewriter is not None:
+            self.typewriter.close()
+
 class ChoiceLoop:
     def __init__(
         self,
@@ -42,7 +107,7 @@ class ChoiceLoop:
             memory_store,
             current_npc=current_npc,
             current_location=current_location,
-            llm=self.llm,  # Needed for LLM importance rating and reflection
+            llm=self.llm,  # Needed for reflection
         )
         self.prompt_template = _load_prompt_template()
         #Running conversation history passed to the LLM each turn so it remembers what was said this session
@@ -62,6 +127,8 @@ class ChoiceLoop:
             "prompt_tokens": 0,
         }
         self.choice_timer_started_at = None
+        #Pre-generates the next turn for each displayed choice while the player decides
+        self.speculation = SpeculativeTurns() if SPECULATIVE_PREGENERATION else None
 
     def _visible_turn_number(self):
         try:
@@ -139,6 +206,11 @@ class ChoiceLoop:
             return 0.0
         return max(0.0, time.perf_counter() - self.choice_timer_started_at)
 
+    def _show_streamed_turn_marker(self):
+        #Streamed lines come before the response is ready, so their timing gets its own line ahead of them
+        print(f"[First text in {self._elapsed_since_choice():.2f}s]")
+        self._show_turn_marker()
+
     def _show_response_ready(self, timing_meta, errors=None): #SHowing how long it takes for the resposne to be ready + how many Attempts -> IMPORTANT FOR EVAL
         elapsed = float(timing_meta.get("response_ready_seconds", 0.0))
         attempts = 1
@@ -189,12 +261,144 @@ class ChoiceLoop:
             for i, choice in enumerate(self.last_choices, start=1):
                 type_line(f"  {i}. {choice['text']}")
 
+    def close(self):
+        #Waits for background work (turn commits, reflection) so nothing is lost when the session ends
+        if self.speculation is not None:
+            self.speculation.close()
+        try:
+            self.state.flush_background()
+        except RuntimeError as exc:
+            print(f"{exc}: {exc.__cause__}") #Reported here because nothing else will read it once the session is over
+
+    def _plan_turn(self, state, player_choice, messages):
+        """Apply the story rules for player_choice to state, then retrieve memories and build the prompt.
+
+        Takes the state explicitly so the same code plans the live turn and the
+        speculative ones, which run on a snapshot.
+        """
+        timing = {}
+        commit_wait_started_at = time.perf_counter()
+        state.wait_for_commits() #The previous turn's memories must be in the journals before anything is retrieved
+        timing["commit_wait_seconds"] = round(time.perf_counter() - commit_wait_started_at, 3)
+        state.turn += 1
+        state._apply_story_choice_rules(player_choice)
+        closing_turn = state.mission_finished()
+
+        #Get the deterministic story suggestions before building the prompt so they can be injected into the choice list
+        story_suggestions = suggest_story_choices(state.world_state, state.current_npc, state.current_location)
+        forced_choices = forced_story_choices(state.world_state, state.current_npc, state.current_location)
+        required_choice_count = 1 if forced_choices else 2
+        retrieval_started_at = time.perf_counter()
+        memory_summaries, retrieval = _retrieve_memories( #retrieval and prompt building
+            player_choice,
+            memory_store=self.memory_store,
+            current_npc=state.current_npc,
+            current_location=state.current_location,
+            world_state=state.world_state,
+            turn=state.turn,
+            count_tokens=self._safe_token_count,
+            is_fallback_event=self._is_fallback_event,
+        )
+        timing["retrieval_seconds"] = round(time.perf_counter() - retrieval_started_at, 3)
+        arc_state = state._current_arc_state()
+        prompt_started_at = time.perf_counter()
+        prompt_text = _build_prompt(
+            prompt_template=self.prompt_template,
+            prologue_summary=self.prologue_summary,
+            state=state.world_state,
+            player_choice=player_choice,
+            memory_summaries=memory_summaries,
+            arc_state=arc_state,
+            recent_messages=messages,
+            turn=state.turn,
+            known_locations=sorted(set(state._known_location_map().values())),
+            known_quests=sorted(state.world_state.get("active_quests", {}).keys()),
+            story_transition=state.pending_story_narration or "none",
+            required_choice_count=required_choice_count,
+            forced_choices=forced_choices,
+        )
+        timing["prompt_build_seconds"] = round(time.perf_counter() - prompt_started_at, 3)
+        retrieval["prompt_tokens"] = self._safe_token_count(prompt_text)
+        timing["prompt_tokens"] = retrieval["prompt_tokens"]
+        timing["memory_tokens"] = retrieval.get("memory_tokens", 0)
+        return {
+            "player_choice": dict(player_choice),
+            "closing_turn": closing_turn,
+            "story_suggestions": story_suggestions,
+            "forced_choices": forced_choices,
+            "required_choice_count": required_choice_count,
+            "retrieval": retrieval,
+            "arc_state": arc_state,
+            "prompt_text": prompt_text,
+            "timing": timing,
+        }
+
+    def _generate_turn(self, state, turn_plan, last_choices, stop_event=None, on_text=None):
+        #Fills raw_output, parsed_output and errors into turn_plan; OutputValidationExhausted propagates
+        generation_started_at = time.perf_counter()
+        try:
+            turn_plan["raw_output"], turn_plan["parsed_output"], turn_plan["errors"] = _generate_valid_json(
+                self.llm,
+                turn_plan["prompt_text"],
+                current_npc=state.current_npc,
+                current_location=state.current_location,
+                current_player_choice=turn_plan["player_choice"],
+                last_choices=last_choices,
+                story_suggestions=turn_plan["story_suggestions"],
+                forced_choices=turn_plan["forced_choices"],
+                required_choice_count=turn_plan["required_choice_count"],
+                world_state=state.world_state,
+                arc_state=turn_plan["arc_state"],
+                stop_event=stop_event,
+                on_text=on_text,
+            )
+        finally:
+            #How long the generation and validation takes +rounding to 3dp
+            turn_plan["timing"]["generation_validation_seconds"] = round(time.perf_counter() - generation_started_at, 3)
+            #Read straight away, before a reflection or speculative call reuses the model
+            turn_plan["prefix_cache_tokens"] = getattr(self.llm, "last_reused_prefix_tokens", 0)
+        return turn_plan
+
+    def _speculate_turn(self, base_state, messages, last_choices, choice, cancel_event):
+        #Runs on the speculation worker. Any failure just means the live turn is generated normally
+        state = base_state.snapshot()
+        turn_plan = self._plan_turn(state, choice, messages)
+        if cancel_event.is_set():
+            return None
+        try:
+            self._generate_turn(state, turn_plan, last_choices, stop_event=cancel_event)
+        except (GenerationCancelled, OutputValidationExhausted):
+            return None
+        turn_plan["state"] = state
+        return turn_plan
+
+    def _start_speculation(self):
+        if self.speculation is None or not self.last_choices:
+            return
+        base_state = self.state.snapshot()
+        messages = list(self.messages)
+        last_choices = [dict(choice) for choice in self.last_choices]
+        self.speculation.start(
+            last_choices,
+            lambda choice, cancel_event: self._speculate_turn(base_state, messages, last_choices, choice, cancel_event),
+        )
+
+    def _take_speculative_turn(self, player_choice):
+        if self.speculation is None:
+            return None
+        turn_plan = self.speculation.take(player_choice)
+        if turn_plan is None:
+            return None
+        self.state.adopt(turn_plan.pop("state"))
+        return turn_plan
+
     def run(self):
         # print("Dynamic mode enabled. LLM is active.")
         if self.resume_mode:
             self._show_resume_context()
             if self.last_choices:
                 print("Select a choice to continue.")
+                self._start_speculation()
                 player_choice = self._prompt_for_choice()
                 if player_choice is None:
                     return
@@ -211,111 +415,86 @@ class ChoiceLoop:
             player_choice = dict(self.initial_player_choice)
 
         while True:
-            self.state.turn += 1
-            self.state._apply_story_choice_rules(player_choice)
-            self.current_player_choice = dict(player_choice)
-            closing_turn = self.state.mission_finished()
             timing_meta = {
                 "timer_source": self._ensure_choice_timer(),
                 "turn_started_elapsed_seconds": round(self._elapsed_since_choice(), 3),
             }
-
-            #Get the deterministic story suggestions before building the prompt so they can be injected into the choice list
-            story_suggestions = suggest_story_choices(
-                self.state.world_state,
-                self.state.current_npc,
-                self.state.current_location,
-            )
-            forced_choices = forced_story_choices(
-                self.state.world_state,
-                self.state.current_npc,
-                self.state.current_location,
-            )
-            required_choice_count = 1 if forced_choices else 2
-            retrieval_started_at = time.perf_counter()
-            memory_summaries, self.last_retrieval = _retrieve_memories( #retrieval and prompt building
-                player_choice,
-                memory_store=self.memory_store,
-                current_npc=self.state.current_npc,
-                current_location=self.state.current_location,
-                world_state=self.state.world_state,
-                turn=self.state.turn,
-                count_tokens=self._safe_token_count,
-                is_fallback_event=self._is_fallback_event,
-            )
-            timing_meta["retrieval_seconds"] = round(time.perf_counter() - retrieval_started_at, 3)
-            arc_state = self.state._current_arc_state()
-            prompt_started_at = time.perf_counter()
-            prompt_text = _build_prompt(
-                prompt_template=self.prompt_template,
-                prologue_summary=self.prologue_summary,
-                state=self.state.world_state,
-                player_choice=player_choice,
-                memory_summaries=memory_summaries,
-                arc_state=arc_state,
-                recent_messages=self.messages,
-                turn=self.state.turn,
-                known_locations=sorted(set(self.state._known_location_map().values())),
-                known_quests=sorted(self.state.world_state.get("active_quests", {}).keys()),
-                story_transition=self.state.pending_story_narration or "none",
-                required_choice_count=required_choice_count,
-                forced_choices=forced_choices,
-            )
-            timing_meta["prompt_build_seconds"] = round(time.perf_counter() - prompt_started_at, 3)
-            self.last_retrieval["prompt_tokens"] = self._safe_token_count(prompt_text)
-            timing_meta["prompt_tokens"] = self.last_retrieval["prompt_tokens"]
-            timing_meta["memory_tokens"] = self.last_retrieval.get("memory_tokens", 0)
+            turn_plan = self._take_speculative_turn(player_choice)
+            timing_meta["speculative"] = turn_plan is not None
+            if turn_plan is None:
+                turn_plan = self._plan_turn(self.state, player_choice, self.messages)
+            self.current_player_choice = dict(player_choice)
+            self.last_retrieval = turn_plan["retrieval"]
+            closing_turn = turn_plan["closing_turn"]
+            forced_choices = turn_plan["forced_choices"]
+            required_choice_count = turn_plan["required_choice_count"]
+            arc_state = turn_plan["arc_state"]
+            prompt_text = turn_plan["prompt_text"]
+            timing_meta.update(turn_plan["timing"])
 
             print(self._thinking_label())
             timing_meta["thinking_label_seconds"] = round(self._elapsed_since_choice(), 3)
-            generation_started_at = time.perf_counter()
-            try:
-                raw_output, parsed_output, errors = _generate_valid_json(
-                    self.llm,
-                    prompt_text,
-                    current_npc=self.state.current_npc,
-                    current_location=self.state.current_location,
-                    current_player_choice=self.current_player_choice,
-                    last_choices=self.last_choices,
-                    story_suggestions=story_suggestions,
-                    forced_choices=forced_choices,
-                    required_choice_count=required_choice_count,
-                    world_state=self.state.world_state,
-                    arc_state=arc_state,
-                )
-            except OutputValidationExhausted as exc:
-                timing_meta["generation_validation_seconds"] = round(time.perf_counter() - generation_started_at, 3)
-                timing_meta["failure_elapsed_seconds"] = round(self._elapsed_since_choice(), 3)
-                _log_turn(
-                    self.llm,
-                    self.state.turn,
-                    player_choice,
-                    prompt_text,
-                    self.last_retrieval,
-                    exc.last_raw,
-                    None,
-                    False,
-                    exc.errors,
-                    timing_meta=timing_meta,
-                )
-                _log_failure(
-                    self.llm,
-                    self.state.turn,
-                    player_choice,
-                    prompt_text,
-                    self.last_retrieval,
-                    current_npc=self.state.current_npc,
-                    current_location=self.state.current_location,
-                    arc_state=arc_state,
-                    raw_output=exc.last_raw,
-                    errors=exc.errors,
-                    attempts=exc.attempts,
-                    timing_meta=timing_meta,
-                )
-                print("Session ended: model could not produce a valid turn.")
-                return
+            turn_stream = None
+            if "parsed_output" not in turn_plan:
+                if STREAM_TURN_OUTPUT:
+                    turn_stream = TurnStream(
+                        self._show_streamed_turn_marker,
+                        self.state.current_npc,
+                        self.state.pending_story_narration,
+                        check=lambda field, text, speaker: _line_survives_validation(
+                            field,
+                            text,
+                            speaker,
+                            current_npc=self.state.current_npc,
+                            current_player_choice=player_choice,
+                            world_state=self.state.world_state,
+                        ),
+                    )
+                try:
+                    self._generate_turn(
+                        self.state,
+                        turn_plan,
+                        self.last_choices,
+                        on_text=turn_stream.feed if turn_stream else None,
+                    )
+                except OutputValidationExhausted as exc:
+                    timing_meta["generation_validation_seconds"] = turn_plan["timing"]["generation_validation_seconds"]
+                    timing_meta["failure_elapsed_seconds"] = round(self._elapsed_since_choice(), 3)
+                    _log_turn(
+                        self.llm,
+                        self.state.turn,
+                        player_choice,
+                        prompt_text,
+                        self.last_retrieval,
+                        exc.last_raw,
+                        None,
+                        False,
+                        exc.errors,
+                        timing_meta=timing_meta,
+                        prefix_cache_tokens=turn_plan.get("prefix_cache_tokens"),
+                    )
+                    _log_failure(
+                        self.llm,
+                        self.state.turn,
+                        player_choice,
+                        prompt_text,
+                        self.last_retrieval,
+                        current_npc=self.state.current_npc,
+                        current_location=self.state.current_location,
+                        arc_state=arc_state,
+                        raw_output=exc.last_raw,
+                        errors=exc.errors,
+                        attempts=exc.attempts,
+                        timing_meta=timing_meta,
+                    )
+                    print("Session ended: model could not produce a valid turn.")
+                    return
+                finally:
+                    if turn_stream is not None:
+                        turn_stream.close()
 
-            timing_meta["generation_validation_seconds"] = round(time.perf_counter() - generation_started_at, 3) #How long the generation and validation takes +rounding to 3dp
+            timing_meta["generation_validation_seconds"] = turn_plan["timing"]["generation_validation_seconds"]
+            raw_output, parsed_output, errors = turn_plan["raw_output"], turn_plan["parsed_output"], turn_plan["errors"]
             parsed_output = self.state._apply_pending_story_narration(parsed_output)
 
             timing_meta["response_ready_seconds"] = round(self._elapsed_since_choice(), 3)
@@ -331,12 +510,26 @@ class ChoiceLoop:
                     "npc": self.state.current_npc,
                 }
             )
-            self._show_response_ready(timing_meta, errors=errors)
-            self._show_turn_marker()
+            lines = {}
             if parsed_output["narrator"]:
-                type_line(f"Narrator: {parsed_output['narrator']}")
+                lines["narrator"] = f"Narrator: {parsed_output['narrator']}"
             if parsed_output["speaker"] and parsed_output["reply"]:
-                type_line(f"{parsed_output['speaker']}: {parsed_output['reply']}")
+                lines["reply"] = f"{parsed_output['speaker']}: {parsed_output['reply']}"
+            streamed = turn_stream is not None and turn_stream.typewriter is not None
+            if streamed:
+                timing_meta["first_text_seconds"] = round(turn_stream.first_text_at - self.choice_timer_started_at, 3)
+            self._show_response_ready(timing_meta, errors=errors)
+            remaining = list(lines.values())
+            if not streamed:
+                self._show_turn_marker()
+            else:
+                shown = list(turn_stream.shown.values())
+                if shown == remaining[: len(shown)]:
+                    remaining = remaining[len(shown) :] #Type only the lines that were still held back
+                else:
+                    print("[Corrected]") #Validation still changed a streamed line - mark the retyped turn as the real one
+            for line in remaining:
+                type_line(line)
             self.messages.append(
                 {
                     "role": "assistant",
@@ -350,7 +543,10 @@ class ChoiceLoop:
                 type_line(f"  {i}. {choice['text']}")
 
             timing_meta["render_complete_seconds"] = round(self._elapsed_since_choice(), 3)
-            _log_turn(
+            #The log row, state save and memory writes are committed in the background while the player chooses.
+            #State updates stay inline: the next turn's rules and the speculation snapshot start from them
+            self.state.submit_commit(
+                _log_turn,
                 self.llm,
                 self.state.turn,
                 player_choice,
@@ -361,8 +557,8 @@ class ChoiceLoop:
                 True,
                 errors,
                 timing_meta=timing_meta,
+                prefix_cache_tokens=turn_plan.get("prefix_cache_tokens"),
             )
-
             self.state._apply_state_updates(player_choice, parsed_output)
             self.state._persist_turn_memory(player_choice, parsed_output, self.last_retrieval)
 
@@ -374,6 +570,7 @@ class ChoiceLoop:
             if POST_RESPONSE_PAUSE_SECONDS > 0:
                 time.sleep(POST_RESPONSE_PAUSE_SECONDS)
 
+            self._start_speculation()
             player_choice = self._prompt_for_choice()
             if player_choice is None:
                 return
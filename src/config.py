@@ -14,16 +14,36 @@ POST_RESPONSE_PAUSE_SECONDS = 0.2
 PLAYER_CHOICE_SPEAK_SECONDS = 0.2
 
 MAX_JSON_RETRY_ATTEMPTS = 4
+CONSTRAINED_JSON_DECODING = True # mask tokens that would break the turn JSON schema (src/json_grammar.py)
+JSON_CANDIDATES_PER_ATTEMPT = 1 # >1 samples that many turns in one batched generate call and keeps the first valid one
+JSON_LOCAL_REPAIR = True # fix trailing commas, truncation, single quotes, a slipped speaker... before asking the model to regenerate (src/json_repair.py)
+JSON_CONTINUATION_ROUNDS = 2 # times a turn cut off at max_new_tokens is resumed from its KV cache before it counts as a failed attempt
+JSON_CONTINUATION_TOKENS = 64 # new tokens per continuation round
 
 MIN_LLM_CHOICES = 1
 MAX_LLM_CHOICES = 2
 
 MEMORY_RECENT_TURNS = 8
 MEMORY_NPC_TURNS = 20
+MEMORY_ANN_CANDIDATES = 12 # extra candidates pulled from the whole history by the vector index and, when vectors cannot find them (hashing fallback, no or mismatched embeddings), the BM25 keyword index; 0 disables
 MEMORY_TOP_K = 3 # change this between runs: 0, 1, 2, 3, 4, 5
 MEMORY_TOKEN_BUDGET = 350  # was 200 — tighter budget was cutting off useful summaries
+MEMORY_CACHE_ROWS = 256 # newest parsed rows kept in memory per journal file, 0 turns the cache off
+EMBEDDING_ONNX_PATH = Path("models/minilm-int8/model.onnx") # int8 model for LOCAL_EMBEDDING_BACKEND=onnx, written by python -m src.embedder_onnx
+EMBEDDING_HASH_DIM = 256 # width of the dependency-free hashed embeddings (src/embedder_hashing.py)
+EMBEDDING_BATCH_SIZE = 32 # texts per SentenceTransformer.encode batch in embed_many()
+EMBEDDING_CACHE_SIZE = 1024 # sentence embeddings kept in the in-memory LRU, 0 turns it off
+EMBEDDING_DISK_CACHE_DIR = None # e.g. Path("data/embedding_cache"): one .npy per text hash, shared across sessions; None disables
+EMBEDDING_DISK_CACHE_MAX_FILES = 4096 # least recently used .npy files are deleted past this many
 PROMPT_RECENT_MESSAGES = 6
 
+STREAM_TURN_OUTPUT = True # type each narrator/reply line as soon as it is generated and passes the line checks, instead of after the whole turn validates
+SPECULATIVE_PREGENERATION = False # generate the next turn for every displayed choice while the player decides (uses the idle model)
+
+REFLECTION_EVERY_N_TURNS = 5
+REFLECTION_MAX_PENDING = 1 # reflections waiting on the background worker; extra ones are skipped rather than queued
+BACKGROUND_COMMIT = True # write the turn log, state save and memory journals while the player chooses; the next turn waits for them before retrieval
+
 VALID_TIME_OF_DAY = {"dawn", "morning", "noon", "afternoon", "evening", "night"}
 ALLOWED_QUEST_STATUS = {"not_started", "active", "completed", "failed"}
 ALLOWED_ACTION_TYPES = {"ask", "investigate", "travel", "accuse", "reassure", "threaten", "trade", "exit", "resume"}
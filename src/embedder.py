@@ -13,37 +13,309 @@ Model choice — all-MiniLM-L6-v2:
   short dialogue and summary text. Got this idea from
     Reimers & Gurevych (2019) "Sentence-BERT: Sentence Embeddings using
     Siamese BERT-Networks", EMNLP 2019.
+
+Backends (LOCAL_EMBEDDING_BACKEND):
+  torch  sentence-transformers in full precision (default)
+  onnx   the same model exported to ONNX with int8 weights (src/embedder_onnx.py),
+         much lighter on CPU hosts where it shares cores with generation.
+         Falls back to torch if onnxruntime or the exported model is missing.
+  hashing  NumPy feature hashing (src/embedder_hashing.py), no dependencies.
+           Also the last tier when no model backend can be loaded, so scoring
+           keeps a similarity signal in minimal installs.
+
+Caching:
+  The same choice texts and summaries come back turn after turn, and a retry
+  re-embeds the same query.  embed() keeps an LRU of the last
+  EMBEDDING_CACHE_SIZE vectors and, when EMBEDDING_DISK_CACHE_DIR is set, a .npy
+  file per text hash so the cache also survives between sessions.  The disk
+  cache is off by default, keeps at most EMBEDDING_DISK_CACHE_MAX_FILES files
+  (least recently used go first) and is cleared when a new game resets the data.
 """
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
 import numpy as np
 
-_model = None  # Populated on first call to embed()
+from src.config import (
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_DISK_CACHE_DIR,
+    EMBEDDING_DISK_CACHE_MAX_FILES,
+    EMBEDDING_HASH_DIM,
+)
 
-def _get_model():
-    global _model
-    if _model is not None:
-        return _model if _model is not False else None
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_BACKENDS = {"torch", "onnx", "hashing"}
+
+_model = None  # Populated on first call to embed(), or by warm_up()
+_backend = None  # Backend that actually loaded, part of the disk cache key
+_fallback_reason = None  # Why a requested model backend did not load, when the hashing tier took over
+_model_lock = threading.Lock()
+_warmup_started = threading.Event()
+_model_ready = threading.Event()  # set once loading has finished, whether or not it succeeded
+_cache = OrderedDict()  # text -> read-only vector, least recently used first
+_cache_lock = threading.Lock()  # reflections embed from a background thread
+_cache_stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+_disk_files = None  # .npy files in the disk cache, counted on the first write
+
+def _requested_backend():
+    backend = os.getenv("LOCAL_EMBEDDING_BACKEND", "torch").strip().lower() or "torch"
+    return backend if backend in EMBEDDING_BACKENDS else "torch"
 
+def _load_model():
+    global _backend, _fallback_reason
+    requested = _requested_backend()
+    if requested == "onnx":
+        try:
+            from src import embedder_onnx
+            model = embedder_onnx.load()
+            _backend = "onnx"
+            return model
+        except Exception:
+            pass  # no onnxruntime or no exported model - the torch model still works
+    if requested != "hashing":
+        try:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(EMBEDDING_MODEL)
+            _backend = "torch"
+            return model
+        except Exception as exc:
+            # not installed, or the model could not be fetched this time - fall through to hashing
+            _fallback_reason = f"{type(exc).__name__}: {exc}"
     try:
-        from sentence_transformers import SentenceTransformer
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
+        from src.embedder_hashing import HashingEmbedder
+        _backend = "hashing"
+        return HashingEmbedder()
     except Exception:
-        # sentence-transformers not installed — mark unavailable so we don't
-        # retry on every call.  All callers check for None and fall back.
-        _model = False
+        # Mark unavailable so we don't retry on every call.  All callers check for None and fall back.
+        return False
 
+def _ensure_loaded():
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = _load_model()
+    _model_ready.set()
+
+def warm_up():
+    """Start loading the model on a background thread.
+
+    game.py calls this first thing, so the import and model load overlap with
+    LocalLLM.load() and the prologue instead of landing in the first turn's
+    retrieval time.  Calling it again is a no-op.
+    """
+    if _warmup_started.is_set() or _model is not None:
+        return
+    _warmup_started.set()
+    threading.Thread(target=_ensure_loaded, name="embedder-warmup", daemon=True).start()
+
+def _get_model():
+    if _model is None:
+        if _warmup_started.is_set():
+            _model_ready.wait()  # only blocks if the warm-up has not finished yet
+        _ensure_loaded()
     return _model if _model is not False else None
 
 
+def is_available():
+    """True when the embedding model loaded; loads it on first call."""
+    return _get_model() is not None
+
+def embedding_backend():
+    """Backend that loaded ("torch", "onnx" or "hashing"), or None; loads it on first call."""
+    return _backend if _get_model() is not None else None
+
+def embedding_dim():
+    """Width of the vectors embed() returns, or None when no backend loaded."""
+    model = _get_model()
+    if model is None:
+        return None
+    dim = getattr(model, "dim", None)  # HashingEmbedder and the ONNX backend
+    if dim is None and hasattr(model, "get_sentence_embedding_dimension"):
+        dim = model.get_sentence_embedding_dimension()
+    return int(dim) if dim else None
+
+def fallback_reason():
+    """Why the hashing tier stands in for the requested model backend, or None."""
+    return _fallback_reason if embedding_backend() == "hashing" else None
+
+def can_replace_stored(stored_dim):
+    """True when vectors of width stored_dim should be re-embedded with the loaded backend.
+
+    Only an upgrade qualifies: vectors from the hashing tier replaced by a model
+    backend.  The other way round is usually a model that failed to load this time
+    (no network for the HF hub...), and overwriting the stored MiniLM vectors with
+    hashed ones would lose them for every later session.
+    """
+    dim = embedding_dim()
+    return (
+        stored_dim is not None
+        and dim is not None
+        and int(stored_dim) != dim
+        and int(stored_dim) == EMBEDDING_HASH_DIM
+        and embedding_backend() in ("torch", "onnx")
+    )
+
+def _disk_cache_path(text):
+    if not EMBEDDING_DISK_CACHE_DIR:
+        return None
+    # int8 vectors differ slightly from full precision ones, so each backend has its own entries
+    digest = hashlib.sha256(f"{EMBEDDING_MODEL}:{_backend or 'torch'}\n{text}".encode("utf-8")).hexdigest()
+    return Path(EMBEDDING_DISK_CACHE_DIR) / digest[:2] / f"{digest}.npy"
+
+def _load_from_disk(text):
+    path = _disk_cache_path(text)
+    if path is None or not path.exists():
+        return None
+    try:
+        vector = np.load(path)
+        os.utime(path)  # the mtime is the recency used for eviction
+        return vector
+    except Exception:
+        return None
+
+def _disk_cache_files():
+    return list(Path(EMBEDDING_DISK_CACHE_DIR).glob("*/*.npy"))
+
+def _evict_from_disk():
+    # Caller holds _cache_lock.  Drops the least recently used files down to 90% of the cap
+    global _disk_files
+    files = []
+    for path in _disk_cache_files():
+        try:
+            files.append((path.stat().st_mtime, path))
+        except OSError:
+            pass
+    files.sort()
+    keep = int(max(0, EMBEDDING_DISK_CACHE_MAX_FILES) * 0.9)
+    for _, path in files[: max(0, len(files) - keep)]:
+        path.unlink(missing_ok=True)
+    _disk_files = min(len(files), keep)
+
+def _save_to_disk(text, vector):
+    global _disk_files
+    path = _disk_cache_path(text)
+    if path is None:
+        return
+    try:
+        existed = path.exists()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_suffix(".tmp")
+        with temp_path.open("wb") as f:
+            np.save(f, vector)
+        temp_path.replace(path)
+        if existed:
+            return
+        with _cache_lock:
+            _disk_files = len(_disk_cache_files()) if _disk_files is None else _disk_files + 1
+            if _disk_files > EMBEDDING_DISK_CACHE_MAX_FILES:
+                _evict_from_disk()
+    except Exception:
+        pass  # the disk cache is only an optimisation
+
+def clear_disk_cache():
+    """Delete every file in the disk cache, e.g. when a new game resets the saved data."""
+    global _disk_files
+    if not EMBEDDING_DISK_CACHE_DIR:
+        return
+    with _cache_lock:
+        for path in Path(EMBEDDING_DISK_CACHE_DIR).glob("*/*"):
+            path.unlink(missing_ok=True)
+        _disk_files = 0
+
+def _remember(text, vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    vector.flags.writeable = False  # shared between callers
+    with _cache_lock:
+        _cache[text] = vector
+        _cache.move_to_end(text)
+        while len(_cache) > max(0, EMBEDDING_CACHE_SIZE):
+            _cache.popitem(last=False)
+    return vector
+
+def _cached(text):
+    # LRU first, then the disk cache; None means the text has to be encoded
+    with _cache_lock:
+        vector = _cache.get(text)
+        if vector is not None:
+            _cache.move_to_end(text)
+            _cache_stats["hits"] += 1
+            return vector
+    vector = _load_from_disk(text)
+    if vector is None:
+        return None
+    with _cache_lock:
+        _cache_stats["disk_hits"] += 1
+    return _remember(text, vector)
+
+def _store(text, vector):
+    with _cache_lock:
+        _cache_stats["misses"] += 1
+    vector = _remember(text, vector)
+    _save_to_disk(text, vector)
+    return vector
+
 def embed(text):
-    """Return a normalised numpy embedding vector, or None if unavailable."""
+    """Return a normalised numpy embedding vector, or None if unavailable.
+
+    Repeated texts come from the LRU (then the disk cache) instead of a forward pass.
+    The returned array is read-only.
+    """
     model = _get_model()
     if model is None:
         return None
+    text = str(text or "")
+    if not getattr(model, "cacheable", True):
+        return model.encode(text, normalize_embeddings=True)
+    vector = _cached(text)
+    if vector is not None:
+        return vector
     try:
-        return model.encode(str(text or ""), normalize_embeddings=True)
+        return _store(text, model.encode(text, normalize_embeddings=True))
     except Exception:
         return None
 
+def embed_many(texts, batch_size=EMBEDDING_BATCH_SIZE):
+    """Embed several texts at once as a contiguous (len(texts), dim) float32 matrix.
+
+    Cached texts are looked up and the rest go through one batched encode call,
+    which is much cheaper than one call per text.  Returns None if the model is
+    unavailable or encoding fails.
+    """
+    model = _get_model()
+    if model is None:
+        return None
+    texts = [str(text or "") for text in texts]
+    if not getattr(model, "cacheable", True):
+        return np.ascontiguousarray(model.encode(texts, batch_size=batch_size, normalize_embeddings=True), dtype=np.float32)
+    vectors = [_cached(text) for text in texts]
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    if missing:
+        try:
+            encoded = model.encode(missing, batch_size=max(1, int(batch_size)), normalize_embeddings=True)
+        except Exception:
+            return None
+        fresh = {text: _store(text, vector) for text, vector in zip(missing, encoded)}
+        vectors = [fresh[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+    if not vectors:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.ascontiguousarray(np.stack(vectors), dtype=np.float32)
+
+def embed_cache_info():
+    """Hit/miss counters and current size of the in-memory embedding cache."""
+    with _cache_lock:
+        return {**_cache_stats, "size": len(_cache), "max_size": EMBEDDING_CACHE_SIZE}
+
+def clear_embed_cache():
+    with _cache_lock:
+        _cache.clear()
+        for key in _cache_stats:
+            _cache_stats[key] = 0
+
 
 def cosine_similarity(a, b):
     """Cosine similarity between two array-like vectors.  Returns 0.0 on failure.
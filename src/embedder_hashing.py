@@ -0,0 +1,55 @@
+'''
+src/embedder_hashing.py
+
+Dependency-free fallback tier for the sentence embedder.
+
+When neither sentence-transformers nor the ONNX backend is available, texts are
+embedded by feature hashing: every word and every character trigram of a word is
+hashed (crc32, stable across runs, unlike hash()) to one of EMBEDDING_HASH_DIM
+buckets with a +/-1 sign, and the counts are L2-normalised.  It knows nothing about
+meaning, but shared content words and word pieces ("tamper" / "tampered") still give a
+useful cosine, at microseconds per string.
+
+The width differs from MiniLM's 384 on purpose: the memory store only keeps vectors
+of one width, so hashed vectors are never compared against model vectors.
+'''
+
+import zlib
+
+import numpy as np
+
+from src.config import EMBEDDING_HASH_DIM
+from src.keyword_index import _match_term_list
+
+def _features(text):
+    for word in _match_term_list(text): #Stopwords would make every pair of texts look alike
+        yield "w:" + word
+        padded = f"<{word}>"
+        for start in range(len(padded) - 2):
+            yield "c:" + padded[start : start + 3]
+
+class HashingEmbedder:
+    """Same encode() interface as SentenceTransformer, no model to load."""
+
+    cacheable = False  # hashing is cheaper than a cache lookup on disk
+
+    def __init__(self, dim=EMBEDDING_HASH_DIM):
+        self.dim = int(dim)
+
+    def _encode_one(self, text, normalize):
+        hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in _features(text)), dtype=np.uint32)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if hashes.size:
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vector, hashes % self.dim, signs)
+        if normalize:
+            norm = float(np.linalg.norm(vector))
+            if norm:
+                vector /= norm
+        return vector
+
+    def encode(self, texts, normalize_embeddings=True, batch_size=32):
+        if isinstance(texts, str):
+            return self._encode_one(texts, normalize_embeddings)
+        rows = [self._encode_one(text, normalize_embeddings) for text in texts]
+        return np.stack(rows) if rows else np.zeros((0, self.dim), dtype=np.float32)
@@ -0,0 +1,124 @@
+'''
+src/embedder_onnx.py
+
+int8 ONNX backend for the sentence embedder (LOCAL_EMBEDDING_BACKEND=onnx).
+
+The PyTorch MiniLM runs in full precision and competes with generation for CPU
+cores.  This runs the same model exported to ONNX with dynamically quantised
+int8 weights through onnxruntime: a smaller file, faster matmuls, and the same
+mean pooling + L2 normalisation as sentence-transformers, so the vectors stay
+interchangeable with the ones already in the sidecar (see tests/test_embedder_onnx.py
+for the cosine parity check).
+
+Export once with:  python -m src.embedder_onnx
+'''
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from src.config import EMBEDDING_ONNX_PATH
+
+HF_MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+MAX_SEQ_LENGTH = 256 #Same truncation as the sentence-transformers model card
+
+def _mean_pool(token_embeddings, attention_mask, normalize=True):
+    mask = attention_mask[..., None].astype(np.float32)
+    summed = (token_embeddings * mask).sum(axis=1)
+    pooled = summed / np.maximum(mask.sum(axis=1), 1e-9)
+    if normalize:
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        pooled = pooled / np.maximum(norms, 1e-12)
+    return pooled.astype(np.float32)
+
+def _output_width(session):
+    #Hidden size from the last_hidden_state output shape, e.g. ["batch", "sequence", 384]; None when it is symbolic
+    try:
+        width = session.get_outputs()[0].shape[-1]
+    except Exception:
+        return None
+    return width if isinstance(width, int) and width > 0 else None
+
+def _config_width(model_dir):
+    #hidden_size from the config.json export() writes next to the model
+    try:
+        return int(json.loads((Path(model_dir) / "config.json").read_text(encoding="utf-8"))["hidden_size"])
+    except Exception:
+        return None
+
+class OnnxSentenceEmbedder:
+    """Drop-in for SentenceTransformer.encode() over an onnxruntime session."""
+
+    def __init__(self, session, tokenizer, dim=None):
+        self.session = session
+        self.tokenizer = tokenizer
+        self._input_names = {item.name for item in session.get_inputs()}
+        self.dim = dim or _output_width(session) #Read by embedder.embedding_dim() without running the model
+
+    def encode(self, texts, normalize_embeddings=True, batch_size=32):
+        single = isinstance(texts, str)
+        batch = [texts] if single else list(texts)
+        rows = []
+        step = max(1, int(batch_size))
+        for start in range(0, len(batch), step):
+            encoded = self.tokenizer(
+                batch[start : start + step],
+                padding=True,
+                truncation=True,
+                max_length=MAX_SEQ_LENGTH,
+                return_tensors="np",
+            )
+            feeds = {name: np.asarray(value, dtype=np.int64) for name, value in encoded.items() if name in self._input_names}
+            token_embeddings = self.session.run(None, feeds)[0]
+            rows.append(_mean_pool(token_embeddings, feeds["attention_mask"], normalize=normalize_embeddings))
+        matrix = np.concatenate(rows) if rows else np.zeros((0, 0), dtype=np.float32)
+        return matrix[0] if single else matrix
+
+def load(path=EMBEDDING_ONNX_PATH):
+    """Open the exported int8 model.  Raises if onnxruntime or the model file is missing."""
+    import onnxruntime
+    from transformers import AutoTokenizer
+
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"{path} not found. Export it with: python -m src.embedder_onnx")
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = onnxruntime.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+    tokenizer = AutoTokenizer.from_pretrained(str(path.parent)) #export() saves the tokenizer next to the model
+    return OnnxSentenceEmbedder(session, tokenizer, dim=_output_width(session) or _config_width(path.parent))
+
+def export(path=EMBEDDING_ONNX_PATH):
+    """Export MiniLM to ONNX and quantise its weights to int8.  Needs torch + onnxruntime."""
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(HF_MODEL_ID)
+    model = AutoModel.from_pretrained(HF_MODEL_ID).eval()
+    sample = tokenizer(["warm up"], return_tensors="pt")
+    fp32_path = path.with_name(path.stem + "-fp32.onnx")
+    axes = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            str(fp32_path),
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={"input_ids": axes, "attention_mask": axes, "token_type_ids": axes, "last_hidden_state": axes},
+            opset_version=17,
+        )
+    quantize_dynamic(str(fp32_path), str(path), weight_type=QuantType.QInt8)
+    fp32_path.unlink(missing_ok=True)
+    tokenizer.save_pretrained(str(path.parent))
+    model.config.save_pretrained(str(path.parent)) #hidden_size, in case the output width is symbolic
+    return path
+
+if __name__ == "__main__":
+    target = Path(sys.argv[1]) if len(sys.argv) > 1 else EMBEDDING_ONNX_PATH
+    print(f"Wrote {export(target)}")
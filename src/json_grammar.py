@@ -0,0 +1,568 @@
+'''
+src/json_grammar.py
+
+Grammar-constrained decoding for the turn JSON.
+Instead of hoping the LLM writes valid JSON and retrying when it doesnt, the logits
+processor here masks out every token that would break the schema, so the model can
+only ever produce a structurally valid object (the validator still checks the content).
+
+The grammar is a small pushdown automaton over characters driven by a subset of JSON
+Schema: object (properties in order, required), string (minLength/maxLength),
+const, enum, array (items/minItems/maxItems) and integer (minimum/maximum).
+'''
+
+from src.config import ALLOWED_ACTION_TYPES, ALLOWED_EVENT_TYPES, MAX_LLM_CHOICES, VALID_TIME_OF_DAY
+
+GRAMMAR_TOP_K = 32 #How many of the most likely tokens get checked against the grammar first
+GRAMMAR_FALLBACK_SCAN = 2048 #How far down the ranking the fallback looks before dropping to single-character tokens
+CHARS_PER_TOKEN = 4 #Rough English BPE rate, used to fit the string limits to a token budget
+SCHEMA_OVERHEAD_TOKENS = 40 #Keys, quotes, brackets, speaker and importance
+CHOICE_OVERHEAD_TOKENS = 20 #Keys, punctuation and action_type of one choice
+MIN_FIELD_CHARS = {"narrator": 40, "reply": 40, "id": 12, "text": 24, "memory_summary": 40}
+WHITESPACE = " \t\n\r"
+DIGITS = "0123456789"
+HEX_DIGITS = "0123456789abcdefABCDEF"
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+def _string_limits(count, max_new_tokens):
+    """maxLength per free-text field, scaled down so a full turn fits in max_new_tokens.
+
+    A limit the token budget cannot reach is useless: the model writes into it, hits
+    max_new_tokens mid-object and the turn is continued or regenerated.  Without a
+    budget the plain limits apply.
+    """
+    limits = {"narrator": 200, "reply": 200, "id": 60, "text": 160, "memory_summary": 240, "tag": 40, "tags": 6}
+    if not max_new_tokens:
+        return limits
+    text_tokens = int(max_new_tokens) - SCHEMA_OVERHEAD_TOKENS - CHOICE_OVERHEAD_TOKENS * count
+    total_chars = limits["narrator"] + limits["reply"] + limits["memory_summary"] + count * (limits["id"] + limits["text"])
+    scale = max(0, text_tokens) * CHARS_PER_TOKEN / total_chars
+    if scale >= 1:
+        return limits
+    for field, floor in MIN_FIELD_CHARS.items():
+        limits[field] = max(floor, int(limits[field] * scale))
+    limits["tags"] = 0 #Optional, and the validator derives them when they are missing
+    return limits
+
+def build_turn_schema(current_npc, required_choice_count=MAX_LLM_CHOICES, max_new_tokens=None):
+    #Same keys as prompts/prompt_v1.txt, with the speaker pinned to the active NPC
+    npc = str(current_npc or "").strip()
+    count = max(1, min(MAX_LLM_CHOICES, int(required_choice_count or 1)))
+    limits = _string_limits(count, max_new_tokens)
+    speaker = {"const": npc} if npc else {"type": "string", "minLength": 1, "maxLength": 40}
+    return {
+        "type": "object",
+        "properties": {
+            "narrator": {"type": "string", "maxLength": limits["narrator"]},
+            "speaker": speaker,
+            "reply": {"type": "string", "minLength": 1, "maxLength": limits["reply"]},
+            "choices": {
+                "type": "array",
+                "minItems": count,
+                "maxItems": count,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string", "minLength": 1, "maxLength": limits["id"]},
+                        "text": {"type": "string", "minLength": 1, "maxLength": limits["text"]},
+                        "action_type": {"enum": sorted(ALLOWED_ACTION_TYPES)},
+                    },
+                    "required": ["id", "text", "action_type"],
+                },
+            },
+            "state_updates": {
+                "type": "object",
+                "properties": {
+                    "time_of_day": {"enum": sorted(VALID_TIME_OF_DAY)},
+                    "day": {"type": "integer", "minimum": 1, "maximum": 999},
+                },
+                "required": [],
+            },
+            "memory_summary": {"type": "string", "maxLength": limits["memory_summary"]},
+            "importance": {"type": "integer", "minimum": 1, "maximum": 10},
+            #Optional extras the validator understands, kept so the retry skeleton is still reachable
+            "event_type": {"enum": sorted(ALLOWED_EVENT_TYPES)},
+            "tags": {"type": "array", "minItems": 0, "maxItems": limits["tags"], "items": {"type": "string", "minLength": 1, "maxLength": limits["tag"]}},
+        },
+        "required": ["narrator", "speaker", "reply", "choices", "state_updates", "memory_summary", "importance"],
+    }
+
+class _Node:
+    __slots__ = ("kind", "values", "min_len", "max_len", "props", "key_options", "can_close", "items", "min_items", "max_items", "minimum", "maximum")
+
+def _compile(schema):
+    node = _Node()
+    if "const" in schema or "enum" in schema:
+        node.kind = "choice"
+        node.values = (str(schema["const"]),) if "const" in schema else tuple(str(v) for v in schema["enum"])
+        return node
+
+    kind = schema.get("type")
+    node.kind = kind
+    if kind == "string":
+        node.min_len = int(schema.get("minLength", 0))
+        node.max_len = int(schema.get("maxLength", 10_000))
+    elif kind == "integer":
+        node.minimum = max(0, int(schema.get("minimum", 0))) #Negative numbers are never needed here
+        node.maximum = int(schema.get("maximum", 10**9))
+    elif kind == "array":
+        node.items = _compile(schema.get("items", {"type": "string"}))
+        node.min_items = int(schema.get("minItems", 0))
+        node.max_items = int(schema.get("maxItems", 10**6))
+    elif kind == "object":
+        names = list(schema.get("properties", {}).keys())
+        required = set(schema.get("required", []))
+        node.props = tuple((name, _compile(schema["properties"][name])) for name in names)
+        #Keys must appear in schema order. From position i the model may write any key up to (and including) the next required one
+        key_options = []
+        can_close = []
+        for start in range(len(names) + 1):
+            options = []
+            for index in range(start, len(names)):
+                options.append((index, names[index]))
+                if names[index] in required:
+                    break
+            key_options.append(tuple(options))
+            can_close.append(not any(name in required for name in names[start:]))
+        node.key_options = tuple(key_options)
+        node.can_close = tuple(can_close)
+    else:
+        raise ValueError(f"Unsupported schema node: {schema}")
+    return node
+
+def _open(node, ch):
+    #Frame for a value of this node that starts with ch, or None
+    if node.kind in ("string", "choice"):
+        return ("string", node, "", False) if ch == '"' else None
+    if node.kind == "object":
+        return ("object", node, 0, "open", -1) if ch == "{" else None
+    if node.kind == "array":
+        return ("array", node, 0, "open") if ch == "[" else None
+    if node.kind == "integer" and ch in DIGITS and _integer_reachable(node, ch):
+        return ("integer", node, ch)
+    return None
+
+def _integer_reachable(node, digits):
+    #True when some integer in [minimum, maximum] is written starting with these digits
+    if digits.startswith("0"):
+        return digits == "0" and node.minimum == 0 #No leading zeros, so "0" can only ever be 0
+    low = int(digits)
+    width = 1
+    while low <= node.maximum:
+        if low + width - 1 >= node.minimum:
+            return True
+        low *= 10
+        width *= 10
+    return False
+
+def _finish(stack):
+    #A child value just closed - move the parent container on to its next position
+    if not stack:
+        return stack
+    parent = stack[-1]
+    if parent[0] == "object":
+        return stack[:-1] + (("object", parent[1], parent[4] + 1, "next", parent[4]),)
+    if parent[0] == "array":
+        return stack[:-1] + (("array", parent[1], parent[2] + 1, "next"),)
+    return stack
+
+def _string_char(rest, node, text, ch):
+    new_text = text + ch
+    if node.kind == "string":
+        if len(new_text) > node.max_len:
+            return None
+    elif not any(value.startswith(new_text) for value in node.values):
+        return None
+    return rest + (("string", node, new_text, False),)
+
+def _step(stack, ch):
+    if not stack:
+        #Top-level object is complete, only trailing whitespace is allowed
+        return stack if ch in WHITESPACE else None
+
+    frame = stack[-1]
+    kind = frame[0]
+    rest = stack[:-1]
+
+    if kind == "value":
+        if ch in WHITESPACE:
+            return stack
+        opened = _open(frame[1], ch)
+        return None if opened is None else rest + (opened,)
+
+    if kind == "string":
+        _, node, text, escaped = frame
+        if isinstance(escaped, str):
+            #Inside \uXXXX - escaped holds "u" plus the hex digits read so far
+            if ch not in HEX_DIGITS:
+                return None
+            if len(escaped) < 4:
+                return rest + (("string", node, text, escaped + ch),)
+            return _string_char(rest, node, text, chr(int(escaped[1:] + ch, 16)))
+        if escaped:
+            if ch == "u":
+                return rest + (("string", node, text, "u"),)
+            decoded = ESCAPES.get(ch)
+            return None if decoded is None else _string_char(rest, node, text, decoded)
+        if ch == "\\":
+            return rest + (("string", node, text, True),) if node.kind == "string" else None
+        if ch == '"':
+            if node.kind == "string" and len(text) < node.min_len:
+                return None
+            if node.kind == "choice" and text not in node.values:
+                return None
+            return _finish(rest)
+        if ord(ch) < 0x20:
+            return None
+        return _string_char(rest, node, text, ch)
+
+    if kind == "key":
+        _, options, text = frame
+        if ch == '"':
+            parent = rest[-1]
+            for index, name in options:
+                if name == text:
+                    return rest[:-1] + (("object", parent[1], parent[2], "colon", index),)
+            return None
+        new_text = text + ch
+        if any(name.startswith(new_text) for _, name in options):
+            return rest + (("key", options, new_text),)
+        return None
+
+    if kind == "object":
+        _, node, next_index, phase, key_index = frame
+        if ch in WHITESPACE:
+            return stack
+        if phase in ("open", "key"):
+            if ch == '"' and node.key_options[next_index]:
+                return stack + (("key", node.key_options[next_index], ""),)
+            if ch == "}" and phase == "open" and node.can_close[next_index]:
+                return _finish(rest)
+            return None
+        if phase == "colon":
+            if ch == ":":
+                return rest + (("object", node, next_index, "value", key_index), ("value", node.props[key_index][1]))
+            return None
+        if phase == "next":
+            if ch == "," and node.key_options[next_index]:
+                return rest + (("object", node, next_index, "key", key_index),)
+            if ch == "}" and node.can_close[next_index]:
+                return _finish(rest)
+        return None
+
+    if kind == "array":
+        _, node, count, phase = frame
+        if ch in WHITESPACE:
+            return stack
+        if phase == "open":
+            if ch == "]":
+                return _finish(rest) if node.min_items == 0 else None
+            if node.max_items == 0:
+                return None
+            return _step(rest + (("array", node, 0, "value"), ("value", node.items)), ch)
+        if phase == "next":
+            if ch == "," and count < node.max_items:
+                return rest + (("array", node, count, "value"), ("value", node.items))
+            if ch == "]" and count >= node.min_items:
+                return _finish(rest)
+        return None
+
+    if kind == "integer":
+        _, node, digits = frame
+        if ch in DIGITS:
+            if not _integer_reachable(node, digits + ch):
+                return None
+            return rest + (("integer", node, digits + ch),)
+        if int(digits) < node.minimum:
+            return None
+        #Numbers have no closing character, so the one that ends them is handed back to the parent
+        return _step(_finish(rest), ch)
+
+    return None
+
+class JsonGrammar:
+    """Character-level automaton for one schema.
+
+    States are immutable tuples, so checking a candidate token is just advancing a
+    copy of the state and seeing whether it survives.  An empty tuple means the
+    top-level value is complete.
+    """
+
+    def __init__(self, schema):
+        self.root = _compile(schema)
+
+    def initial_state(self):
+        return (("value", self.root),)
+
+    def advance(self, state, text):
+        for ch in text:
+            state = _step(state, ch)
+            if state is None:
+                return None
+        return state
+
+    @staticmethod
+    def is_complete(state):
+        return state == ()
+
+    def accepts(self, text):
+        state = self.advance(self.initial_state(), text)
+        return state is not None and self.is_complete(state)
+
+class JsonSchemaLogitsProcessor:
+    """Masks logits so each sampled token keeps the output a valid prefix of the schema.
+
+    token_texts[i] is the decoded text of token i, or None for special/partial tokens
+    that can never be written.  Once the object is complete only EOS is allowed.
+    """
+
+    def __init__(self, grammar, token_texts, eos_token_ids, top_k=GRAMMAR_TOP_K):
+        self.grammar = grammar
+        self.token_texts = token_texts
+        self.eos_token_ids = [int(token_id) for token_id in eos_token_ids if token_id is not None]
+        self.top_k = top_k
+        self.states = None
+        self._char_tokens = None
+
+    def _token_text(self, token_id):
+        if 0 <= token_id < len(self.token_texts):
+            return self.token_texts[token_id]
+        return None
+
+    def _advance_row(self, state, token_id):
+        if state is None or self.grammar.is_complete(state):
+            return state
+        text = self._token_text(token_id)
+        if not text:
+            return None #Something outside the grammar got through (e.g. a forced token) - stop constraining this row
+        return self.grammar.advance(state, text)
+
+    def _allowed_tokens(self, state, row_scores):
+        allowed = []
+        for token_id in row_scores.topk(min(self.top_k, row_scores.shape[-1])).indices.tolist():
+            text = self._token_text(token_id)
+            if text and self.grammar.advance(state, text) is not None:
+                allowed.append(token_id)
+        if allowed:
+            return allowed
+
+        #Nothing likely fits (e.g. the model wants a markdown fence) - look further down the ranking, but not the whole vocab
+        scan = min(GRAMMAR_FALLBACK_SCAN, row_scores.shape[-1])
+        for token_id in row_scores.topk(scan).indices.tolist()[self.top_k :]:
+            text = self._token_text(token_id)
+            if text and self.grammar.advance(state, text) is not None:
+                allowed.append(token_id)
+                if len(allowed) >= self.top_k:
+                    break
+        return allowed or self._single_char_tokens(state)
+
+    def _single_char_tokens(self, state):
+        #The grammar moves one character at a time, so whatever comes next starts with a one-character token
+        if self._char_tokens is None:
+            self._char_tokens = {}
+            for token_id, text in enumerate(self.token_texts):
+                if text and len(text) == 1 and text not in self._char_tokens:
+                    self._char_tokens[text] = token_id
+        return [token_id for text, token_id in self._char_tokens.items() if self.grammar.advance(state, text) is not None]
+
+    def __call__(self, input_ids, scores):
+        batch_size = input_ids.shape[0]
+        if self.states is None:
+            self.states = [self.grammar.initial_state() for _ in range(batch_size)]
+        else:
+            last_tokens = input_ids[:, -1].tolist()
+            self.states = [self._advance_row(state, token_id) for state, token_id in zip(self.states, last_tokens)]
+
+        mask = scores.new_full(scores.shape, float("-inf"))
+        for row, state in enumerate(self.states):
+            if state is None:
+                mask[row] = 0.0
+            elif self.grammar.is_complete(state):
+                mask[row, self.eos_token_ids] = 0.0
+            else:
+                allowed = self._allowed_tokens(state, scores[row])
+                if allowed:
+                    mask[row, allowed] = 0.0
+                else:
+                    mask[row] = 0.0
+        return scores + mask
+
+    def resume_from(self, completion_ids):
+        #Continuing an earlier generation: replay its tokens so the grammar picks up where it stopped.
+        #The last one is left out because the first call advances over input_ids[:, -1] as usual
+        state = self.grammar.initial_state()
+        for token_id in list(completion_ids)[:-1]:
+            state = self._advance_row(state, int(token_id))
+        self.states = [state]
+        return self
+
+class JsonObjectTracker:
+    """Follows brace depth and string state over streamed text.
+
+    complete becomes True the moment the first top-level object closes.  Text before
+    the first '{' (prose, a markdown fence) is ignored, and braces inside strings
+    are not counted.
+    """
+
+    def __init__(self):
+        self.started = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.complete = False
+
+    def feed(self, text):
+        for ch in text:
+            if self.complete:
+                break
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == "{":
+                self.started = True
+                self.depth += 1
+            elif not self.started:
+                continue
+            elif ch == '"':
+                self.in_string = True
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+        return self.complete
+
+class JsonFieldStreamer:
+    """Pulls top-level string values out of JSON text while it is still being generated.
+
+    feed() takes text chunks as tokens arrive.  For every key in fields,
+    on_start(key) fires when its string value opens, on_text(key, text) for each
+    decoded piece (escapes resolved) and on_end(key) when it closes, so a renderer
+    can start typing the narrator line long before the object is complete.  Every
+    finished top-level string ends up in values, e.g. values["speaker"].
+    """
+
+    def __init__(self, fields, on_start=None, on_text=None, on_end=None):
+        self.fields = set(fields)
+        self.on_start = on_start
+        self.on_text = on_text
+        self.on_end = on_end
+        self.values = {}
+        self.depth = 0
+        self.in_string = False
+        self.escape = None #None outside an escape, "" right after a backslash, "u..." while reading \uXXXX
+        self.high_surrogate = None
+        self.role = None #"key" or "value" for a string directly inside the top-level object
+        self.key = None
+        self.expect = "key"
+        self.buffer = []
+        self.complete = False
+
+    def feed(self, text):
+        for ch in text:
+            if self.complete:
+                break
+            if self.in_string:
+                self._string_char(ch)
+            elif self.depth == 0:
+                if ch == "{": #Anything before the object (prose, a markdown fence) is ignored
+                    self.depth = 1
+                    self.expect = "key"
+            elif ch == '"':
+                self.in_string = True
+                self.buffer = []
+                self.role = None
+                if self.depth == 1:
+                    self.role = "key" if self.expect == "key" else "value"
+                    if self.role == "value" and self.key in self.fields and self.on_start:
+                        self.on_start(self.key)
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                self.complete = self.depth == 0
+            elif self.depth == 1 and ch == ":":
+                self.expect = "value"
+            elif self.depth == 1 and ch == ",":
+                self.expect = "key"
+        return self.complete
+
+    def _string_char(self, ch):
+        if self.escape is not None:
+            if self.escape.startswith("u"):
+                self.escape += ch
+                if len(self.escape) == 5:
+                    hex_digits, self.escape = self.escape[1:], None
+                    try:
+                        self._emit_code_point(int(hex_digits, 16))
+                    except ValueError:
+                        pass
+            elif ch == "u":
+                self.escape = "u"
+            else:
+                self.escape = None
+                self._emit(ESCAPES.get(ch, ch))
+            return
+        if ch == "\\":
+            self.escape = ""
+        elif ch == '"':
+            self.in_string = False
+            if self.role == "key":
+                self.key = "".join(self.buffer)
+            elif self.role == "value":
+                self.values[self.key] = "".join(self.buffer)
+                if self.key in self.fields and self.on_end:
+                    self.on_end(self.key)
+            self.role = None
+        else:
+            self._emit(ch)
+
+    def _emit_code_point(self, code_point):
+        #Characters outside the BMP arrive as a surrogate pair of \u escapes
+        if 0xD800 <= code_point <= 0xDBFF:
+            self.high_surrogate = code_point
+            return
+        if 0xDC00 <= code_point <= 0xDFFF and self.high_surrogate is not None:
+            code_point = 0x10000 + ((self.high_surrogate - 0xD800) << 10) + (code_point - 0xDC00)
+        self.high_surrogate = None
+        if not 0xD800 <= code_point <= 0xDFFF:
+            self._emit(chr(code_point))
+
+    def _emit(self, text):
+        if self.role is None:
+            return
+        self.buffer.append(text)
+        if self.role == "value" and self.key in self.fields and self.on_text:
+            self.on_text(self.key, text)
+
+class JsonObjectStoppingCriteria:
+    #Stops each sequence as soon as its outer JSON object is closed instead of decoding on to max_new_tokens
+    def __init__(self, token_texts):
+        self.token_texts = token_texts
+        self.trackers = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        batch_size = input_ids.shape[0]
+        if self.trackers is None:
+            self.trackers = [JsonObjectTracker() for _ in range(batch_size)]
+        done = input_ids.new_zeros(batch_size).bool()
+        for row, token_id in enumerate(input_ids[:, -1].tolist()):
+            tracker = self.trackers[row]
+            if not tracker.complete and 0 <= token_id < len(self.token_texts) and self.token_texts[token_id]:
+                tracker.feed(self.token_texts[token_id])
+            if tracker.complete:
+                done[row] = True
+        return done
+
+    def resume_from(self, completion_ids):
+        #Continuing an earlier generation: the tracker has to have seen the text already written
+        tracker = JsonObjectTracker()
+        for token_id in completion_ids:
+            token_id = int(token_id)
+            if 0 <= token_id < len(self.token_texts) and self.token_texts[token_id]:
+                tracker.feed(self.token_texts[token_id])
+        self.trackers = [tracker]
+        return self
@@ -0,0 +1,252 @@
+'''
+src/json_repair.py
+
+Cheap local repairs for turn JSON that almost validates.
+
+A lot of rejected outputs are one mechanical slip away from valid: a trailing
+comma, Python-style single quotes, an object cut off at max_new_tokens between
+two fields, or the speaker written as "eli".  Regenerating costs a full prompt prefill
+plus decoding, so these are fixed here first and regeneration is left for output
+that is wrong in substance (wrong voice, repeated reply, scene drift...).
+
+Every fix returns the names of the repairs that fired so they end up in the turn
+log as json_local_repair_<name>.
+'''
+
+import json
+import re
+
+FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)(?:```|$)", re.DOTALL | re.IGNORECASE)
+PLACEHOLDER_SPEAKERS = {"npc"} #A label rather than a voice. "Alex" or "narrator" means the reply is in the wrong voice and is regenerated
+PLAYER_FACING_FIELDS = {"narrator", "reply", "text"} #Shown to the player, so never closed half-way through a sentence
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSERS = {"{": "}", "[": "]"}
+
+def _scan(text):
+    """Walk text outside of string literals.
+
+    Returns (open brackets still on the stack, offset of the opening quote when it
+    ends inside a string or None, offsets of the commas between members).
+    """
+    stack = []
+    commas = []
+    in_string = False
+    string_start = None
+    escaped = False
+    for index, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+            string_start = index
+        elif ch in CLOSERS:
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+        elif ch == ",":
+            commas.append(index)
+    return stack, string_start if in_string else None, commas
+
+def _key_of_value(text, quote_index):
+    #The key whose value starts at quote_index ("reply" in '"reply": "...'), or None for keys and array items
+    match = re.search(r'"((?:[^"\\]|\\.)*)"\s*:\s*$', text[:quote_index])
+    return match.group(1) if match else None
+
+def _loads(text):
+    try:
+        return json.loads(text)
+    except Exception:
+        return None
+
+def _strip_fences(text):
+    match = FENCE_PATTERN.search(text)
+    if not match:
+        return text, False
+    return match.group(1).strip(), True
+
+def _rewrite_outside_strings(text):
+    #Splits text into (chunk, is_string) pieces so the fixes below never touch text inside a string value
+    pieces = []
+    start = 0
+    in_string = False
+    escaped = False
+    for index, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                pieces.append((text[start : index + 1], True))
+                start = index + 1
+                in_string = False
+        elif ch == '"':
+            pieces.append((text[start:index], False))
+            start = index
+            in_string = True
+    pieces.append((text[start:], in_string))
+    return pieces
+
+def _remove_trailing_commas(text):
+    pieces = _rewrite_outside_strings(text)
+    fixed = "".join(chunk if is_string else re.sub(r",(\s*[}\]])", r"\1", chunk) for chunk, is_string in pieces)
+    return fixed, fixed != text
+
+def _replace_python_literals(text):
+    pattern = re.compile(r"\b(True|False|None)\b")
+    pieces = _rewrite_outside_strings(text)
+    fixed = "".join(chunk if is_string else pattern.sub(lambda m: PYTHON_LITERALS[m.group(1)], chunk) for chunk, is_string in pieces)
+    return fixed, fixed != text
+
+def _convert_single_quotes(text):
+    #'key': 'value' -> "key": "value", escaping any double quote inside the old string
+    if "'" not in text:
+        return text, False
+    out = []
+    quote = None
+    escaped = False
+    for ch in text:
+        if quote is None:
+            if ch in "\"'":
+                quote = ch
+                ch = '"'
+        elif escaped:
+            escaped = False
+            if quote == "'" and ch == "'":
+                out[-1] = "'" #\' needs no escape once the string is double-quoted
+                continue
+        elif ch == "\\":
+            escaped = True
+        elif ch == quote:
+            quote = None
+            ch = '"'
+        elif ch == '"' and quote == "'":
+            ch = '\\"'
+        out.append(ch)
+    fixed = "".join(out)
+    return fixed, fixed != text
+
+def _close_truncated(text):
+    """Close an object cut off mid-way, dropping the last member if it is incomplete.
+
+    Tries the text as it stands (closing an open string first), then cuts back
+    one member at a time until the closed object parses.  A narrator, reply or
+    choice text cut mid-sentence is dropped rather than closed, so the player never
+    sees half a line - validation then fills or regenerates it.
+    """
+    stack, string_start, commas = _scan(text)
+    if not stack and string_start is None:
+        return None
+    cuts = [text[:index] for index in reversed(commas)]
+    if string_start is None:
+        cuts.insert(0, text)
+    elif _key_of_value(text, string_start) not in PLAYER_FACING_FIELDS:
+        head = text
+        trailing_backslashes = len(head) - len(head.rstrip("\\"))
+        if trailing_backslashes % 2:
+            head = head[:-1] #Cut inside an escape sequence
+        cuts.insert(0, head + '"')
+    for cut in cuts:
+        cut = cut.rstrip().rstrip(",")
+        open_brackets, open_string, _ = _scan(cut)
+        if open_string is not None:
+            continue
+        parsed = _loads(cut + "".join(CLOSERS[bracket] for bracket in reversed(open_brackets)))
+        if isinstance(parsed, dict):
+            return parsed
+    return None
+
+def _repair_json_text(raw_text):
+    """Parse raw model output that json.loads rejects.  Returns (object or None, repairs)."""
+    text = str(raw_text or "").strip()
+    repairs = []
+    text, fenced = _strip_fences(text)
+    if fenced:
+        repairs.append("markdown_fence")
+    start = text.find("{")
+    if start == -1:
+        return None, []
+    if start > 0:
+        repairs.append("leading_text")
+    text = text[start:]
+
+    for name, fix in (
+        ("trailing_comma", _remove_trailing_commas),
+        ("single_quotes", _convert_single_quotes),
+        ("python_literals", _replace_python_literals),
+    ):
+        parsed = _loads(text)
+        if isinstance(parsed, dict):
+            return parsed, repairs
+        fixed, changed = fix(text)
+        if changed:
+            text = fixed
+            repairs.append(name)
+
+    parsed = _loads(text)
+    if isinstance(parsed, dict):
+        return parsed, repairs
+    #Text after the object (the model kept talking) - keep only the first complete object
+    try:
+        decoded, _ = json.JSONDecoder().raw_decode(text)
+    except Exception:
+        decoded = None
+    if isinstance(decoded, dict):
+        return decoded, repairs + ["trailing_text"]
+    parsed = _close_truncated(text)
+    if parsed is None:
+        return None, []
+    return parsed, repairs + ["closed_truncated_object"]
+
+def _repair_turn_fields(parsed, current_npc):
+    """Field-level fixes applied in place before validation.  Returns the repairs that fired."""
+    if not isinstance(parsed, dict):
+        return []
+    repairs = []
+    active_npc = str(current_npc or "").strip()
+
+    speaker = parsed.get("speaker")
+    speaker_text = " ".join(str(speaker or "").split())
+    if active_npc and speaker != active_npc:
+        low = speaker_text.lower()
+        #Only obvious slips: blank, a placeholder, other casing, or the name with extra words ("Eli the courier").
+        #The player's or another NPC's name means the reply is in the wrong voice, which only a regeneration fixes
+        if not low or low in PLACEHOLDER_SPEAKERS or low.split()[0].strip(",:") == active_npc.lower():
+            parsed["speaker"] = active_npc
+            repairs.append("speaker")
+
+    reply = parsed.get("reply")
+    if isinstance(reply, str) and active_npc:
+        prefix = re.match(rf"\s*{re.escape(active_npc)}\s*:\s*", reply, re.IGNORECASE)
+        if prefix and reply[prefix.end() :].strip():
+            parsed["reply"] = reply[prefix.end() :]
+            repairs.append("reply_speaker_prefix")
+
+    if parsed.get("narrator") is None and "narrator" in parsed:
+        parsed["narrator"] = ""
+        repairs.append("narrator_null")
+
+    choices = parsed.get("choices")
+    if isinstance(choices, dict):
+        parsed["choices"] = [choices]
+        repairs.append("choices_object")
+
+    importance = parsed.get("importance")
+    if isinstance(importance, str) and importance.strip().isdigit():
+        parsed["importance"] = int(importance.strip())
+        repairs.append("importance_string")
+    elif isinstance(importance, float) and not isinstance(importance, bool):
+        parsed["importance"] = int(round(importance))
+        repairs.append("importance_float")
+
+    updates = parsed.get("state_updates")
+    if isinstance(updates, dict) and isinstance(updates.get("day"), str) and updates["day"].strip().isdigit():
+        updates["day"] = int(updates["day"].strip())
+        repairs.append("state_updates_day")
+    return repairs
@@ -0,0 +1,166 @@
+'''
+src/keyword_index.py
+
+Inverted keyword index over every journal event, for lexical retrieval when no
+embedding model is available.
+
+Each event's match terms (tags, summary, reply, choice text and id) are counted once
+when the row is written and filed under term -> {event_id: term frequency} posting
+lists.  A query is then a walk over the posting lists of its own terms, ranked with
+BM25, instead of re-tokenising every candidate on every turn.
+
+File (next to the journals):
+  keywords.jsonl   one row per event: event_id, journal, byte offset and term counts
+'''
+
+import json
+import math
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+
+from src.config import STOPWORDS
+
+KEYWORD_INDEX_FILE = "keywords.jsonl"
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def _match_term_list(text): #Same filter as the retriever's tokenizer, but keeping repeats for term frequency
+    return [
+        token
+        for token in re.findall(r"[a-z0-9_]+", str(text or "").lower())
+        if len(token) >= 3 and token not in STOPWORDS
+    ]
+
+def _event_term_counts(event):
+    counts = Counter()
+    for raw_tag in event.get("tags", []) or []:
+        counts.update(_match_term_list(raw_tag))
+    counts.update(
+        _match_term_list(
+            " ".join(
+                [
+                    str(event.get("memory_summary", "")),
+                    str(event.get("reply", "")),
+                    str(event.get("choice_text", "")),
+                    str(event.get("choice_id", "")),
+                ]
+            )
+        )
+    )
+    return counts
+
+class KeywordIndex:
+    def __init__(self, root):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.postings = {} #term -> {event_id: term frequency}
+        self.locations = {} #event_id -> (journal filename, byte offset)
+        self.lengths = {} #event_id -> number of match terms
+        self._total_length = 0
+
+    @property
+    def path(self):
+        return self.root / KEYWORD_INDEX_FILE
+
+    def _file(self, event_id, journal, offset, counts):
+        self.locations[event_id] = (journal, offset)
+        length = sum(counts.values())
+        self.lengths[event_id] = length
+        self._total_length += length
+        for term, frequency in counts.items():
+            self.postings.setdefault(term, {})[event_id] = frequency
+
+    def _clear(self):
+        self.postings = {}
+        self.locations = {}
+        self.lengths = {}
+        self._total_length = 0
+
+    def load(self):
+        """Read keywords.jsonl into memory.  Returns False when there is no index file yet."""
+        with self._lock:
+            self._loaded = True
+            self._clear()
+            if not self.path.exists():
+                return False
+            with self.path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                        event_id = str(row["event_id"])
+                        location = (str(row["journal"]), int(row["offset"]))
+                        counts = {str(term): int(count) for term, count in row["terms"].items()}
+                    except Exception:
+                        continue
+                    if event_id not in self.locations:
+                        self._file(event_id, *location, counts)
+            return True
+
+    def is_loaded(self):
+        return self._loaded
+
+    def rebuild(self, rows):
+        """Replace the index with (journal, offset, row) triples, e.g. from a full journal scan."""
+        with self._lock:
+            self._loaded = True
+            self._clear()
+            lines = []
+            for journal, offset, row in rows:
+                line = self._add_locked(row, journal, offset)
+                if line:
+                    lines.append(line)
+            self.root.mkdir(parents=True, exist_ok=True)
+            self.path.write_text("".join(lines), encoding="utf-8")
+
+    def _add_locked(self, row, journal, offset):
+        event_id = str(row.get("event_id", "")).strip()
+        if not event_id or event_id in self.locations:
+            return None #The NPC copy of an event is already filed under its turns.jsonl row
+        counts = _event_term_counts(row)
+        self._file(event_id, journal, offset, counts)
+        return json.dumps({"event_id": event_id, "journal": journal, "offset": offset, "terms": counts}) + "\n"
+
+    def add(self, row, journal, offset): #Called for every journal append
+        with self._lock:
+            line = self._add_locked(row, journal, offset)
+            if line:
+                with self.path.open("a", encoding="utf-8") as f:
+                    f.write(line)
+
+    def __contains__(self, event_id):
+        return event_id in self.locations
+
+    def location(self, event_id):
+        return self.locations.get(event_id)
+
+    def matches(self, terms):
+        """Set of query terms each indexed event contains: event_id -> set(terms)."""
+        found = {}
+        with self._lock:
+            for term in set(terms):
+                for event_id in self.postings.get(term, ()):
+                    found.setdefault(event_id, set()).add(term)
+        return found
+
+    def search(self, terms, k):
+        """Top-k (event_id, BM25 score) pairs for the query terms, best first."""
+        if k <= 0:
+            return []
+        scores = Counter()
+        with self._lock:
+            count = len(self.lengths)
+            if not count:
+                return []
+            average_length = max(1.0, self._total_length / count)
+            for term in set(terms):
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1.0 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for event_id, frequency in posting.items():
+                    norm = 1.0 - BM25_B + BM25_B * self.lengths[event_id] / average_length
+                    scores[event_id] += idf * frequency * (BM25_K1 + 1.0) / (frequency + BM25_K1 * norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:k]
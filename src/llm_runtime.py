@@ -6,11 +6,70 @@ Moved this from game.py to make it clearer + more modular + more industry standa
 Still very basic
 '''
 
+import copy
 import os
+import threading
 import time
 
+from src.json_grammar import JsonGrammar, JsonObjectStoppingCriteria, JsonSchemaLogitsProcessor
+
+SUPPORTED_DEVICES = {"auto", "cuda", "cpu"}
+DTYPE_NAMES = {"float16", "bfloat16", "float32"}
+PREFIX_CACHE_MIN_TOKENS = 32 #Shorter shared prefixes are not worth an extra forward pass
+
+class StopEventCriteria:
+    #Ends generation at the next token once the event is set, e.g. when a speculative turn is discarded
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return input_ids.new_full((input_ids.shape[0],), self.event.is_set()).bool()
+
+class TextCallbackStreamer:
+    """Minimal transformers streamer: decodes tokens as generate() produces them and
+    passes only the new text to on_text (TextIteratorStreamer without the queue).
+
+    With several return sequences only the first one is streamed.
+    """
+
+    def __init__(self, tokenizer, on_text, rows=1):
+        self.tokenizer = tokenizer
+        self.on_text = on_text
+        self.rows = rows
+        self.token_ids = []
+        self.emitted = 0
+        self.prompt_seen = False
+
+    def put(self, value):
+        if not self.prompt_seen:
+            self.prompt_seen = True #generate() hands over the prompt ids first
+            return
+        self.token_ids.extend(value.reshape(self.rows, -1)[0].tolist())
+        self._flush(final=False)
+
+    def end(self):
+        self._flush(final=True)
+
+    def _flush(self, final):
+        text = self.tokenizer.decode(self.token_ids, skip_special_tokens=True)
+        if not final and text.endswith("\ufffd"):
+            return #Half of a multi-byte character, wait for the next token
+        if len(text) > self.emitted:
+            chunk, self.emitted = text[self.emitted :], len(text)
+            try:
+                self.on_text(chunk)
+            except Exception:
+                pass #A rendering problem must not abort generation
+
+def _common_prefix_length(a, b):
+    limit = min(len(a), len(b))
+    index = 0
+    while index < limit and a[index] == b[index]:
+        index += 1
+    return index
+
 class LocalLLM:
-    def __init__(self):
+    def __init__(self, device=None):
         self.model_id = os.getenv("LOCAL_MODEL_ID", "").strip()
         self.max_new_tokens = None
         raw_tokens = os.getenv("LOCAL_MAX_NEW_TOKENS", "").strip()
@@ -19,11 +78,57 @@ class LocalLLM:
                 self.max_new_tokens = max(16, int(raw_tokens))
             except Exception:
                 self.max_new_tokens = None
-        self.device = "cuda"
+        #Explicit device argument wins, then LOCAL_DEVICE, then auto-detect in load()
+        self.requested_device = str(device or os.getenv("LOCAL_DEVICE", "auto")).strip().lower() or "auto"
+        self.dtype_name = os.getenv("LOCAL_DTYPE", "").strip().lower()
+        self.num_threads_setting = os.getenv("LOCAL_NUM_THREADS", "").strip()
+        self.num_threads = None
+        #Prefix KV cache - the system message, prompt contract and PROLOGUE block are identical every turn so we only prefill them once
+        self.prefix_cache_enabled = os.getenv("LOCAL_PREFIX_CACHE", "1").strip().lower() not in {"0", "false", "off", "no"}
+        self._prefix_ids = []
+        self._prefix_cache = None
+        self._last_prompt_ids = []
+        self._token_texts = None
+        #One model, one generation at a time - background reflection shares it with the game loop
+        self._generate_lock = threading.RLock()
+        #Per thread, so a speculative turn or a reflection in between cannot take over the game loop's truncated output
+        self._local = threading.local()
+        self.device = None
         self.tokenizer = None
         self.model = None
         self.torch = None
 
+    def _resolve_device(self, torch):
+        if self.requested_device not in SUPPORTED_DEVICES:
+            raise RuntimeError(f"Unsupported LOCAL_DEVICE '{self.requested_device}'. Use one of: {', '.join(sorted(SUPPORTED_DEVICES))}")
+        if self.requested_device == "cuda":
+            if not torch.cuda.is_available():
+                raise RuntimeError("CUDA was requested but is unavailable. Set LOCAL_DEVICE=cpu or LOCAL_DEVICE=auto.")
+            return "cuda"
+        if self.requested_device == "cpu":
+            return "cpu"
+        return "cuda" if torch.cuda.is_available() else "cpu"
+
+    def _resolve_dtype(self, torch):
+        if self.dtype_name:
+            if self.dtype_name not in DTYPE_NAMES:
+                raise RuntimeError(f"Unsupported LOCAL_DTYPE '{self.dtype_name}'. Use one of: {', '.join(sorted(DTYPE_NAMES))}")
+            return getattr(torch, self.dtype_name)
+        #Half precision is the fast path on NVIDIA cards, but most CPUs have no fp16 kernels so float32 is the safe default there
+        return torch.float16 if self.device == "cuda" else torch.float32
+
+    def _resolve_num_threads(self):
+        #None keeps torch's own default. A typo is an error rather than silently running on every core
+        if not self.num_threads_setting:
+            return None
+        try:
+            threads = int(self.num_threads_setting)
+        except ValueError:
+            threads = 0
+        if threads < 1:
+            raise RuntimeError(f"Unsupported LOCAL_NUM_THREADS '{self.num_threads_setting}'. Use a whole number of at least 1.")
+        return threads
+
     def load(self):
         os.environ.setdefault("HF_HUB_DISABLE_PROGRESS_BARS", "1") #No progress bars.. no noise
 
@@ -34,12 +139,11 @@ class LocalLLM:
             raise RuntimeError(f"transformers/torch missing ({exc})")
 
         self.torch = torch
+        self.device = self._resolve_device(torch)
+        self.num_threads = self._resolve_num_threads()
 
-        if not torch.cuda.is_available():
-            raise RuntimeError("CUDA is unavailable. This runtime requires a CUDA-capable GPU.")
-        
-        #Can change this for other gpus
-        self.device = "cuda" #Only suppoting CUDA which means running on my NVIDIA GPU, this is most common
+        if self.device == "cpu" and self.num_threads:
+            torch.set_num_threads(self.num_threads) #Leave some cores free for the embedder if needed
 
         if not self.model_id:
             self.model_id = "Qwen/Qwen2.5-1.5B-Instruct"
@@ -50,7 +154,7 @@ class LocalLLM:
         t0 = time.time() #Timing how long it takes to load
         print(f"Loading local model: {self.model_id}")
 
-        model_dtype = torch.float16
+        model_dtype = self._resolve_dtype(torch)
         self.tokenizer = AutoTokenizer.from_pretrained(self.model_id) #download tokeniser
         self.model = AutoModelForCausalLM.from_pretrained(
             self.model_id,
@@ -63,16 +167,209 @@ class LocalLLM:
         if self.tokenizer.pad_token_id is None:
             self.tokenizer.pad_token = self.tokenizer.eos_token
 
-        # Safe speed knobs for NVIDIA cards.
-        torch.backends.cuda.matmul.allow_tf32 = True  #Speeds up LLM as it speeds up matrix multiplications...
-        torch.backends.cudnn.allow_tf32 = True
+        if self.device == "cuda":
+            # Safe speed knobs for NVIDIA cards.
+            torch.backends.cuda.matmul.allow_tf32 = True  #Speeds up LLM as it speeds up matrix multiplications...
+            torch.backends.cudnn.allow_tf32 = True
 
         elapsed = time.time() - t0
-        print(f"Runtime device: {self.device}")
+        print(f"Runtime device: {self.device} ({str(model_dtype).replace('torch.', '')})")
+        if self.device == "cpu":
+            print(f"CPU threads: {torch.get_num_threads()}")
         print(f"Max new tokens: {self.max_new_tokens}")
         print(f"Local LLM ready in {elapsed:.1f}s.") #Debug
 
-    def generate(self, messages): #Expecting lists of dicts with role and content
+    def reset_prefix_cache(self):
+        self._prefix_ids = []
+        self._prefix_cache = None
+        self._last_prompt_ids = []
+
+    def _build_prefix_cache(self, input_ids, length):
+        with self.torch.no_grad():
+            outputs = self.model(input_ids=input_ids[:, :length], use_cache=True)
+        self._prefix_cache = outputs.past_key_values
+        self._prefix_ids = input_ids[0, :length].tolist()
+
+    def _prefix_cache_for(self, input_ids):
+        """Return a private copy of the cached prefix KV state for this prompt, or None.
+
+        The stable prefix is discovered rather than configured: it is the longest
+        token prefix shared with the previous prompt.  Once cached it only ever
+        shrinks (via crop) when a later prompt diverges earlier, so the cache
+        settles on the part of the prompt that really is byte-identical.
+        """
+        self.last_reused_prefix_tokens = 0
+        if not self.prefix_cache_enabled:
+            return None
+
+        ids = input_ids[0].tolist()
+        #Always leave at least one token for generate() to prefill itself
+        limit = len(ids) - 1
+        previous_ids = self._last_prompt_ids
+        self._last_prompt_ids = ids
+
+        shared = min(_common_prefix_length(self._prefix_ids, ids), limit)
+        if self._prefix_cache is not None and shared >= PREFIX_CACHE_MIN_TOKENS:
+            if shared < len(self._prefix_ids):
+                if hasattr(self._prefix_cache, "crop"):
+                    self._prefix_cache.crop(shared)
+                    self._prefix_ids = self._prefix_ids[:shared]
+                else:
+                    self._build_prefix_cache(input_ids, shared)
+        else:
+            shared = min(_common_prefix_length(previous_ids, ids), limit)
+            if shared < PREFIX_CACHE_MIN_TOKENS:
+                #Unrelated prompt (e.g. a reflection) - keep whatever prefix we already had for the next turn
+                return None
+            self._build_prefix_cache(input_ids, shared)
+
+        self.last_reused_prefix_tokens = len(self._prefix_ids)
+        #generate() appends to the cache in place, so it gets a copy and the stored prefix stays clean
+        return copy.deepcopy(self._prefix_cache)
+
+    def _vocab_texts(self):
+        #Decoded text of every token, built once. Special tokens and partial UTF-8 pieces map to None so the grammar never picks them
+        if self._token_texts is None:
+            special_ids = set(self.tokenizer.all_special_ids)
+            pieces = self.tokenizer.batch_decode(
+                [[token_id] for token_id in range(len(self.tokenizer))],
+                skip_special_tokens=False,
+                clean_up_tokenization_spaces=False,
+            )
+            self._token_texts = [
+                None if token_id in special_ids or not piece or "\ufffd" in piece else piece
+                for token_id, piece in enumerate(pieces)
+            ]
+        return self._token_texts
+
+    def _schema_processor(self, schema):
+        eos_ids = self.tokenizer.eos_token_id
+        if not isinstance(eos_ids, (list, tuple)):
+            eos_ids = [eos_ids]
+        return JsonSchemaLogitsProcessor(JsonGrammar(schema), self._vocab_texts(), eos_ids)
+
+    def generate(self, messages, schema=None, stop_at_json=True, max_new_tokens=None, stop_event=None, on_text=None):
+        #Expecting lists of dicts with role and content, schema switches on constrained JSON decoding
+        #max_new_tokens overrides the default for this call only, stop_event cuts the call short from another thread
+        #on_text(chunk) streams the decoded completion while it is generated; the full text is still returned
+        return self.generate_many(
+            messages,
+            1,
+            schema=schema,
+            stop_at_json=stop_at_json,
+            max_new_tokens=max_new_tokens,
+            stop_event=stop_event,
+            on_text=on_text,
+        )[0]
+
+    def generate_many(self, messages, count, schema=None, stop_at_json=True, max_new_tokens=None, stop_event=None, on_text=None):
+        """Sample count completions of the same prompt in one batched generate() call.
+
+        The prompt is prefilled once and the rows decode side by side, so asking for
+        several candidates costs far less than generating them one after another.
+        Same options as generate(); on_text streams the first row only.
+        """
+        with self._generate_lock:
+            return self._generate(
+                messages,
+                count=max(1, int(count)),
+                schema=schema,
+                stop_at_json=stop_at_json,
+                max_new_tokens=max_new_tokens,
+                stop_event=stop_event,
+                on_text=on_text,
+            )
+
+    @property
+    def last_reused_prefix_tokens(self):
+        #Cached prefix tokens this thread's last generate() reused - per thread, like last_truncated
+        return getattr(self._local, "reused_prefix_tokens", 0)
+
+    @last_reused_prefix_tokens.setter
+    def last_reused_prefix_tokens(self, value):
+        self._local.reused_prefix_tokens = value
+
+    @property
+    def last_truncated(self):
+        #True when this thread's last generate() hit max_new_tokens before finishing, see continue_generation()
+        return getattr(self._local, "continuation", None) is not None
+
+    def _remember_continuation(self, output, prompt_len, generated_from, budget, schema, stop_at_json):
+        #Keep the sequence and its KV cache only when the completion was cut off, so it can be resumed
+        self._local.continuation = None
+        sequences = output.sequences
+        past_key_values = getattr(output, "past_key_values", None)
+        if sequences.shape[0] != 1 or past_key_values is None:
+            return
+        new_ids = sequences[0, generated_from:].tolist()
+        eos_ids = self.tokenizer.eos_token_id
+        if not isinstance(eos_ids, (list, tuple)):
+            eos_ids = [eos_ids]
+        if len(new_ids) < budget or (new_ids and new_ids[-1] in eos_ids):
+            return
+        self._local.continuation = {
+            "sequence": sequences,
+            "prompt_len": prompt_len,
+            "past_key_values": past_key_values,
+            "schema": schema,
+            "stop_at_json": stop_at_json,
+        }
+
+    def continue_generation(self, max_new_tokens=None, stop_event=None, on_text=None):
+        """Resume this thread's last generate() call where max_new_tokens cut it off.
+
+        Decoding carries on from the stored KV cache, so neither the prompt nor the
+        partial output is prefilled again, and the same grammar and stop criteria
+        pick up mid-object.  Returns the whole completion so far (old text plus the
+        new tokens), or None when there is nothing to continue.
+        """
+        with self._generate_lock:
+            state = getattr(self._local, "continuation", None)
+            self._local.continuation = None
+            if state is None or (stop_event is not None and stop_event.is_set()):
+                return None
+            sequence = state["sequence"]
+            prompt_len = state["prompt_len"]
+            completion_ids = sequence[0, prompt_len:].tolist()
+            generate_kwargs = {
+                "input_ids": sequence,
+                "attention_mask": self.torch.ones_like(sequence),
+                "past_key_values": state["past_key_values"],
+            }
+            if state["schema"] is not None:
+                from transformers import LogitsProcessorList
+                processor = self._schema_processor(state["schema"]).resume_from(completion_ids)
+                generate_kwargs["logits_processor"] = LogitsProcessorList([processor])
+            stopping_criteria = []
+            if state["stop_at_json"]:
+                stopping_criteria.append(JsonObjectStoppingCriteria(self._vocab_texts()).resume_from(completion_ids))
+            if stop_event is not None:
+                stopping_criteria.append(StopEventCriteria(stop_event))
+            if stopping_criteria:
+                from transformers import StoppingCriteriaList
+                generate_kwargs["stopping_criteria"] = StoppingCriteriaList(stopping_criteria)
+            if on_text is not None:
+                generate_kwargs["streamer"] = TextCallbackStreamer(self.tokenizer, on_text)
+
+            budget = max_new_tokens or self.max_new_tokens
+            with self.torch.no_grad():
+                output = self.model.generate(
+                    **generate_kwargs,
+                    do_sample=True,
+                    max_new_tokens=budget,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    eos_token_id=self.tokenizer.eos_token_id,
+                    use_cache=True,
+                    return_dict_in_generate=True,
+                )
+            self._remember_continuation(output, prompt_len, sequence.shape[1], budget, state["schema"], state["stop_at_json"])
+            text = self.tokenizer.decode(output.sequences[0, prompt_len:], skip_special_tokens=True).strip()
+            return text or "(empty response)"
+
+    def _generate(self, messages, count=1, schema=None, stop_at_json=True, max_new_tokens=None, stop_event=None, on_text=None):
+        self._local.continuation = None
+        if stop_event is not None and stop_event.is_set():
+            return ["(empty response)"] * count
         if hasattr(self.tokenizer, "apply_chat_template"):
             full_prompt = self.tokenizer.apply_chat_template(
                 messages,
@@ -84,23 +381,50 @@ class LocalLLM:
 
         inputs = self.tokenizer(full_prompt, return_tensors="pt")
         inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        generate_kwargs = dict(inputs)
+        past_key_values = self._prefix_cache_for(inputs["input_ids"])
+        if past_key_values is not None and count > 1:
+            #generate() repeats the prompt rows for num_return_sequences but not a cache passed in
+            if hasattr(past_key_values, "batch_repeat_interleave"):
+                past_key_values.batch_repeat_interleave(count)
+            else:
+                past_key_values = None
+                self.last_reused_prefix_tokens = 0
+        if past_key_values is not None:
+            generate_kwargs["past_key_values"] = past_key_values
+        if count > 1:
+            generate_kwargs["num_return_sequences"] = count
+        if schema is not None:
+            from transformers import LogitsProcessorList
+            generate_kwargs["logits_processor"] = LogitsProcessorList([self._schema_processor(schema)])
+        stopping_criteria = []
+        if stop_at_json:
+            #Plain-text calls never open a brace, so this only ever cuts off chatter after a JSON object
+            stopping_criteria.append(JsonObjectStoppingCriteria(self._vocab_texts()))
+        if stop_event is not None:
+            stopping_criteria.append(StopEventCriteria(stop_event))
+        if stopping_criteria:
+            from transformers import StoppingCriteriaList
+            generate_kwargs["stopping_criteria"] = StoppingCriteriaList(stopping_criteria)
+        if on_text is not None:
+            generate_kwargs["streamer"] = TextCallbackStreamer(self.tokenizer, on_text, rows=count)
 
+        budget = max_new_tokens or self.max_new_tokens
         with self.torch.no_grad():
-            output_ids = self.model.generate( 
-                **inputs,
+            output = self.model.generate( 
+                **generate_kwargs,
                 do_sample=True,
-                max_new_tokens=self.max_new_tokens,
+                max_new_tokens=budget,
                 pad_token_id=self.tokenizer.pad_token_id,
                 eos_token_id=self.tokenizer.eos_token_id,
                 use_cache=True,
+                return_dict_in_generate=True,
             )
 
         prompt_len = inputs["input_ids"].shape[1]
-        completion_ids = output_ids[0][prompt_len:]
-        text = self.tokenizer.decode(completion_ids, skip_special_tokens=True).strip()
-        if not text:
-            return "(empty response)"
-        return text
+        self._remember_continuation(output, prompt_len, prompt_len, budget, schema, stop_at_json)
+        texts = self.tokenizer.batch_decode(output.sequences[:, prompt_len:], skip_special_tokens=True)
+        return [text.strip() or "(empty response)" for text in texts]
 
     def count_tokens_text(self, text): 
         if not self.tokenizer:
@@ -6,9 +6,19 @@ Scoring logic - How relevant a past memory is to the current situation
 '''
 import re
 
+import numpy as np
+
 from src.choice_formatter import _slugify
-from src.config import MEMORY_NPC_TURNS, MEMORY_RECENT_TURNS, MEMORY_TOKEN_BUDGET, MEMORY_TOP_K, STOPWORDS
-from src.embedder import cosine_similarity, embed  # semantic retrieval (Problem 1 & 2)
+from src.config import (
+    MEMORY_ANN_CANDIDATES,
+    MEMORY_NPC_TURNS,
+    MEMORY_RECENT_TURNS,
+    MEMORY_TOKEN_BUDGET,
+    MEMORY_TOP_K,
+    STOPWORDS,
+)
+from src.embedder import embed, embedding_backend  # semantic retrieval (Problem 1 & 2)
+from src.keyword_index import _event_term_counts
 
 def _tokenize_for_match(text):
     tokens = set()
@@ -95,66 +105,137 @@ def _build_retrieval_query(player_choice, world_state, current_npc):
         "keywords": keywords,
     }
 
-def _score_memory_candidate(event, query, turn, query_embedding=None):
-    event_id = str(event.get("event_id", "")).strip() or f"legacy_{event.get('turn', 0)}"
-    quest_ids = {str(item).strip() for item in event.get("quest_ids", []) if str(item).strip()}
+def _event_match_terms(event):
+    return set(_event_term_counts(event))
 
-    tag_terms = set()
-    for raw_tag in event.get("tags", []):
-        tag_terms.update(_tokenize_for_match(raw_tag))
+def _event_terms(event):
+    """Normalised term sets the scorer needs from an event.
 
-    text_terms = _tokenize_for_match(
-        " ".join(
-            [
-                str(event.get("memory_summary", "")),
-                str(event.get("reply", "")),
-                str(event.get("choice_text", "")),
-                str(event.get("choice_id", "")),
-            ]
-        )
-    )
+    Stored on the event as "terms" when it is written, so scoring an old event
+    is set lookups instead of re-tokenising its text every turn.
+    """
+    rule_effects = event.get("rule_effects", {})
+    if not isinstance(rule_effects, dict):
+        rule_effects = {}
+    return {
+        "match": sorted(_event_match_terms(event)),
+        "quest_ids": sorted({str(item).strip() for item in event.get("quest_ids", []) if str(item).strip()}),
+        "milestones": sorted({str(item).strip() for item in rule_effects.get("milestones", []) if str(item).strip()}),
+        "npc": str(event.get("current_npc", "")).strip().lower(),
+        "event_type": str(event.get("event_type", "dialogue")).strip().lower(),
+    }
+
+def _semantic_scores(embeddings, query_embedding, count):
+    """Cosine similarity of every candidate against the query in one matrix-vector product.
 
+    Returns (scores, has_embedding).  Candidates without a usable vector score 0 and
+    are flagged so the caller can fall back to keyword overlap for them.
+    """
+    scores = np.zeros(count, dtype=np.float32)
+    has_embedding = np.zeros(count, dtype=bool)
+    if query_embedding is None or embeddings is None:
+        return scores, has_embedding
+
+    query_vector = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+    rows = []
+    for index, vector in enumerate(embeddings):
+        # A vector of another width came from a different backend (e.g. hashed vs MiniLM),
+        # its cosine would be meaningless, so that candidate uses keyword overlap instead
+        if vector is None or np.shape(vector)[-1] != query_vector.shape[0]:
+            continue
+        has_embedding[index] = True
+        rows.append(index)
+    query_norm = float(np.linalg.norm(query_vector))
+    if not rows or query_norm == 0.0:
+        return scores, has_embedding
+
+    matrix = np.stack([np.asarray(embeddings[index], dtype=np.float32).reshape(-1) for index in rows])
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    scores[rows] = (matrix / norms) @ (query_vector / query_norm)
+    return scores, has_embedding
+
+def _score_memory_candidates(events, query, turn, query_embedding=None, embeddings=None, keyword_index=None):
+    """Score every candidate at once.
+
+    Per-event features are gathered in one pass, then recency, importance,
+    constraint bonuses and relevance are combined as arrays, so the cost per
+    extra candidate is a few set lookups rather than a full scoring call.
+    Events already in keyword_index take their keyword and checkpoint overlap
+    from its posting lists, the rest from the "terms" stored with them, so
+    only events written before terms were stored are tokenised here.
+    """
+    count = len(events)
+    if not count:
+        return []
+
+    # Query-only work, done once rather than once per candidate
     query_terms = set(query.get("keywords", []))
-    quest_overlap = quest_ids & set(query.get("active_quest_ids", []))
-    keyword_overlap = query_terms & (tag_terms | text_terms)
-    same_npc = str(event.get("current_npc", "")).strip().lower() == str(query.get("current_npc", "")).strip().lower()
+    query_quest_ids = set(query.get("active_quest_ids", []))
+    query_npc = str(query.get("current_npc", "")).strip().lower()
+    current_checkpoint_id = str(query.get("current_checkpoint_id", "")).strip()
     checkpoint_terms = _tokenize_for_match(
         " ".join(
             [
-                str(query.get("current_checkpoint_id", "")),
+                current_checkpoint_id,
                 str(query.get("current_checkpoint_goal", "")),
                 str(query.get("next_checkpoint_id", "")),
             ]
         )
     )
-    checkpoint_overlap = checkpoint_terms & (tag_terms | text_terms)
-    rule_effects = event.get("rule_effects", {})
-    if not isinstance(rule_effects, dict):
-        rule_effects = {}
-    milestone_terms = {str(item).strip() for item in rule_effects.get("milestones", []) if str(item).strip()}
-    turns_ago = max(0, turn - int(event.get("turn", 0) or 0))
-    recency_score = 1.0 / (1 + turns_ago)
-
-    importance = event.get("importance", 3)
-    if isinstance(importance, bool) or not isinstance(importance, int):
-        importance = 3
-    importance_score = max(0, min(10, importance)) / 10.0
-
-    event_type = str(event.get("event_type", "dialogue")).strip().lower()
-    if event_type == "fallback":
-        importance_score *= 0.4
-
-    constraint_bonus = 0.0
-    if quest_overlap:
-        constraint_bonus += 1.5
-    if same_npc:
-        constraint_bonus += 0.35
-    if checkpoint_overlap:
-        constraint_bonus += 1.0
-    if str(query.get("current_checkpoint_id", "")).strip() in milestone_terms:
-        constraint_bonus += 1.5
-    if event_type in {"promise", "debt", "threat"} and same_npc:
-        constraint_bonus += 0.75
+
+    query_matches = keyword_index.matches(query_terms) if keyword_index is not None else {}
+    checkpoint_matches = keyword_index.matches(checkpoint_terms) if keyword_index is not None else {}
+
+    event_ids = []
+    keyword_counts = np.zeros(count, dtype=np.float32)
+    quest_overlap = np.zeros(count, dtype=bool)
+    same_npc = np.zeros(count, dtype=bool)
+    checkpoint_overlap = np.zeros(count, dtype=bool)
+    milestone_hit = np.zeros(count, dtype=bool)
+    commitment = np.zeros(count, dtype=bool)
+    fallback = np.zeros(count, dtype=bool)
+    event_turns = np.zeros(count, dtype=np.float32)
+    importance = np.full(count, 3.0, dtype=np.float32)
+
+    for index, event in enumerate(events):
+        event_id = str(event.get("event_id", "")).strip()
+        event_ids.append(event_id or f"legacy_{event.get('turn', 0)}")
+        terms = event.get("terms")
+        if not isinstance(terms, dict):
+            terms = _event_terms(event)  # written before terms were stored
+        if keyword_index is not None and event_id in keyword_index:
+            keyword_counts[index] = len(query_matches.get(event_id, ()))
+            checkpoint_overlap[index] = event_id in checkpoint_matches
+        else:
+            match_terms = terms.get("match", ())
+            keyword_counts[index] = len(query_terms.intersection(match_terms))
+            checkpoint_overlap[index] = not checkpoint_terms.isdisjoint(match_terms)
+        quest_overlap[index] = not query_quest_ids.isdisjoint(terms.get("quest_ids", ()))
+        same_npc[index] = terms.get("npc", "") == query_npc
+        milestone_hit[index] = current_checkpoint_id in terms.get("milestones", ())
+
+        event_type = terms.get("event_type", "dialogue")
+        commitment[index] = event_type in {"promise", "debt", "threat"}
+        fallback[index] = event_type == "fallback"
+        event_turns[index] = int(event.get("turn", 0) or 0)
+        raw_importance = event.get("importance", 3)
+        if isinstance(raw_importance, int) and not isinstance(raw_importance, bool):
+            importance[index] = raw_importance
+
+    turns_ago = np.maximum(0.0, turn - event_turns)
+    recency_score = 1.0 / (1.0 + turns_ago)
+
+    importance_score = np.clip(importance, 0, 10) / 10.0
+    importance_score[fallback] *= 0.4
+
+    constraint_bonus = (
+        1.5 * quest_overlap
+        + 0.35 * same_npc
+        + 1.0 * checkpoint_overlap
+        + 1.5 * milestone_hit
+        + 0.75 * (commitment & same_npc)
+    )
 
     # --- Semantic relevance (Problem 1 & 2) ---
     # Generative Agents (Park et al. 2023) scores memories as:
@@ -165,25 +246,55 @@ def _score_memory_candidate(event, query, turn, query_embedding=None):
     # can surface memories that are topically related even when the player
     # uses different words — e.g. "who tampered with it?" matches a memory
     # about Eli editing the route entry without sharing any keywords.
-    semantic_score = 0.0
-    event_embedding = event.get("embedding")
-    if query_embedding is not None and event_embedding is not None:
-        semantic_score = cosine_similarity(query_embedding, event_embedding)
-        relevance = semantic_score * 2.0
-    else:
-        # Fallback: original keyword overlap when embeddings are unavailable
-        # (e.g. sentence-transformers not installed, or event predates embedding)
-        relevance = len(keyword_overlap) * 1.25
-
-    score = relevance + recency_score + importance_score + constraint_bonus
-    return {
-        "event_id": event_id,
-        "event": event,
-        "score": score,
-        # Widen the filter when we have a strong semantic hit — a high cosine
-        # score means the memory is topically relevant even without keyword overlap
-        "passes_filter": bool(keyword_overlap or quest_overlap or same_npc or semantic_score > 0.25),
-    }
+    # Candidates with no usable embedding (no embedding backend, the event
+    # predates embedding, or its vector came from another backend) fall back
+    # to the original keyword overlap.
+    semantic_score, has_embedding = _semantic_scores(embeddings, query_embedding, count)
+    relevance = np.where(has_embedding, semantic_score * 2.0, keyword_counts * 1.25)
+
+    scores = relevance + recency_score + importance_score + constraint_bonus
+    # Widen the filter when we have a strong semantic hit — a high cosine
+    # score means the memory is topically relevant even without keyword overlap
+    passes_filter = (keyword_counts > 0) | quest_overlap | same_npc | (semantic_score > 0.25)
+
+    return [
+        {
+            "event_id": event_ids[index],
+            "event": events[index],
+            "score": float(scores[index]),
+            "passes_filter": bool(passes_filter[index]),
+        }
+        for index in range(count)
+    ]
+
+def _merge_candidates(sources, current_npc, is_fallback_event):
+    """Merge candidate lists into one list keyed by event_id, first sighting first.
+
+    sources is a list of (provenance, events) pairs: "npc" for the active NPC's
+    journal, "global" for turns.jsonl, and "vector" / "keyword" for whole-history
+    hits from the IVF and BM25 indexes.
+    Outside the NPC's own journal only events with that NPC, or travel, handoff and
+    prologue events, are kept.  Each candidate records every source it came from.
+    Events are never compared to each other, so this is linear in the candidates.
+    """
+    active_npc = str(current_npc or "").strip().lower()
+    merged = {}
+    for provenance, events in sources:
+        for event in events:
+            if is_fallback_event(event):
+                continue
+            if provenance != "npc":
+                event_npc = str(event.get("current_npc", "")).strip().lower()
+                event_type = str(event.get("event_type", "")).strip().lower()
+                if event_npc != active_npc and event_type not in {"travel", "handoff", "prologue"}:
+                    continue
+            event_id = str(event.get("event_id", "")).strip() or f"legacy_{event.get('turn', 0)}_{len(merged)}"
+            candidate = merged.get(event_id)
+            if candidate is None:
+                merged[event_id] = {"event": event, "sources": [provenance]}
+            elif provenance not in candidate["sources"]:
+                candidate["sources"].append(provenance)
+    return list(merged.values())
 
 def _retrieve_memories(
     player_choice,
@@ -202,35 +313,48 @@ def _retrieve_memories(
     # Combining the player's spoken line with the keyword set gives the
     # embedding model richer context than either alone.
     query_text = f"{player_choice.get('text', '')} {' '.join(query.get('keywords', []))}"
-    query_embedding = embed(query_text)  # None if sentence-transformers unavailable
+    query_embedding = embed(query_text)  # None only if no embedding backend could load
 
     npc_turns = memory_store.load_npc_turns(current_npc, MEMORY_NPC_TURNS)
     recent = memory_store.load_recent_turns(MEMORY_RECENT_TURNS)
-    active_npc = str(current_npc or "").strip().lower()
 
-    seen_ids = set()
-    combined = []
-    for event in npc_turns + recent:
-        if is_fallback_event(event):
-            continue
-        event_npc = str(event.get("current_npc", "")).strip().lower()
-        event_type = str(event.get("event_type", "")).strip().lower()
-        if event in recent and event_npc != active_npc and event_type not in {"travel", "handoff", "prologue"}:
-            continue
-        event_id = str(event.get("event_id", "")).strip() or f"legacy_{event.get('turn', 0)}_{len(combined)}"
-        if event_id in seen_ids:
-            continue
-        seen_ids.add(event_id)
-        combined.append(event)
-
-    scored = []
-    for event in combined:
-        item = _score_memory_candidate(event, query, turn, query_embedding=query_embedding)
-        if item["passes_filter"]:
-            scored.append(item)
+    # The windows only cover the last few turns. The vector index searches the
+    # whole journal so an older but highly relevant clue can still compete.  The
+    # BM25 keyword index does the same job lexically whenever the vectors carry no
+    # meaning (the hashing fallback) or cannot be searched (no embedding, or a
+    # sidecar written by another backend), and the two are merged by provenance.
+    keyword_index = memory_store.keyword_index()
+    vector_events = []
+    keyword_events = []
+    if MEMORY_ANN_CANDIDATES > 0:
+        if query_embedding is not None:
+            vector_events = memory_store.search_similar_events(query_embedding, MEMORY_ANN_CANDIDATES)
+        if not vector_events or embedding_backend() == "hashing":
+            keyword_events = memory_store.search_keywords(query.get("keywords", []), MEMORY_ANN_CANDIDATES)
+
+    candidates = _merge_candidates(
+        [("npc", npc_turns), ("global", recent), ("vector", vector_events), ("keyword", keyword_events)],
+        current_npc,
+        is_fallback_event,
+    )
+    combined = [candidate["event"] for candidate in candidates]
+
+    # One sidecar read for every candidate instead of parsing a float list per row
+    embeddings = memory_store.load_event_embeddings(combined) if query_embedding is not None else None
+
+    all_scored = _score_memory_candidates(
+        combined,
+        query,
+        turn,
+        query_embedding=query_embedding,
+        embeddings=embeddings,
+        keyword_index=keyword_index,
+    )
+    for item, candidate in zip(all_scored, candidates):
+        item["sources"] = candidate["sources"]
+    scored = [item for item in all_scored if item["passes_filter"]]
     if not scored:
-        for event in combined[-MEMORY_RECENT_TURNS:]:
-            scored.append(_score_memory_candidate(event, query, turn, query_embedding=query_embedding))
+        scored = all_scored[-MEMORY_RECENT_TURNS:]
     scored.sort(key=lambda item: item["score"], reverse=True)
 
     selected = []
@@ -260,6 +384,8 @@ def _retrieve_memories(
         "query": query,
         "selected": selected,
         "candidate_count": len(combined),
+        "ann_candidate_count": len(vector_events),
+        "keyword_candidate_count": len(keyword_events),
         "memory_tokens": memory_tokens,
         "prompt_tokens": 0,
     }
@@ -3,15 +3,54 @@ src/memory_store.py
 
 Simple memory journaling
 Each turn is appended to JSONL files so memory persists between sessions
+
+Embeddings live in a binary sidecar (embeddings.f32, one float32 row per vector)
+instead of inside the JSON rows - a 384-float list was ~8 KB of text per row and
+parsing it dominated retrieval.  Rows only carry "embedding_index", the row number
+in the sidecar, and the turn + NPC copies of an event share the same vector.
+
+Every sidecar row is also filed in an IVF index (src/vector_index.py) and a locator
+(embeddings_loc.jsonl: sidecar row -> journal file + byte offset), so the retriever
+can pull the most similar events from the whole history, not just the recent window.
+Without embeddings the same job falls to the BM25 keyword index (src/keyword_index.py),
+which is also kept up to date on every append.
 """
 
 import json
+import os
 import re 
+import threading
+from collections import deque
 from pathlib import Path
 
+import numpy as np
+
+from src.config import MEMORY_CACHE_ROWS
+from src.keyword_index import KEYWORD_INDEX_FILE, KeywordIndex
+from src.vector_index import ASSIGNMENTS_FILE, CENTROIDS_FILE, IVFIndex
+
+TAIL_BLOCK_BYTES = 64 * 1024 #Chunk size for reading journals backwards from the end
+EMBEDDINGS_FILE = "embeddings.f32"
+EMBEDDINGS_META_FILE = "embeddings.json" #Holds the vector width so the raw matrix can be reshaped
+EMBEDDING_DTYPE = np.float32
+EMBEDDING_LOCATOR_FILE = "embeddings_loc.jsonl"
+
 class MemoryStore:
-    def __init__(self, root="data/memory"): #Folder where the memory files are
+    def __init__(self, root="data/memory", cache_rows=MEMORY_CACHE_ROWS): #Folder where the memory files are
         self.root = Path(root)
+        self._lock = threading.Lock() #Reflections are appended from a background thread
+        # Write-through cache: path -> deque of the newest parsed rows. Filled on first read,
+        # appended on every write, so steady-state retrieval never touches the disk.
+        # Cached rows are shared between callers and must be treated as read-only.
+        self.cache_rows = max(0, int(cache_rows or 0))
+        self._cache = {}
+        self._embedding_dim = None
+        self.mismatched_embeddings = 0 #Vectors dropped because their width did not match the sidecar
+        self._locator = None #sidecar row -> (journal filename, byte offset of the first row that uses it)
+        self._locator_rescanned = False
+        self._vector_index = IVFIndex(self.root, self._embedding_matrix)
+        self._keyword_index = KeywordIndex(self.root)
+        self._keywords_rescanned = False
 
     def _safe_npc_filename(self, npc_name): #Making a different jsonl file for each npc, for context blocks
         raw = str(npc_name or "").strip().lower()
@@ -20,19 +59,62 @@ class MemoryStore:
         return safe or "unknown_npc"
 
     def _append_jsonl(self, path, row): #Appending a row in a jsonl file and then creating the file
-        path.parent.mkdir(parents=True, exist_ok=True)
-        with path.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(row) + "\n")
+        line = json.dumps(row) + "\n"
+        with self._lock:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with path.open("ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(line.encode("utf-8"))
+            cached = self._cache.get(path)
+            if cached is not None:
+                cached.append(json.loads(line)) #Parsed copy so the cache holds exactly what a disk read would
+            embedding_index = row.get("embedding_index")
+            if isinstance(embedding_index, int) and not isinstance(embedding_index, bool):
+                self._record_location(embedding_index, path.name, offset)
+            self._ensure_keyword_index()
+            self._keyword_index.add(row, path.name, offset)
+
+    def _read_recent(self, path, n): #Last n rows from the cache when it is big enough, otherwise from disk
+        if not self.cache_rows or n > self.cache_rows:
+            return self._read_jsonl(path, n)
+        if n <= 0:
+            return []
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached is None:
+                cached = deque(self._read_jsonl(path, self.cache_rows), maxlen=self.cache_rows)
+                self._cache[path] = cached
+            rows = list(cached)
+        return rows[-n:]
 
     def _read_jsonl(self, path, n): #Reading the last n valid lines from the jsonl file, returning the eldest first
-        if not path.exists():
+        """Seek to the end and scan backwards in blocks, so the cost depends on n rather than journal size."""
+        if n <= 0 or not path.exists():
             return []
+        rows = []
         try:
-            lines = path.read_text(encoding="utf-8").splitlines()
+            with path.open("rb") as f:
+                f.seek(0, os.SEEK_END)
+                position = f.tell()
+                remainder = b""
+                while position > 0 and len(rows) < n:
+                    size = min(TAIL_BLOCK_BYTES, position)
+                    position -= size
+                    f.seek(position)
+                    lines = (f.read(size) + remainder).split(b"\n")
+                    # The first piece may be the tail end of a line that starts in an earlier block
+                    remainder = lines.pop(0)
+                    self._collect_rows_backwards(lines, rows, n)
+                if position == 0 and remainder:
+                    self._collect_rows_backwards([remainder], rows, n)
         except Exception:
-            return []
-        rows = []
+            pass
+        return list(reversed(rows))
+
+    def _collect_rows_backwards(self, lines, rows, n):
         for line in reversed(lines):
+            if len(rows) >= n:
+                return
             line = line.strip()
             if not line:
                 continue
@@ -40,9 +122,6 @@ class MemoryStore:
                 rows.append(json.loads(line))
             except Exception:
                 continue
-            if len(rows) == n:
-                break
-        return list(reversed(rows))
 
     def _read_all_jsonl(self, path):
         if not path.exists():
@@ -62,6 +141,26 @@ class MemoryStore:
                 continue
         return rows
 
+    def _read_journal_for_rewrite(self, path):
+        #Like _read_all_jsonl, but a line that does not parse (e.g. half-written in a crash) is kept as its raw text
+        #so rewriting the journal never deletes it
+        if not path.exists():
+            return []
+        try:
+            lines = path.read_text(encoding="utf-8").splitlines()
+        except Exception:
+            return []
+        rows = []
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except Exception:
+                row = None
+            rows.append(row if isinstance(row, dict) else line)
+        return rows
+
     def append_turn(self, row): 
         self._append_jsonl(self.root / "turns.jsonl", row)
 
@@ -72,19 +171,11 @@ class MemoryStore:
         self._append_jsonl(self.root / f"{safe_name}.jsonl", row)
 
     def load_last_turn(self): #loading the last save
-        path = self.root / "turns.jsonl"
-        if not path.exists():
-            return None
-        try:
-            lines = path.read_text(encoding="utf-8").splitlines()
-            if not lines:
-                return None
-            return json.loads(lines[-1])
-        except Exception:
-            return None
+        rows = self._read_recent(self.root / "turns.jsonl", 1)
+        return rows[-1] if rows else None
 
     def load_recent_turns(self, n=5):
-        return self._read_jsonl(self.root / "turns.jsonl", n)
+        return self._read_recent(self.root / "turns.jsonl", n)
 
     def load_all_turns(self):
         return self._read_all_jsonl(self.root / "turns.jsonl")
@@ -93,7 +184,7 @@ class MemoryStore:
         if not npc_name: 
             return []
         safe_name = self._safe_npc_filename(npc_name)
-        return self._read_jsonl(self.root / f"{safe_name}.jsonl", n)
+        return self._read_recent(self.root / f"{safe_name}.jsonl", n)
 
     def load_all_npc_turns(self, npc_name):
         if not npc_name:
@@ -101,8 +192,377 @@ class MemoryStore:
         safe_name = self._safe_npc_filename(npc_name)
         return self._read_all_jsonl(self.root / f"{safe_name}.jsonl")
 
+    def _load_embedding_dim(self):
+        if self._embedding_dim is None:
+            try:
+                meta = json.loads((self.root / EMBEDDINGS_META_FILE).read_text(encoding="utf-8"))
+                self._embedding_dim = int(meta["dim"])
+            except Exception:
+                return None
+        return self._embedding_dim
+
+    def embedding_dim(self): #Width of the stored vectors, None before the first one is written
+        with self._lock:
+            return self._load_embedding_dim()
+
+    def append_embedding(self, vector): #Appending one vector to the sidecar, returns its row index (None if there is nothing to store)
+        if vector is None:
+            return None
+        return self.append_embeddings(np.asarray(vector, dtype=EMBEDDING_DTYPE).reshape(1, -1))[0]
+
+    def append_embeddings(self, matrix): #Appending a (rows, dim) matrix in one write, returns the row index of each vector
+        if matrix is None:
+            return []
+        rows = np.ascontiguousarray(matrix, dtype=EMBEDDING_DTYPE)
+        if rows.ndim != 2 or rows.shape[1] == 0:
+            return [None] * (rows.shape[0] if rows.ndim == 2 else 0)
+        if rows.shape[0] == 0:
+            return []
+        path = self.root / EMBEDDINGS_FILE
+        with self._lock:
+            dim = self._load_embedding_dim()
+            if dim is None:
+                self.root.mkdir(parents=True, exist_ok=True)
+                (self.root / EMBEDDINGS_META_FILE).write_text(
+                    json.dumps({"dim": int(rows.shape[1]), "dtype": np.dtype(EMBEDDING_DTYPE).name}),
+                    encoding="utf-8",
+                )
+                self._embedding_dim = dim = int(rows.shape[1])
+            if rows.shape[1] != dim:
+                #A different embedding backend wrote this store - keep the rows, skip the vectors until reembed_embeddings() migrates it
+                self.mismatched_embeddings += rows.shape[0]
+                return [None] * rows.shape[0]
+            row_bytes = dim * rows.itemsize
+            with path.open("ab") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size % row_bytes:
+                    size -= size % row_bytes
+                    f.truncate(size) #Drop a half-written vector from a crash so indices stay aligned
+                first = size // row_bytes
+                f.write(rows.tobytes())
+        self._vector_index.add()
+        return list(range(int(first), int(first) + rows.shape[0]))
+
+    def _embedding_matrix(self): #The whole sidecar as a read-only (rows, dim) memmap, or None
+        dim = self._load_embedding_dim()
+        path = self.root / EMBEDDINGS_FILE
+        if dim is None or not path.exists() or path.stat().st_size < dim * np.dtype(EMBEDDING_DTYPE).itemsize:
+            return None
+        try:
+            matrix = np.memmap(path, dtype=EMBEDDING_DTYPE, mode="r")
+        except Exception:
+            return None
+        return matrix[: (matrix.size // dim) * dim].reshape(-1, dim)
+
+    def load_embeddings(self, indices): #Vectors for sidecar row indices, None for any index that is missing or invalid
+        matrix = self._embedding_matrix()
+        if matrix is None:
+            return [None for _ in indices]
+        vectors = []
+        for index in indices:
+            if isinstance(index, int) and not isinstance(index, bool) and 0 <= index < matrix.shape[0]:
+                vectors.append(np.array(matrix[index]))
+            else:
+                vectors.append(None)
+        return vectors
+
+    def load_event_embeddings(self, events):
+        #Embedding for each event: sidecar row when indexed, the old inline list for journals written before the sidecar
+        vectors = self.load_embeddings([event.get("embedding_index") for event in events])
+        for position, event in enumerate(events):
+            if vectors[position] is None and event.get("embedding") is not None:
+                vectors[position] = np.asarray(event["embedding"], dtype=EMBEDDING_DTYPE)
+        return vectors
+
+    def migrate_inline_embeddings(self):
+        """Move inline "embedding" lists from existing journals into the sidecar.
+
+        Rows are rewritten with an "embedding_index" instead.  The same event in
+        turns.jsonl and an NPC file is stored once.  Returns how many rows changed.
+        """
+        if not self.root.exists():
+            return 0
+        migrated = 0
+        by_event_id = {}
+        for path in self._journal_paths():
+            rows = self._read_journal_for_rewrite(path)
+            if not any(isinstance(row, dict) and isinstance(row.get("embedding"), list) for row in rows):
+                continue
+            for row in rows:
+                if not isinstance(row, dict):
+                    continue
+                vector = row.pop("embedding", None)
+                if not isinstance(vector, list) or "embedding_index" in row:
+                    continue
+                event_id = str(row.get("event_id", "")).strip()
+                index = by_event_id.get(event_id) if event_id else None
+                if index is None:
+                    index = self.append_embedding(vector)
+                    if event_id and index is not None:
+                        by_event_id[event_id] = index
+                row["embedding_index"] = index
+                migrated += 1
+            self._rewrite_journal(path, rows)
+        if migrated:
+            self._reindex_journals()
+        return migrated
+
+    def backfill_embeddings(self, embed_many):
+        """Embed every stored event that has no vector yet, e.g. rows written while
+        sentence-transformers was not installed.
+
+        All missing summaries go through one embed_many(texts) call, which returns a
+        (len(texts), dim) matrix or None.  Returns how many rows changed.
+        """
+        if not self.root.exists():
+            return 0
+        journals = []
+        texts = {} #event_id (or a per-row key for rows without one) -> summary to embed
+        for path in self._journal_paths():
+            rows = self._read_journal_for_rewrite(path)
+            pending = []
+            for position, row in enumerate(rows):
+                if not isinstance(row, dict):
+                    continue
+                summary = str(row.get("memory_summary", "")).strip()
+                if row.get("embedding_index") is not None or row.get("embedding") is not None or not summary:
+                    continue
+                key = str(row.get("event_id", "")).strip() or f"{path.name}:{position}"
+                texts.setdefault(key, summary)
+                pending.append((row, key))
+            if pending:
+                journals.append((path, rows, pending))
+        if not texts:
+            return 0
+        matrix = embed_many(list(texts.values()))
+        if matrix is None or len(matrix) != len(texts):
+            return 0
+        indices = dict(zip(texts, self.append_embeddings(matrix)))
+        updated = 0
+        for path, rows, pending in journals:
+            changed = 0
+            for row, key in pending:
+                if indices.get(key) is not None:
+                    row["embedding_index"] = indices[key]
+                    changed += 1
+            if changed: #Nothing was stored (e.g. the vectors did not fit the sidecar) - leave the file alone
+                self._rewrite_journal(path, rows)
+                updated += changed
+        if updated:
+            self._reindex_journals()
+        return updated
+
+    def reembed_embeddings(self, embed_many):
+        """Replace the sidecar with vectors from the current embedder.
+
+        The sidecar keeps one width, so a save started on the hashing fallback (256)
+        would drop every MiniLM vector (384) once sentence-transformers is installed.
+        Every stored summary is embedded again in one embed_many() call, the old
+        sidecar and IVF index are discarded and each row gets its new
+        embedding_index.  Returns how many memories were embedded.
+        """
+        if not self.root.exists():
+            return 0
+        journals = []
+        texts = {}
+        for path in self._journal_paths():
+            rows = self._read_journal_for_rewrite(path)
+            entries = []
+            for position, row in enumerate(rows):
+                if not isinstance(row, dict):
+                    continue
+                summary = str(row.get("memory_summary", "")).strip()
+                key = None
+                if summary:
+                    key = str(row.get("event_id", "")).strip() or f"{path.name}:{position}"
+                    texts.setdefault(key, summary)
+                if key is not None or row.get("embedding_index") is not None:
+                    entries.append((row, key))
+            if entries:
+                journals.append((path, rows, entries))
+        matrix = embed_many(list(texts.values())) if texts else None
+        if texts and (matrix is None or len(matrix) != len(texts)):
+            return 0 #Keep the old sidecar rather than lose every vector
+        with self._lock:
+            for name in (EMBEDDINGS_FILE, EMBEDDINGS_META_FILE, CENTROIDS_FILE, ASSIGNMENTS_FILE, EMBEDDING_LOCATOR_FILE):
+                (self.root / name).unlink(missing_ok=True)
+            self._embedding_dim = None
+            self.mismatched_embeddings = 0
+            self._locator = None
+            self._vector_index = IVFIndex(self.root, self._embedding_matrix)
+        indices = dict(zip(texts, self.append_embeddings(matrix))) if texts else {}
+        for path, rows, entries in journals:
+            changed = False
+            for row, key in entries:
+                index = indices.get(key) if key is not None else None
+                if row.get("embedding_index") != index:
+                    row["embedding_index"] = index
+                    changed = True
+            if changed:
+                self._rewrite_journal(path, rows)
+        self._reindex_journals()
+        return sum(index is not None for index in indices.values())
+
+    def _rewrite_journal(self, path, rows):
+        temp_path = path.with_suffix(".jsonl.tmp")
+        #Raw strings are lines that did not parse, written back untouched
+        temp_path.write_text(
+            "".join((row if isinstance(row, str) else json.dumps(row)) + "\n" for row in rows),
+            encoding="utf-8",
+        )
+        with self._lock:
+            os.replace(temp_path, path)
+            self._cache.pop(path, None)
+
+    def _reindex_journals(self):
+        with self._lock:
+            self._rebuild_locator() #Rewriting the journals moved every row
+            self._keyword_index.rebuild(self._scan_journals())
+
+    def _journal_paths(self): #turns.jsonl first, so an event is located in the global journal when it is in both
+        paths = sorted(self.root.glob("*.jsonl"))
+        return sorted(
+            (path for path in paths if path.name not in {EMBEDDING_LOCATOR_FILE, KEYWORD_INDEX_FILE}),
+            key=lambda path: path.name != "turns.jsonl",
+        )
+
+    def _scan_journals(self): #(journal filename, byte offset, row) for every parseable row
+        for path in self._journal_paths():
+            offset = 0
+            try:
+                with path.open("rb") as f:
+                    for line in f:
+                        try:
+                            row = json.loads(line)
+                        except Exception:
+                            row = None
+                        if isinstance(row, dict):
+                            yield path.name, offset, row
+                        offset += len(line)
+            except Exception:
+                continue
+
+    def _rebuild_locator(self):
+        #One linear scan of every journal, only needed when the locator file is missing or stale
+        self._locator = {}
+        for journal, offset, row in self._scan_journals():
+            index = row.get("embedding_index")
+            if isinstance(index, int) and not isinstance(index, bool) and index not in self._locator:
+                self._locator[index] = (journal, offset)
+        self.root.mkdir(parents=True, exist_ok=True)
+        lines = [
+            json.dumps({"index": index, "journal": journal, "offset": offset})
+            for index, (journal, offset) in sorted(self._locator.items())
+        ]
+        (self.root / EMBEDDING_LOCATOR_FILE).write_text("".join(line + "\n" for line in lines), encoding="utf-8")
+
+    def _ensure_locator(self): #Caller holds self._lock
+        if self._locator is not None:
+            return
+        path = self.root / EMBEDDING_LOCATOR_FILE
+        if not path.exists():
+            self._rebuild_locator()
+            return
+        self._locator = {}
+        for row in self._read_all_jsonl(path):
+            try:
+                self._locator.setdefault(int(row["index"]), (str(row["journal"]), int(row["offset"])))
+            except Exception:
+                continue
+
+    def _record_location(self, index, journal, offset): #Caller holds self._lock
+        self._ensure_locator()
+        if index in self._locator:
+            return
+        self._locator[index] = (journal, offset)
+        with (self.root / EMBEDDING_LOCATOR_FILE).open("a", encoding="utf-8") as f:
+            f.write(json.dumps({"index": index, "journal": journal, "offset": offset}) + "\n")
+
+    def _read_row_at(self, journal, offset):
+        try:
+            with (self.root / journal).open("rb") as f:
+                f.seek(offset)
+                return json.loads(f.readline())
+        except Exception:
+            return None
+
+    def search_similar_events(self, query_vector, k):
+        """Up to k journal events whose embeddings are closest to query_vector, best first.
+
+        Searches the whole history through the IVF index, so the cost grows with the
+        probed clusters rather than with the journal.
+        """
+        hits = self._vector_index.search(query_vector, k)
+        if not hits:
+            return []
+        events = []
+        with self._lock:
+            self._ensure_locator()
+            for index, _score in hits:
+                row = self._locate_row(index)
+                if row is None and not self._locator_rescanned:
+                    #Journals were rewritten or edited by hand - rescan once per session and try again
+                    self._locator_rescanned = True
+                    self._rebuild_locator()
+                    row = self._locate_row(index)
+                if row is not None:
+                    events.append(row)
+        return events
+
+    def _ensure_keyword_index(self): #Caller holds self._lock
+        if not self._keyword_index.is_loaded() and not self._keyword_index.load():
+            self._keyword_index.rebuild(self._scan_journals()) #No index file yet - file every existing row once
+
+    def keyword_index(self):
+        """The BM25 keyword index over every journal event, loaded on first use."""
+        with self._lock:
+            self._ensure_keyword_index()
+            return self._keyword_index
+
+    def search_keywords(self, terms, k):
+        """Up to k journal events ranked by BM25 over the query terms, best first."""
+        with self._lock:
+            self._ensure_keyword_index()
+        hits = self._keyword_index.search(terms, k)
+        events = []
+        with self._lock:
+            for event_id, _score in hits:
+                row = self._locate_keyword_row(event_id)
+                if row is None and not self._keywords_rescanned:
+                    self._keywords_rescanned = True
+                    self._keyword_index.rebuild(self._scan_journals())
+                    row = self._locate_keyword_row(event_id)
+                if row is not None:
+                    events.append(row)
+        return events
+
+    def _locate_keyword_row(self, event_id): #Caller holds self._lock
+        location = self._keyword_index.location(event_id)
+        row = self._read_row_at(*location) if location else None
+        if not isinstance(row, dict) or str(row.get("event_id", "")).strip() != event_id:
+            return None
+        return row
+
+    def _locate_row(self, index): #Caller holds self._lock
+        location = self._locator.get(index)
+        row = self._read_row_at(*location) if location else None
+        if not isinstance(row, dict) or row.get("embedding_index") != index:
+            return None
+        return row
+
     def reset(self): #Starting fresh and removing all memory files
+        with self._lock:
+            self._cache.clear()
+            self._embedding_dim = None
+            self.mismatched_embeddings = 0
+            self._locator = None
+            self._locator_rescanned = False
+            self._vector_index = IVFIndex(self.root, self._embedding_matrix)
+            self._keyword_index = KeywordIndex(self.root)
+            self._keywords_rescanned = False
         if not self.root.exists(): 
             return
         for path in self.root.glob("*.jsonl"):
             path.unlink(missing_ok=True)
+        for name in (EMBEDDINGS_FILE, EMBEDDINGS_META_FILE, CENTROIDS_FILE, ASSIGNMENTS_FILE):
+            (self.root / name).unlink(missing_ok=True)
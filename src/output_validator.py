@@ -19,11 +19,18 @@ from src.choice_formatter import (
 )
 from src.config import (
     ALLOWED_EVENT_TYPES,
+    CONSTRAINED_JSON_DECODING,
+    JSON_CANDIDATES_PER_ATTEMPT,
+    JSON_CONTINUATION_ROUNDS,
+    JSON_CONTINUATION_TOKENS,
+    JSON_LOCAL_REPAIR,
     MAX_JSON_RETRY_ATTEMPTS,
     MAX_LLM_CHOICES,
     MIN_LLM_CHOICES,
     VALID_TIME_OF_DAY,
 )
+from src.json_grammar import build_turn_schema
+from src.json_repair import _repair_json_text, _repair_turn_fields
 from src.memory_retrieval import _build_auto_memory_summary, _derive_tags
 
 #Scenes we dont support - if the LLM hallucinates these locations or props we strip them from the output
@@ -46,6 +53,10 @@ class OutputValidationExhausted(RuntimeError):
         self.attempts = attempts
 
 
+class GenerationCancelled(RuntimeError):
+    #Raised when stop_event was set during generation, e.g. a speculative turn the player did not pick
+    pass
+
 def _extract_json_object(raw_text):
     #The LLM sometimes wraps JSON in markdown fences or adds text around it, this tries to pull just the object out
     text = str(raw_text or "").strip()
@@ -75,6 +86,23 @@ def _extract_json_object(raw_text):
                     return None
     return None
 
+def _continue_truncated(llm, raw, stop_event=None, on_text=None):
+    #A turn cut off at max_new_tokens is resumed from its KV cache instead of regenerated. Returns (raw, rounds used)
+    rounds = 0
+    while rounds < JSON_CONTINUATION_ROUNDS and getattr(llm, "last_truncated", False):
+        continued = llm.continue_generation(
+            max_new_tokens=JSON_CONTINUATION_TOKENS,
+            stop_event=stop_event,
+            on_text=on_text,
+        )
+        if continued is None:
+            break
+        raw = continued
+        rounds += 1
+        if _extract_json_object(raw) is not None:
+            break
+    return raw, rounds
+
 def _sanitize_state_updates(updates):
     #Only allow time_of_day and day through - the LLM isnt allowed to change location or quest status itself
     if not isinstance(updates, dict):
@@ -170,6 +198,60 @@ def _has_unsupported_scene_drift(text):
         return False
     return any(re.search(pattern, low) for pattern in UNSUPPORTED_SCENE_PATTERNS)
 
+def _dialogue_errors(speaker_text, reply_text, *, current_npc, current_player_choice, world_state):
+    #Core dialogue checks - speaker must match the active NPC and the reply cant just echo the player back
+    errors = []
+    active_npc = str(current_npc or "").strip()
+    current_choice_text = str(current_player_choice.get("text", "")).strip().lower()
+    last_reply = str(world_state.get("last_reply", "")).strip()
+    last_speaker = str(world_state.get("last_speaker", "")).strip()
+    if not speaker_text or not reply_text:
+        errors.append("Dialogue mode: speaker and reply must both be non-empty.")
+    if active_npc and speaker_text.lower() != active_npc.lower():
+        errors.append(f"Dialogue mode: speaker must be current_npc '{active_npc}'.")
+    if current_choice_text and reply_text.lower() == current_choice_text:
+        errors.append("Dialogue mode: reply must not repeat the player's selected line verbatim.")
+    if (
+        last_reply
+        and last_speaker
+        and active_npc
+        and last_speaker.lower() == active_npc.lower()
+        and _is_too_similar_to_previous(reply_text, last_reply)
+    ):
+        errors.append("Dialogue mode: reply must add new information, not paraphrase the previous NPC line.")
+    if _has_unsupported_scene_drift(reply_text):
+        errors.append("Dialogue mode: reply introduced unsupported scene details.")
+    return errors
+
+def _narrator_is_kept(narrator_text, world_state):
+    #A narrator that repeats the last one or drifts out of the scene is swapped for the stock line
+    last_narrator = str(world_state.get("last_narrator", "")).strip()
+    if narrator_text and _is_too_similar_to_previous(narrator_text, last_narrator):
+        return False
+    return not (narrator_text and _has_unsupported_scene_drift(narrator_text))
+
+def _line_survives_validation(field, text, speaker, *, current_npc, current_player_choice, world_state):
+    """True when _validate_output would keep a streamed narrator/reply exactly as written.
+
+    The speaker has to match current_npc character for character, since the local
+    repair would otherwise rewrite its casing and change the line.
+    """
+    text = str(text or "").strip()
+    if not text:
+        return False
+    if field == "narrator":
+        return _narrator_is_kept(text, world_state)
+    speaker = str(speaker or "").strip()
+    if speaker != str(current_npc or "").strip():
+        return False
+    return not _dialogue_errors(
+        speaker,
+        text,
+        current_npc=current_npc,
+        current_player_choice=current_player_choice,
+        world_state=world_state,
+    )
+
 def _estimate_importance(event_type, state_updates, arc_update):
     #Fallback importance score when the LLM doesnt give one - clue/threat/quest events score higher than plain dialogue
     score = 3
@@ -206,31 +288,18 @@ def _validate_output(
     speaker_text = str(parsed.get("speaker", "")).strip()
     reply_text = str(parsed.get("reply", "")).strip()
     active_npc = str(current_npc or "").strip()
-    current_choice_text = str(current_player_choice.get("text", "")).strip().lower()
     last_narrator = str(world_state.get("last_narrator", "")).strip()
-    last_reply = str(world_state.get("last_reply", "")).strip()
-    last_speaker = str(world_state.get("last_speaker", "")).strip()
 
-    #Core dialogue checks - speaker must match the active NPC and the reply cant just echo the player back
-    if not speaker_text or not reply_text:
-        errors.append("Dialogue mode: speaker and reply must both be non-empty.")
-    if active_npc and speaker_text.lower() != active_npc.lower():
-        errors.append(f"Dialogue mode: speaker must be current_npc '{active_npc}'.")
-    if current_choice_text and reply_text.lower() == current_choice_text:
-        errors.append("Dialogue mode: reply must not repeat the player's selected line verbatim.")
-    if (
-        last_reply
-        and last_speaker
-        and active_npc
-        and last_speaker.lower() == active_npc.lower()
-        and _is_too_similar_to_previous(reply_text, last_reply)
-    ):
-        errors.append("Dialogue mode: reply must add new information, not paraphrase the previous NPC line.")
-    if _has_unsupported_scene_drift(reply_text):
-        errors.append("Dialogue mode: reply introduced unsupported scene details.")
-    if narrator_text and _is_too_similar_to_previous(narrator_text, last_narrator):
-        narrator_text = ""
-    if narrator_text and _has_unsupported_scene_drift(narrator_text):
+    errors.extend(
+        _dialogue_errors(
+            speaker_text,
+            reply_text,
+            current_npc=current_npc,
+            current_player_choice=current_player_choice,
+            world_state=world_state,
+        )
+    )
+    if not _narrator_is_kept(narrator_text, world_state):
         narrator_text = ""
     if not narrator_text:
         narrator_text = _build_auto_narrator(
@@ -380,99 +449,141 @@ def _generate_valid_json(
     required_choice_count,
     world_state,
     arc_state,
+    stop_event=None,
+    on_text=None,
 ):
     base_messages = [
         {"role": "system", "content": "You are a grounded fantasy NPC narrator. Keep replies short and specific."},
         {"role": "user", "content": prompt_text},
     ]
     original_max_new_tokens = getattr(llm, "max_new_tokens", None)
+    #With constrained decoding the structure is guaranteed, so retries are only spent on content problems.
+    #The string limits are fitted to the token budget so a full turn can actually be written in it
+    schema_budget = original_max_new_tokens if isinstance(original_max_new_tokens, int) else None
+    schema = build_turn_schema(current_npc, required_choice_count, schema_budget) if CONSTRAINED_JSON_DECODING else None
+    #Several sampled candidates per attempt make it likely that one passes without another serial round
+    candidate_count = JSON_CANDIDATES_PER_ATTEMPT if hasattr(llm, "generate_many") else 1
     last_raw = ""
     last_errors = []
 
-    try:
-        #Each attempt adds increasingly explicit repair instructions - first a fix hint, then a skeleton, then a minimal final attempt
-        for attempt in range(1, MAX_JSON_RETRY_ATTEMPTS + 1):
-            attempt_messages = list(base_messages)
-            if attempt == 2:
-                forced_choice_hint = (
-                    f"The only valid next choice is: {forced_choices[0]['text']}\n"
-                    if forced_choices and len(forced_choices) == 1
-                    else ""
-                )
-                repair_content = (
-                    "Your last response was invalid. Return ONLY valid JSON.\n"
-                    + f"Fix these errors exactly: {json.dumps(last_errors)}\n"
-                    + f"Use this exact speaker value: {current_npc}\n"
-                    + "Never set speaker to Alex.\n"
-                    + f"Keep the reply in {current_npc}'s own voice and do not speak as another NPC.\n"
-                    + f"Choices must be exactly {required_choice_count} object{'s' if required_choice_count != 1 else ''} with keys id, text, action_type.\n"
-                    + forced_choice_hint
-                    + "Do not change quest status, inventory, current_npc, or current_location in state_updates.\n"
-                    + "No markdown fences. No explanation. JSON object only."
-                )
-                attempt_messages.append(
-                    {
-                        "role": "user",
-                        "content": repair_content,
-                    }
-                )
-            elif attempt == 3:
-                choice_skeleton = (
-                    "\"choices\":[{\"id\":\"choice_1\",\"text\":\"\",\"action_type\":\"ask\"}],"
-                    if required_choice_count == 1
-                    else "\"choices\":[{\"id\":\"choice_1\",\"text\":\"\",\"action_type\":\"ask\"},{\"id\":\"choice_2\",\"text\":\"\",\"action_type\":\"ask\"}],"
-                )
-                skeleton_content = (
-                    "Reset and return the bare minimum valid JSON using this skeleton exactly.\n"
-                    + "{"
-                    + "\"narrator\":\"\","
-                    + f"\"speaker\":\"{current_npc}\","
-                    + "\"reply\":\"\","
-                    + choice_skeleton
-                    + "\"state_updates\":{},"
-                    + "\"memory_summary\":\"\","
-                    + "\"arc_update\":{\"advance\":false,\"beat_id\":\"\",\"reason\":\"\"},"
-                    + "\"event_type\":\"dialogue\","
-                    + "\"tags\":[],"
-                    + "\"importance\":3"
-                    + "}\n"
-                    + "Fill the empty strings with short valid content only."
-                )
-                attempt_messages.append(
-                    {
-                        "role": "user",
-                        "content": skeleton_content,
-                    }
-                )
-            elif attempt == 4:
-                if isinstance(original_max_new_tokens, int):
-                    llm.max_new_tokens = max(64, min(original_max_new_tokens, 96))
-                forced_choice_hint = (
-                    f"The only valid next choice is: {forced_choices[0]['text']}\n"
-                    if forced_choices and len(forced_choices) == 1
-                    else ""
-                )
-                final_repair_content = (
-                    "Final repair attempt. Keep everything extremely short.\n"
-                    + f"Speaker must be exactly {current_npc}.\n"
-                    + f"Reply must stay in {current_npc}'s voice.\n"
-                    + f"Current beat: {arc_state.get('next_required_beat') or 'none'}.\n"
-                    + "Use one short sentence for reply.\n"
-                    + "Use at most one short sentence for narrator, or an empty string.\n"
-                    + f"Choices must be exactly {required_choice_count} simple concrete next step{'s' if required_choice_count != 1 else ''}.\n"
-                    + forced_choice_hint
-                    + "Return only a valid JSON object."
-                )
-                attempt_messages.append(
-                    {
-                        "role": "user",
-                        "content": final_repair_content,
-                    }
-                )
-
-            raw = llm.generate(attempt_messages)
-            last_raw = raw
+    #Each attempt adds increasingly explicit repair instructions - first a fix hint, then a skeleton, then a minimal final attempt
+    for attempt in range(1, MAX_JSON_RETRY_ATTEMPTS + 1):
+        attempt_messages = list(base_messages)
+        max_new_tokens = None
+        if attempt == 2:
+            forced_choice_hint = (
+                f"The only valid next choice is: {forced_choices[0]['text']}\n"
+                if forced_choices and len(forced_choices) == 1
+                else ""
+            )
+            repair_content = (
+                "Your last response was invalid. Return ONLY valid JSON.\n"
+                + f"Fix these errors exactly: {json.dumps(last_errors)}\n"
+                + f"Use this exact speaker value: {current_npc}\n"
+                + "Never set speaker to Alex.\n"
+                + f"Keep the reply in {current_npc}'s own voice and do not speak as another NPC.\n"
+                + f"Choices must be exactly {required_choice_count} object{'s' if required_choice_count != 1 else ''} with keys id, text, action_type.\n"
+                + forced_choice_hint
+                + "Do not change quest status, inventory, current_npc, or current_location in state_updates.\n"
+                + "No markdown fences. No explanation. JSON object only."
+            )
+            attempt_messages.append(
+                {
+                    "role": "user",
+                    "content": repair_content,
+                }
+            )
+        elif attempt == 3:
+            choice_skeleton = (
+                "\"choices\":[{\"id\":\"choice_1\",\"text\":\"\",\"action_type\":\"ask\"}],"
+                if required_choice_count == 1
+                else "\"choices\":[{\"id\":\"choice_1\",\"text\":\"\",\"action_type\":\"ask\"},{\"id\":\"choice_2\",\"text\":\"\",\"action_type\":\"ask\"}],"
+            )
+            skeleton_content = (
+                "Reset and return the bare minimum valid JSON using this skeleton exactly.\n"
+                + "{"
+                + "\"narrator\":\"\","
+                + f"\"speaker\":\"{current_npc}\","
+                + "\"reply\":\"\","
+                + choice_skeleton
+                + "\"state_updates\":{},"
+                + "\"memory_summary\":\"\","
+                + "\"importance\":3,"
+                #arc_update is not part of the constrained schema, so only ask for it when decoding is free
+                + ("" if schema else "\"arc_update\":{\"advance\":false,\"beat_id\":\"\",\"reason\":\"\"},")
+                + "\"event_type\":\"dialogue\","
+                + "\"tags\":[]"
+                + "}\n"
+                + "Fill the empty strings with short valid content only."
+            )
+            attempt_messages.append(
+                {
+                    "role": "user",
+                    "content": skeleton_content,
+                }
+            )
+        elif attempt == 4:
+            #Passed per call rather than set on llm - a background speculative turn may share it
+            if isinstance(original_max_new_tokens, int):
+                max_new_tokens = max(64, min(original_max_new_tokens, 96))
+            forced_choice_hint = (
+                f"The only valid next choice is: {forced_choices[0]['text']}\n"
+                if forced_choices and len(forced_choices) == 1
+                else ""
+            )
+            final_repair_content = (
+                "Final repair attempt. Keep everything extremely short.\n"
+                + f"Speaker must be exactly {current_npc}.\n"
+                + f"Reply must stay in {current_npc}'s voice.\n"
+                + f"Current beat: {arc_state.get('next_required_beat') or 'none'}.\n"
+                + "Use one short sentence for reply.\n"
+                + "Use at most one short sentence for narrator, or an empty string.\n"
+                + f"Choices must be exactly {required_choice_count} simple concrete next step{'s' if required_choice_count != 1 else ''}.\n"
+                + forced_choice_hint
+                + "Return only a valid JSON object."
+            )
+            attempt_messages.append(
+                {
+                    "role": "user",
+                    "content": final_repair_content,
+                }
+            )
+
+        generate_kwargs = {"schema": schema}
+        if max_new_tokens is not None:
+            generate_kwargs["max_new_tokens"] = max_new_tokens
+            if schema is not None:
+                generate_kwargs["schema"] = build_turn_schema(current_npc, required_choice_count, max_new_tokens)
+        if stop_event is not None:
+            generate_kwargs["stop_event"] = stop_event
+        if on_text is not None and attempt == 1:
+            generate_kwargs["on_text"] = on_text #Only the first attempt is streamed, repairs are rendered once validated
+        if candidate_count > 1:
+            candidates = llm.generate_many(attempt_messages, candidate_count, **generate_kwargs)
+        else:
+            candidates = [llm.generate(attempt_messages, **generate_kwargs)]
+        if stop_event is not None and stop_event.is_set():
+            raise GenerationCancelled("Generation was cancelled.")
+        continued_rounds = 0
+        if len(candidates) == 1 and _extract_json_object(candidates[0]) is None:
+            #Only truncation is wrong with it so far - finish it before repairing or retrying
+            candidates[0], continued_rounds = _continue_truncated(
+                llm,
+                candidates[0],
+                stop_event=stop_event,
+                on_text=generate_kwargs.get("on_text"),
+            )
+            if stop_event is not None and stop_event.is_set():
+                raise GenerationCancelled("Generation was cancelled.")
+        rejected = []
+        for index, raw in enumerate(candidates, start=1):
             parsed = _extract_json_object(raw)
+            repairs = []
+            if JSON_LOCAL_REPAIR:
+                #Mechanical slips are fixed here so regeneration is only spent on bad content
+                if parsed is None:
+                    parsed, repairs = _repair_json_text(raw)
+                repairs.extend(_repair_turn_fields(parsed, current_npc))
             valid, parsed_output, errors = _validate_output(
                 parsed,
                 current_npc=current_npc,
@@ -488,11 +599,15 @@ def _generate_valid_json(
                 log_errors = []
                 if attempt > 1:
                     log_errors.append(f"json_retry_attempt_{attempt}")
+                if index > 1:
+                    log_errors.append(f"json_candidate_{index}_of_{len(candidates)}")
+                if continued_rounds:
+                    log_errors.append(f"json_continued_{continued_rounds}")
+                log_errors.extend(f"json_local_repair_{name}" for name in repairs)
                 return raw, parsed_output, log_errors
-            last_errors = errors
-    finally:
-        if isinstance(original_max_new_tokens, int):
-            llm.max_new_tokens = original_max_new_tokens
+            rejected.append((raw, errors))
+        #The repair hint targets the candidate that came closest
+        last_raw, last_errors = min(rejected, key=lambda item: len(item[1]))
 
     raise OutputValidationExhausted(
         f"Model could not produce valid JSON after {MAX_JSON_RETRY_ATTEMPTS} attempts.",
@@ -0,0 +1,79 @@
+'''
+src/speculation.py
+
+Speculative pre-generation of the next turn.
+
+While the player reads the choices and types a number, the model is idle.  With
+SPECULATIVE_PREGENERATION on, the choice loop hands every displayed choice to
+SpeculativeTurns, which plans and generates the turn for each of them in the
+background against a snapshot of the game state.  When the player picks one, its
+turn is served as soon as it is ready (usually immediately) and the others are
+cancelled, stopping their generation at the next token.
+'''
+
+import threading
+
+from src.background import BackgroundWorker
+
+def _same_choice(a, b):
+    return str(a.get("id", "")) == str(b.get("id", "")) and str(a.get("text", "")) == str(b.get("text", ""))
+
+class SpeculativeTurns:
+    def __init__(self):
+        self.worker = BackgroundWorker("speculation")
+        self._entries = []
+        self.hits = 0
+        self.misses = 0
+
+    def start(self, choices, run_turn):
+        """Queue run_turn(choice, cancel_event) for every choice, in display order.
+
+        run_turn returns the finished turn, or None if it could not produce one.
+        """
+        self.discard()
+        for choice in choices:
+            entry = {"choice": dict(choice), "cancel": threading.Event(), "done": threading.Event(), "result": None}
+            self._entries.append(entry)
+            self.worker.submit(self._run, entry, run_turn)
+
+    def _run(self, entry, run_turn):
+        try:
+            if not entry["cancel"].is_set():
+                entry["result"] = run_turn(entry["choice"], entry["cancel"])
+        finally:
+            entry["done"].set()
+
+    def take(self, choice):
+        """The precomputed turn for the chosen choice, or None.  Every other entry is cancelled.
+
+        Waits if the chosen turn is still being generated - it is already ahead of
+        a fresh start.
+        """
+        if not self._entries:
+            return None #Nothing was speculated for this turn
+        match = None
+        for entry in self._entries:
+            if match is None and _same_choice(entry["choice"], choice):
+                match = entry
+            else:
+                entry["cancel"].set()
+        self._entries = []
+        result = None
+        if match is not None:
+            match["done"].wait()
+            result = match["result"]
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def discard(self):
+        #Cancel everything still queued or running, e.g. when the session ends
+        for entry in self._entries:
+            entry["cancel"].set()
+        self._entries = []
+
+    def close(self, timeout=None):
+        self.discard()
+        return self.worker.wait(timeout)
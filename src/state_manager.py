@@ -6,10 +6,13 @@ Essentially keeps track of NPC location and what NPC we are currently on.
 Keeps track of current turn number etc...
 '''
 
+import copy
 import time
 from uuid import uuid4 #To give every turn a different id
+from src.background import BackgroundWorker
+from src.config import BACKGROUND_COMMIT, REFLECTION_EVERY_N_TURNS, REFLECTION_MAX_PENDING
 from src.embedder import embed  # semantic embedding at write time (Problem 1)
-from src.memory_retrieval import _build_auto_memory_summary
+from src.memory_retrieval import _build_auto_memory_summary, _event_terms
 from src.state_store import advance_arc_state, build_arc_state
 from src.story_rules import apply_story_choice, canonicalize_story_state
 
@@ -18,7 +21,12 @@ class StateManager:
         self.world_state = canonicalize_story_state(world_state or {})
         self.state_store = state_store
         self.memory_store = memory_store
-        self.llm = llm  # Used for LLM importance rating (Problem 3) and reflection
+        self.llm = llm  # Used for reflection
+        # Reflection runs on its own thread during the player's think time instead of stalling every fifth turn
+        self.reflection_worker = BackgroundWorker("reflection", max_pending=REFLECTION_MAX_PENDING)
+        # Turn commits (log row, state save, embedding, journal appends) run in order on their own thread
+        self.commit_worker = BackgroundWorker("commit")
+        self._reports_commit_errors = True #False on snapshots, so a speculative plan never swallows a failure meant for the live turn
         self.current_npc = self.world_state.get("current_npc", current_npc)
         self.current_location = self.world_state.get("current_location", current_location)
         self.last_rule_effects = {"applied_rules": [], "milestones": []}
@@ -28,6 +36,28 @@ class StateManager:
         except Exception:
             self.turn = 0
 
+    def snapshot(self):
+        """Private copy of the turn state for planning a turn off the main thread.
+
+        World state and rule effects are deep-copied so a speculative turn can apply
+        story rules without touching the live game.  Stores and the LLM are shared;
+        the copy must never persist anything.
+        """
+        clone = copy.copy(self)
+        clone.world_state = copy.deepcopy(self.world_state)
+        clone.last_rule_effects = copy.deepcopy(self.last_rule_effects)
+        clone._reports_commit_errors = False
+        return clone
+
+    def adopt(self, other):
+        #Take over the turn state of a snapshot whose speculative turn is being served
+        self.world_state = other.world_state
+        self.current_npc = other.current_npc
+        self.current_location = other.current_location
+        self.last_rule_effects = other.last_rule_effects
+        self.pending_story_narration = other.pending_story_narration
+        self.turn = other.turn
+
     def mission_finished(self):
         #Checking whether the case has been closed so the loop knows to stop offering choices
         flags = self.world_state.get("quest_flags", {})
@@ -206,39 +236,7 @@ class StateManager:
         self.pending_story_narration = ""
         return parsed_output
 
-    def _rate_importance_with_llm(self, memory_summary):
-        """Ask the LLM to score this memory's importance from 1-10.
-
-        Generative Agents (Park et al. 2023) uses LLM-rated importance as one
-        of three retrieval signals alongside recency and relevance.  A direct
-        rating is richer than the heuristic in output_validator.py which only
-        checks event_type and whether state/arc updates are non-empty.
-        Returns None on any failure so the caller falls back to the validator estimate.
-        """
-        if not self.llm:
-            return None
-        try:
-            prompt = (
-                "Rate the importance of this investigation memory on a scale of 1 to 10. "
-                "1 = trivial small talk, 10 = critical evidence or plot turning point. "
-                "Reply with only a single integer.\n\n"
-                f"Memory: {memory_summary}"
-            )
-            raw = self.llm.generate([{"role": "user", "content": prompt}])
-            # Parse the first integer token in the valid range
-            for token in str(raw).split():
-                cleaned = token.strip(".,!?\"'")
-                try:
-                    val = int(cleaned)
-                    if 1 <= val <= 10:
-                        return val
-                except ValueError:
-                    continue
-        except Exception:
-            pass
-        return None
-
-    def _maybe_reflect(self, current_npc, turn, every_n=5):
+    def _maybe_reflect(self, current_npc, turn, every_n=REFLECTION_EVERY_N_TURNS, current_location=None, quest_ids=None):
         """Every every_n turns, compress recent NPC memories into a single reflection event.
 
         Without compression the JSONL files grow unboundedly and the MEMORY_TOP_K cap
@@ -249,6 +247,13 @@ class StateManager:
         This mirrors the 'reflection' step in Generative Agents (Park et al. 2023)
         where the agent periodically synthesises lower-level observations into
         higher-level insights that persist longer than any individual memory.
+
+        Only the cheap journal read happens here; the summarisation call and the
+        embedding run on reflection_worker so the turn is not held up.  If a
+        reflection is still pending the new one is skipped.
+
+        Called from the commit worker, so the location and quests are passed in as
+        they were at the end of the turn rather than read from the live state.
         """
         if not self.llm or turn % every_n != 0:
             return
@@ -261,6 +266,14 @@ class StateManager:
         ]
         if len(summaries) < 3:
             return
+        # Location and quests are captured now - the world may have moved on by the time the worker runs
+        if current_location is None:
+            current_location = self.current_location
+        if quest_ids is None:
+            quest_ids = sorted(self.world_state.get("active_quests", {}).keys())
+        self.reflection_worker.submit(self._write_reflection, current_npc, turn, summaries, current_location, quest_ids)
+
+    def _write_reflection(self, current_npc, turn, summaries, current_location, quest_ids):
         try:
             prompt = (
                 f"Summarise what Alex has learned about {current_npc} from these observations "
@@ -270,8 +283,8 @@ class StateManager:
             reflection = self.llm.generate([{"role": "user", "content": prompt}]).strip()
             if not reflection:
                 return
-            emb = embed(reflection)
-            self.memory_store.append_npc_memory(current_npc, {
+            embedding_index = self.memory_store.append_embedding(embed(reflection))
+            event = {
                 "event_id": f"reflection_{current_npc}_{turn}_{uuid4().hex[:6]}",
                 "timestamp": time.time(),
                 "turn": turn,
@@ -279,15 +292,46 @@ class StateManager:
                 "event_type": "reflection",
                 "memory_summary": reflection,
                 "importance": 7,  # High — reflections are durable synthesised facts
-                "embedding": emb.tolist() if emb is not None else None,
+                "embedding_index": embedding_index,
                 "current_npc": current_npc,
-                "current_location": self.current_location,
+                "current_location": current_location,
                 "tags": ["reflection", current_npc.lower()],
-                "quest_ids": sorted(self.world_state.get("active_quests", {}).keys()),
-            })
+                "quest_ids": quest_ids,
+            }
+            event["terms"] = _event_terms(event)
+            self.memory_store.append_npc_memory(current_npc, event)
         except Exception:
             pass
 
+    def submit_commit(self, fn, *args, **kwargs):
+        #Queue post-render work behind the turns already committing, or run it now with BACKGROUND_COMMIT off
+        if not BACKGROUND_COMMIT:
+            fn(*args, **kwargs)
+            return
+        self.commit_worker.submit(fn, *args, **kwargs)
+
+    def wait_for_commits(self, timeout=None):
+        """Barrier before the next turn reads memory: every queued commit has landed.
+
+        Raises if a commit failed, the same as when the writes ran inline.  The
+        failure is cleared once the live state has reported it.
+        """
+        finished = self.commit_worker.wait(timeout)
+        error = self.commit_worker.pop_error() if self._reports_commit_errors else self.commit_worker.last_error
+        if error is not None:
+            raise RuntimeError("Saving the previous turn failed") from error
+        return finished
+
+    def flush_background(self, timeout=None):
+        #Let pending commits and reflections land in the journal before the session ends
+        #(commits first - a commit can queue a reflection). Raises if the last commits failed
+        committed = self.commit_worker.wait(timeout)
+        reflected = self.reflection_worker.wait(timeout)
+        error = self.commit_worker.pop_error()
+        if error is not None:
+            raise RuntimeError("Saving the last turn failed") from error
+        return reflected and committed
+
     def _persist_turn_memory(self, player_choice, parsed_output, retrieval_meta):
         self.world_state["last_narrator"] = parsed_output["narrator"]
         self.world_state["last_speaker"] = parsed_output["speaker"]
@@ -301,7 +345,6 @@ class StateManager:
         if speaker and speaker.lower() not in {str(name).strip().lower() for name in spoken_npcs}:
             spoken_npcs.append(speaker)
         self.world_state["spoken_npcs"] = spoken_npcs
-        self.state_store.save(self.world_state)
 
         memory_summary = parsed_output.get("memory_summary", "")
         if not isinstance(memory_summary, str) or not memory_summary.strip():
@@ -312,19 +355,12 @@ class StateManager:
                 current_location=self.current_location,
             )
 
-        # Embed the memory summary for semantic retrieval (Problem 1).
-        # Stored as a plain Python list so it serialises cleanly to JSONL.
-        # Returns None if sentence-transformers is not installed — the scorer
-        # in memory_retrieval.py falls back to keyword overlap in that case.
-        summary_embedding = embed(memory_summary)
-        embedding_list = summary_embedding.tolist() if summary_embedding is not None else None
-
         # LLM-rated importance (Problem 3 — Generative Agents style).
-        # Asking the model directly is richer than the heuristic estimate in
-        # output_validator.py which only checks event_type and state/arc updates.
-        # Falls back to the validator estimate on any failure.
-        llm_importance = self._rate_importance_with_llm(memory_summary)
-        importance = llm_importance if llm_importance is not None else parsed_output.get("importance", 3)
+        # The model rates the memory inside the turn JSON itself (the "importance"
+        # key in prompt_v1.txt), so there is no second generate() call per turn
+        # holding up the next choice.  The validator already clamps it to 0-10 and
+        # falls back to its heuristic estimate when the key is missing.
+        importance = parsed_output.get("importance", 3)
 
         event = {
             "event_id": f"turn_{self.turn}_{uuid4().hex[:8]}",
@@ -346,7 +382,7 @@ class StateManager:
             "event_type": parsed_output.get("event_type", "dialogue"),
             "tags": parsed_output.get("tags", []),
             "importance": importance,
-            "embedding": embedding_list,
+            "embedding_index": None, # filled in by _commit_turn_memory
             "quest_ids": sorted(self.world_state.get("active_quests", {}).keys()),
             "retrieved_memory_ids": [item.get("event_id") for item in retrieval_meta.get("selected", [])],
             "retrieval_scores": [
@@ -358,9 +394,36 @@ class StateManager:
             ],
             "rule_effects": self.last_rule_effects,
         }
+        event["terms"] = _event_terms(event)  # normalised once here instead of every time the event is scored
+
+        # Everything above only touches memory; the disk and model work below runs on
+        # the commit worker while the player reads the choices.  The world state is
+        # copied because the next turn's story rules start mutating it straight away.
+        self.submit_commit(
+            self._commit_turn_memory,
+            copy.deepcopy(self.world_state),
+            event,
+            parsed_output.get("speaker"),
+            event["quest_ids"],
+        )
+
+    def _commit_turn_memory(self, world_state, event, speaker, quest_ids):
+        self.state_store.save(world_state)
+
+        # Embed the memory summary for semantic retrieval (Problem 1).
+        # The vector goes into the memory store's binary sidecar and the row keeps
+        # only its index, which both journal copies of this event share.
+        # Without sentence-transformers this is a hashed vector (src/embedder_hashing.py);
+        # None only if no backend loads, and the scorer falls back to keyword overlap.
+        event["embedding_index"] = self.memory_store.append_embedding(embed(event["memory_summary"]))
         self.memory_store.append_turn(event)
-        self.memory_store.append_npc_memory(parsed_output.get("speaker"), event)
+        self.memory_store.append_npc_memory(speaker, event)
 
         # Every 5 turns, compress recent NPC memories into a single reflection.
         # Prevents retrieval noise from accumulating as the session grows.
-        self._maybe_reflect(self.current_npc, self.turn)
+        self._maybe_reflect(
+            event["current_npc"],
+            event["turn"],
+            current_location=event["current_location"],
+            quest_ids=quest_ids,
+        )
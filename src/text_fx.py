@@ -4,6 +4,8 @@ src/text_fx.py
 Small CLI effect on the text to help people read it better and for better user experience...
 """
 import os
+import queue
+import threading
 import time
 
 DEFAULT_CHAR_DELAY_SECONDS = os.getenv("TYPEWRITER_CHAR_DELAY", "0.05")
@@ -45,3 +47,54 @@ def type_line(text, char_delay=None, line_pause=None):
     if pause > 0:
         time.sleep(pause)
 
+
+class TypewriterStream:
+    """Typewriter output fed from another thread, e.g. tokens arriving during generation.
+
+    write() and end_line() only queue text, so the producer never waits on the
+    character delay; a printer thread types it out.  close() waits until everything
+    queued has been printed.  lines holds every finished line as it was shown.
+    """
+
+    _END_LINE = object()
+    _STOP = object()
+
+    def __init__(self, char_delay=None, line_pause=None):
+        self.delay = _safe_float(DEFAULT_CHAR_DELAY_SECONDS if char_delay is None else char_delay, fallback=0.008)
+        self.pause = _safe_float(DEFAULT_LINE_PAUSE_SECONDS if line_pause is None else line_pause, fallback=0.03)
+        self.lines = []
+        self._current = []
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="typewriter", daemon=True)
+        self._thread.start()
+
+    def write(self, text):
+        if text:
+            self._current.append(text)
+            self._queue.put(text)
+
+    def end_line(self):
+        self.lines.append("".join(self._current))
+        self._current = []
+        self._queue.put(self._END_LINE)
+
+    def close(self):
+        if self._current:
+            self.end_line()
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            if item is self._END_LINE:
+                print()
+                if self.pause > 0:
+                    time.sleep(self.pause)
+                continue
+            for ch in item:
+                print(ch, end="", flush=True)
+                if self.delay > 0:
+                    time.sleep(self.delay)
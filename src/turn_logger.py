@@ -19,18 +19,39 @@ def _retry_count(errors):
                 continue
     return count
 
-def _log_turn(llm, turn, player_choice, prompt_text, retrieval_meta, raw_output, parsed_output, valid, errors, timing_meta=None):
+def _local_repairs(errors):
+    #Names of the local JSON repairs (src/json_repair.py) that made the output valid
+    prefix = "json_local_repair_"
+    return [str(item)[len(prefix) :] for item in errors or [] if str(item).startswith(prefix)]
+
+def _log_turn(
+    llm,
+    turn,
+    player_choice,
+    prompt_text,
+    retrieval_meta,
+    raw_output,
+    parsed_output,
+    valid,
+    errors,
+    timing_meta=None,
+    prefix_cache_tokens=None,
+):
+    #prefix_cache_tokens is captured by the caller right after the turn's generation - by the time the row is
+    #written a reflection or speculative call may have used llm, so it is never read from llm here (None = unknown)
     retry_count = _retry_count(errors)
     row = {
         "timestamp": time.time(),
         "mode": "llm",
         "model": llm.model_id,
+        "device": getattr(llm, "device", None),
         "turn": turn,
         "player_choice_id": player_choice.get("id"),
         "player_choice_text": player_choice.get("text"),
         "player_action_type": player_choice.get("action_type"),
         "prompt": prompt_text,
         "prompt_tokens": retrieval_meta.get("prompt_tokens", 0),
+        "prefix_cache_tokens": prefix_cache_tokens,
         "memory_tokens": retrieval_meta.get("memory_tokens", 0),
         "retrieval_query": retrieval_meta.get("query", {}),
         "retrieval_candidate_count": retrieval_meta.get("candidate_count", 0),
@@ -40,6 +61,7 @@ def _log_turn(llm, turn, player_choice, prompt_text, retrieval_meta, raw_output,
                 "event_id": item.get("event_id"),
                 "score": round(float(item.get("score", 0.0)), 4),
                 "token_count": item.get("token_count"),
+                "sources": item.get("sources", []),
             }
             for item in retrieval_meta.get("selected", [])
         ],
@@ -49,6 +71,7 @@ def _log_turn(llm, turn, player_choice, prompt_text, retrieval_meta, raw_output,
         "errors": errors,
         "had_repair": retry_count > 0,
         "retry_count": retry_count,
+        "local_repairs": _local_repairs(errors),
     }
     if isinstance(timing_meta, dict):
         row["timing"] = timing_meta
@@ -75,6 +98,7 @@ def _log_failure(
         "mode": "llm_failure",
         "failure_type": "validation_exhausted",
         "model": llm.model_id,
+        "device": getattr(llm, "device", None),
         "turn": turn,
         "attempts_exhausted": attempts,
         "player_choice_id": player_choice.get("id"),
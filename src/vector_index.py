@@ -0,0 +1,159 @@
+'''
+src/vector_index.py
+
+Approximate nearest-neighbour search over every stored embedding, so retrieval is not
+limited to the last few turns of each journal.
+
+It is an IVF (inverted file) index in plain NumPy: k-means splits the vectors into
+about sqrt(n) clusters, each vector is filed under its nearest centroid, and a query
+only scores the vectors in its IVF_NPROBE closest clusters.  Small stores are scanned
+exactly - below IVF_MIN_TRAIN_ROWS that is faster than probing anyway.
+
+Files (next to the embedding sidecar):
+  ivf_centroids.npy     centroid matrix, rewritten only when the index is retrained
+  ivf_assignments.i32   one int32 cluster id per sidecar row, appended as rows arrive
+'''
+
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+IVF_MIN_TRAIN_ROWS = 256
+IVF_NPROBE = 4
+IVF_KMEANS_ITERATIONS = 8
+IVF_TRAIN_SAMPLE = 4096 #k-means runs on a sample, every row is still assigned afterwards
+IVF_ASSIGN_CHUNK = 4096
+CENTROIDS_FILE = "ivf_centroids.npy"
+ASSIGNMENTS_FILE = "ivf_assignments.i32"
+
+def _normalise_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return matrix / norms
+
+def _kmeans(sample, cluster_count, iterations=IVF_KMEANS_ITERATIONS, seed=0):
+    #Spherical k-means (cosine), seeded so a retrain is reproducible
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(sample.shape[0], cluster_count, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=cluster_count)
+        empty = counts == 0
+        if empty.any():
+            #Re-seed empty clusters from random rows instead of letting them die
+            sums[empty] = sample[rng.integers(0, sample.shape[0], int(empty.sum()))]
+        centroids = _normalise_rows(sums)
+    return centroids
+
+class IVFIndex:
+    def __init__(self, root, load_matrix):
+        #load_matrix() returns the (rows, dim) embedding sidecar or None, the index never copies it
+        self.root = Path(root)
+        self._load_matrix = load_matrix
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.centroids = None
+        self.lists = []
+        self.assigned = 0
+        self.trained_rows = 0
+
+    def _assign(self, rows):
+        labels = [np.argmax(_normalise_rows(rows[start : start + IVF_ASSIGN_CHUNK]) @ self.centroids.T, axis=1)
+                  for start in range(0, rows.shape[0], IVF_ASSIGN_CHUNK)]
+        return np.concatenate(labels).astype(np.int32) if labels else np.zeros(0, dtype=np.int32)
+
+    def _set_lists(self, labels):
+        self.lists = [[] for _ in range(self.centroids.shape[0])]
+        for row, label in enumerate(labels.tolist()):
+            self.lists[label].append(row)
+        self.assigned = len(labels)
+
+    def _load(self, matrix):
+        self._loaded = True
+        centroids_path = self.root / CENTROIDS_FILE
+        assignments_path = self.root / ASSIGNMENTS_FILE
+        if matrix is None or not centroids_path.exists() or not assignments_path.exists():
+            return
+        try:
+            centroids = np.load(centroids_path)
+            labels = np.fromfile(assignments_path, dtype=np.int32)
+        except Exception:
+            return
+        if centroids.ndim != 2 or centroids.shape[1] != matrix.shape[1] or labels.size > matrix.shape[0]:
+            return #Stale index from another store - retrain on the next sync
+        if labels.size and (labels.min() < 0 or labels.max() >= centroids.shape[0]):
+            return
+        self.centroids = centroids.astype(np.float32)
+        self.trained_rows = max(1, labels.size)
+        self._set_lists(labels)
+
+    def _train(self, matrix):
+        rows = matrix.shape[0]
+        rng = np.random.default_rng(rows)
+        sample_ids = np.sort(rng.choice(rows, min(rows, IVF_TRAIN_SAMPLE), replace=False))
+        sample = _normalise_rows(matrix[sample_ids])
+        self.centroids = _kmeans(sample, max(1, int(np.sqrt(rows))))
+        labels = self._assign(matrix)
+        self._set_lists(labels)
+        self.trained_rows = rows
+        self.root.mkdir(parents=True, exist_ok=True)
+        np.save(self.root / CENTROIDS_FILE, self.centroids)
+        temp_path = self.root / (ASSIGNMENTS_FILE + ".tmp")
+        labels.tofile(temp_path)
+        os.replace(temp_path, self.root / ASSIGNMENTS_FILE)
+
+    def _sync(self):
+        #Bring the index up to date with the sidecar: train, retrain after it doubles, or file new rows
+        matrix = self._load_matrix()
+        if not self._loaded:
+            self._load(matrix)
+        if matrix is None:
+            return None
+        rows = matrix.shape[0]
+        if self.centroids is None:
+            if rows >= IVF_MIN_TRAIN_ROWS:
+                self._train(matrix)
+        elif rows >= 2 * self.trained_rows:
+            self._train(matrix)
+        elif rows > self.assigned:
+            labels = self._assign(matrix[self.assigned :])
+            with (self.root / ASSIGNMENTS_FILE).open("ab") as f:
+                f.write(labels.tobytes())
+            for offset, label in enumerate(labels.tolist()):
+                self.lists[label].append(self.assigned + offset)
+            self.assigned = rows
+        return matrix
+
+    def add(self):
+        #Called after each sidecar append - new rows are filed under their nearest centroid
+        with self._lock:
+            self._sync()
+
+    def search(self, query, k):
+        """Top-k (row, cosine) pairs for the query, best first."""
+        if k <= 0 or query is None:
+            return []
+        with self._lock:
+            matrix = self._sync()
+            if matrix is None or matrix.shape[0] == 0:
+                return []
+            query_vector = np.asarray(query, dtype=np.float32).reshape(-1)
+            norm = float(np.linalg.norm(query_vector))
+            if query_vector.shape[0] != matrix.shape[1] or norm == 0.0:
+                return []
+            query_vector = query_vector / norm
+            if self.centroids is None:
+                candidates = np.arange(matrix.shape[0])
+            else:
+                probe = np.argsort(self.centroids @ query_vector)[::-1][:IVF_NPROBE]
+                candidates = np.array(sorted(row for cluster in probe.tolist() for row in self.lists[cluster]), dtype=np.int64)
+        if candidates.size == 0:
+            return []
+        scores = _normalise_rows(matrix[candidates]) @ query_vector
+        top = np.argsort(scores)[::-1][:k]
+        return [(int(candidates[position]), float(scores[position])) for position in top]
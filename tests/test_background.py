@@ -0,0 +1,34 @@
+'''
+tests/test_background.py
+Unit tests for the background job queue used for reflection
+'''
+
+import threading
+
+from src.background import BackgroundWorker
+
+def test_worker_runs_jobs_in_order_and_wait_blocks_until_done():
+    worker = BackgroundWorker("test")
+    seen = []
+    for index in range(5):
+        assert worker.submit(seen.append, index)
+
+    assert worker.wait(timeout=5)
+    assert seen == [0, 1, 2, 3, 4]
+    assert worker.pending() == 0
+
+def test_worker_drops_jobs_over_the_pending_cap_and_survives_errors():
+    worker = BackgroundWorker("capped", max_pending=1)
+    release = threading.Event()
+
+    def boom():
+        release.wait(5)
+        raise ValueError("reflection failed")
+
+    assert worker.submit(boom)
+    assert not worker.submit(lambda: None)
+    release.set()
+    assert worker.wait(timeout=5)
+    assert isinstance(worker.last_error, ValueError)
+    assert worker.submit(lambda: None)
+    assert worker.wait(timeout=5)
@@ -0,0 +1,87 @@
+'''
+tests/test_commit_pipeline.py
+Unit tests for committing a turn in the background while the player chooses
+'''
+
+import threading
+
+import pytest
+
+import src.state_manager as state_manager_module
+from src.memory_store import MemoryStore
+from src.state_manager import StateManager
+
+class GatedStateStore:
+    #Holds every save until the test opens the gate, like a slow disk
+    def __init__(self):
+        self.gate = threading.Event()
+        self.saved = []
+
+    def save(self, state):
+        self.gate.wait(5)
+        self.saved.append(state)
+
+def _parsed_output(reply):
+    return {
+        "narrator": "Rain drums on the stalls.",
+        "speaker": "Eli",
+        "reply": reply,
+        "choices": [{"id": "ask_more", "text": "Ask more."}],
+        "memory_summary": f"Eli said: {reply}",
+        "importance": 4,
+    }
+
+def test_persist_returns_before_the_writes_and_the_barrier_waits_for_them(tmp_path, monkeypatch):
+    monkeypatch.setattr(state_manager_module, "embed", lambda text: None)
+    store = GatedStateStore()
+    manager = StateManager({}, store, MemoryStore(root=tmp_path), current_npc="Eli", current_location="Market Gate")
+    manager.turn = 1
+
+    manager._persist_turn_memory({"id": "greet", "text": "Greet Eli."}, _parsed_output("Not now."), {"selected": []})
+    assert manager.world_state["last_reply"] == "Not now." #In-memory state is updated straight away
+    assert manager.memory_store.load_recent_turns(1) == []
+    assert manager.wait_for_commits(timeout=0.05) is False
+
+    manager.world_state["last_reply"] = "changed by the next turn"
+    store.gate.set()
+    assert manager.wait_for_commits(timeout=5) is True
+    assert store.saved[0]["last_reply"] == "Not now." #The commit saved the state as it was at the end of the turn
+    assert manager.memory_store.load_recent_turns(1)[0]["reply"] == "Not now."
+    assert manager.memory_store.load_npc_turns("Eli", 1)[0]["choice_id"] == "greet"
+
+def test_commits_land_in_submission_order_and_failures_surface_at_the_barrier(tmp_path, monkeypatch):
+    monkeypatch.setattr(state_manager_module, "embed", lambda text: None)
+    store = GatedStateStore()
+    store.gate.set()
+    manager = StateManager({}, store, MemoryStore(root=tmp_path), current_npc="Eli", current_location="Market Gate")
+    for turn, reply in enumerate(["First.", "Second.", "Third."], start=1):
+        manager.turn = turn
+        manager._persist_turn_memory({"id": f"c{turn}", "text": "Go on."}, _parsed_output(reply), {"selected": []})
+    manager.wait_for_commits(timeout=5)
+    assert [row["reply"] for row in manager.memory_store.load_recent_turns(3)] == ["First.", "Second.", "Third."]
+
+    def fail():
+        raise OSError("disk full")
+
+    manager.submit_commit(fail)
+    with pytest.raises(RuntimeError):
+        manager.wait_for_commits(timeout=5)
+
+def test_a_failed_commit_at_session_end_is_reported_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(state_manager_module, "embed", lambda text: None)
+    store = GatedStateStore()
+    store.gate.set()
+    manager = StateManager({}, store, MemoryStore(root=tmp_path), current_npc="Eli", current_location="Market Gate")
+    snapshot = manager.snapshot()
+
+    def fail():
+        raise OSError("disk full")
+
+    manager.submit_commit(fail)
+    with pytest.raises(RuntimeError):
+        snapshot.wait_for_commits(timeout=5)  # a speculative plan sees it but leaves it for the live state
+    with pytest.raises(RuntimeError) as raised:
+        manager.flush_background(timeout=5)
+    assert isinstance(raised.value.__cause__, OSError)
+    assert manager.flush_background(timeout=5) is True
+    manager.wait_for_commits(timeout=5)  # already reported, not raised again
@@ -0,0 +1,125 @@
+'''
+tests/test_embedder.py
+Unit tests for the embedding cache, using a stand-in model so sentence-transformers is not needed
+'''
+
+import threading
+
+import numpy as np
+import pytest
+
+import src.embedder as embedder
+
+class CountingModel:
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, text, normalize_embeddings=True, batch_size=32):
+        self.calls.append(text)
+        if isinstance(text, list):
+            return np.array([[len(item), 1.0] for item in text], dtype=np.float64)
+        return np.array([len(text), 1.0], dtype=np.float32)
+
+@pytest.fixture
+def model(monkeypatch, tmp_path):
+    fake = CountingModel()
+    monkeypatch.setattr(embedder, "_model", fake)
+    monkeypatch.setattr(embedder, "EMBEDDING_DISK_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(embedder, "_disk_files", None)
+    embedder.clear_embed_cache()
+    yield fake
+    embedder.clear_embed_cache()
+
+def test_repeated_texts_are_served_from_the_lru(model, monkeypatch):
+    monkeypatch.setattr(embedder, "EMBEDDING_CACHE_SIZE", 2)
+
+    first = embedder.embed("ask about the ledger")
+    assert embedder.embed("ask about the ledger") is first
+    embedder.embed("b")
+    embedder.embed("c")  # evicts the ledger text, the least recently used
+
+    assert model.calls == ["ask about the ledger", "b", "c"]
+    assert not first.flags.writeable
+    info = embedder.embed_cache_info()
+    assert (info["hits"], info["misses"], info["size"]) == (1, 3, 2)
+
+def test_disk_cache_survives_a_cleared_lru(model):
+    vector = embedder.embed("Mara hid the shard.")
+    embedder.clear_embed_cache()
+
+    again = embedder.embed("Mara hid the shard.")
+
+    assert model.calls == ["Mara hid the shard."]
+    assert np.array_equal(again, vector)
+    assert embedder.embed_cache_info()["disk_hits"] == 1
+
+def test_disk_cache_is_capped_and_cleared(model, monkeypatch, tmp_path):
+    monkeypatch.setattr(embedder, "EMBEDDING_DISK_CACHE_MAX_FILES", 10)
+    for index in range(12):
+        embedder.embed(f"line {index}")
+
+    files = list((tmp_path / "cache").glob("*/*.npy"))
+    assert 0 < len(files) <= 10
+    assert embedder._disk_cache_path("line 11") in files  # the newest survive eviction
+
+    embedder.clear_disk_cache()
+    assert list((tmp_path / "cache").glob("*/*.npy")) == []
+
+def test_no_model_means_no_vector(monkeypatch):
+    monkeypatch.setattr(embedder, "_model", False)
+    embedder.clear_embed_cache()
+    assert embedder.embed("anything") is None
+
+def test_embed_many_encodes_only_uncached_texts_in_one_batch(model):
+    embedder.embed("seen")
+
+    matrix = embedder.embed_many(["seen", "new text", "new text", "other"])
+
+    assert model.calls == ["seen", ["new text", "other"]]
+    assert matrix.dtype == np.float32 and matrix.flags.c_contiguous
+    assert matrix[:, 0].tolist() == [4.0, 8.0, 8.0, 5.0]
+    assert embedder.embed_many([]).shape == (0, 0)
+
+def test_embed_waits_for_the_background_warm_up(monkeypatch, tmp_path):
+    release = threading.Event()
+    loads = []
+
+    def slow_load():
+        loads.append(1)
+        release.wait(5)
+        return CountingModel()
+
+    monkeypatch.setattr(embedder, "_model", None)
+    monkeypatch.setattr(embedder, "_warmup_started", threading.Event())
+    monkeypatch.setattr(embedder, "_model_ready", threading.Event())
+    monkeypatch.setattr(embedder, "_load_model", slow_load)
+    monkeypatch.setattr(embedder, "EMBEDDING_DISK_CACHE_DIR", None)
+    embedder.clear_embed_cache()
+
+    embedder.warm_up()
+    embedder.warm_up()
+    threading.Timer(0.05, release.set).start()
+    vector = embedder.embed("ledger")
+
+    assert vector is not None and loads == [1]
+    assert embedder._model_ready.is_set()
+    embedder.clear_embed_cache()
+
+class WidthModel:
+    def __init__(self, dim):
+        self.dim = dim
+
+@pytest.mark.parametrize(
+    "backend, dim, stored_dim, expected",
+    [
+        ("torch", 384, 256, True),  # hashing fallback upgraded to MiniLM
+        ("onnx", 384, 256, True),
+        ("hashing", 256, 384, False),  # MiniLM failed to load this time - keep its vectors on disk
+        ("torch", 384, 384, False),
+        ("torch", 384, None, False),
+    ],
+)
+def test_only_an_upgrade_from_hashing_replaces_stored_vectors(monkeypatch, backend, dim, stored_dim, expected):
+    monkeypatch.setattr(embedder, "_model", WidthModel(dim))
+    monkeypatch.setattr(embedder, "_backend", backend)
+    assert embedder.can_replace_stored(stored_dim) is expected
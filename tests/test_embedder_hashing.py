@@ -0,0 +1,38 @@
+'''
+tests/test_embedder_hashing.py
+Unit tests for the dependency-free hashed embedding fallback
+'''
+
+import numpy as np
+
+import src.embedder as embedder
+from src.embedder_hashing import HashingEmbedder
+
+def test_hashed_vectors_are_stable_normalised_and_share_word_pieces():
+    model = HashingEmbedder(dim=128)
+
+    query, related, unrelated = model.encode(
+        ["Who tampered with the ledger?", "Eli was tampering with the ledger entry.", "The weather is nice at noon."]
+    )
+
+    assert query.shape == (128,) and query.dtype == np.float32
+    assert np.isclose(np.linalg.norm(query), 1.0)
+    assert np.array_equal(model.encode("Who tampered with the ledger?"), query)
+    assert query @ related > 0.4 > query @ unrelated
+    assert not model.encode("the and of").any()  # only stopwords -> zero vector, which scores 0
+    assert model.encode([]).shape == (0, 128)
+
+def test_hashing_is_the_last_tier_and_skips_the_caches(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOCAL_EMBEDDING_BACKEND", "hashing")
+    monkeypatch.setattr(embedder, "_backend", None)
+    model = embedder._load_model()
+    assert isinstance(model, HashingEmbedder) and embedder._backend == "hashing"
+
+    monkeypatch.setattr(embedder, "_model", model)
+    monkeypatch.setattr(embedder, "EMBEDDING_DISK_CACHE_DIR", tmp_path)
+    embedder.clear_embed_cache()
+
+    assert embedder.embed("ledger").shape == (model.dim,)
+    assert embedder.embed_many(["ledger", "route"]).shape == (2, model.dim)
+    assert embedder.embed_cache_info()["size"] == 0
+    assert not any(tmp_path.iterdir())
@@ -0,0 +1,129 @@
+'''
+tests/test_embedder_onnx.py
+Unit tests for the int8 ONNX embedder backend: pooling on a stub session, the int8 path on a tiny
+quantised fixture model (needs onnx + onnxruntime), and a parity check against sentence-transformers
+that only runs when the real exported model is present
+'''
+
+import numpy as np
+import pytest
+
+from src.config import EMBEDDING_ONNX_PATH
+from src.embedder_onnx import OnnxSentenceEmbedder, _mean_pool
+
+PARITY_TEXTS = [
+    "Alex accepted Mara's job to recover the missing Echo Shard.",
+    "Eli edited the route entry in the shipping ledger.",
+    "Who tampered with it?",
+    "The library records list a late delivery to the Market Gate.",
+]
+
+class _Input:
+    def __init__(self, name):
+        self.name = name
+
+class StubSession:
+    def get_inputs(self):
+        return [_Input("input_ids"), _Input("attention_mask")]
+
+    def get_outputs(self):
+        output = _Input("last_hidden_state")
+        output.shape = ["batch", "sequence", 2]
+        return [output]
+
+    def run(self, outputs, feeds):
+        # Token vector = [token id, 1], so the pooled vector is easy to predict
+        ids = feeds["input_ids"].astype(np.float32)
+        return [np.stack([ids, np.ones_like(ids)], axis=-1)]
+
+def stub_tokenizer(texts, **kwargs):
+    lengths = [len(text.split()) for text in texts]
+    width = max(lengths)
+    ids = np.zeros((len(texts), width), dtype=np.int64)
+    mask = np.zeros((len(texts), width), dtype=np.int64)
+    for row, length in enumerate(lengths):
+        ids[row, :length] = 3
+        mask[row, :length] = 1
+    ids[0, 0] = 5
+    return {"input_ids": ids, "attention_mask": mask, "token_type_ids": np.zeros_like(ids)}
+
+def test_mean_pooling_ignores_padding_and_normalises():
+    model = OnnxSentenceEmbedder(StubSession(), stub_tokenizer)
+
+    matrix = model.encode(["a b", "c d e f"], batch_size=8)
+    single = model.encode("a b", normalize_embeddings=False)
+
+    assert model.dim == 2  # from the output shape, no forward pass
+    assert matrix.dtype == np.float32 and matrix.shape == (2, 2)
+    assert np.allclose(np.linalg.norm(matrix, axis=1), 1.0)
+    assert single.tolist() == [4.0, 1.0]  # (5 + 3) / 2, padding token not averaged in
+    assert np.allclose(matrix[1], np.array([3.0, 1.0]) / np.sqrt(10.0))
+
+def word_tokenizer(texts, **kwargs):
+    #One id per word, from a 32-word toy vocabulary
+    rows = [[sum(map(ord, word)) % 32 for word in text.lower().split()] for text in texts]
+    width = max(len(row) for row in rows)
+    ids = np.zeros((len(texts), width), dtype=np.int64)
+    mask = np.zeros((len(texts), width), dtype=np.int64)
+    for index, row in enumerate(rows):
+        ids[index, : len(row)] = row
+        mask[index, : len(row)] = 1
+    return {"input_ids": ids, "attention_mask": mask}
+
+def test_int8_fixture_model_matches_its_float_weights(tmp_path):
+    onnx = pytest.importorskip("onnx")
+    onnxruntime = pytest.importorskip("onnxruntime")
+    from onnx import TensorProto, helper, numpy_helper
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    #A tiny stand-in for MiniLM: embedding lookup then one projection, quantised the same way export() does
+    rng = np.random.default_rng(0)
+    table = rng.standard_normal((32, 16)).astype(np.float32)
+    weight = rng.standard_normal((16, 16)).astype(np.float32)
+    axes = ["batch", "sequence"]
+    graph = helper.make_graph(
+        [
+            helper.make_node("Gather", ["table", "input_ids"], ["embedded"]),
+            helper.make_node("MatMul", ["embedded", "weight"], ["last_hidden_state"]),
+        ],
+        "tiny_encoder",
+        [
+            helper.make_tensor_value_info("input_ids", TensorProto.INT64, axes),
+            helper.make_tensor_value_info("attention_mask", TensorProto.INT64, axes),
+        ],
+        [helper.make_tensor_value_info("last_hidden_state", TensorProto.FLOAT, axes + [16])],
+        [numpy_helper.from_array(table, "table"), numpy_helper.from_array(weight, "weight")],
+    )
+    fp32_path, int8_path = tmp_path / "model-fp32.onnx", tmp_path / "model.onnx"
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8), str(fp32_path))
+    quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+
+    session = onnxruntime.InferenceSession(str(int8_path), providers=["CPUExecutionProvider"])
+    model = OnnxSentenceEmbedder(session, word_tokenizer)
+    quantised = model.encode(PARITY_TEXTS, batch_size=3)
+
+    encoded = word_tokenizer(PARITY_TEXTS)
+    reference = _mean_pool(table[encoded["input_ids"]] @ weight, encoded["attention_mask"])
+    assert model.dim == 16 and quantised.shape == (len(PARITY_TEXTS), 16)
+    assert np.sum(reference * quantised, axis=1).min() > 0.98
+
+def test_int8_backend_agrees_with_the_reference_encoder():
+    pytest.importorskip("onnxruntime")
+    sentence_transformers = pytest.importorskip("sentence_transformers")
+    if not EMBEDDING_ONNX_PATH.exists():
+        pytest.skip("int8 model not exported (python -m src.embedder_onnx)")
+    from src import embedder_onnx
+
+    reference = sentence_transformers.SentenceTransformer("all-MiniLM-L6-v2").encode(
+        PARITY_TEXTS, normalize_embeddings=True
+    )
+    quantised = embedder_onnx.load().encode(PARITY_TEXTS, normalize_embeddings=True)
+
+    cosines = np.sum(reference * quantised, axis=1)
+    assert cosines.min() > 0.98
+    # Retrieval only cares about ranking: the nearest neighbour of every text must not change
+    reference_sims = reference @ reference.T
+    quantised_sims = quantised @ quantised.T
+    np.fill_diagonal(reference_sims, -1.0)
+    np.fill_diagonal(quantised_sims, -1.0)
+    assert np.array_equal(reference_sims.argmax(axis=1), quantised_sims.argmax(axis=1))
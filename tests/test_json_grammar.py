@@ -0,0 +1,159 @@
+'''
+tests/test_json_grammar.py
+Unit tests for the character-level JSON grammar used by constrained decoding
+'''
+
+import json
+
+from src.json_grammar import (
+    JsonFieldStreamer,
+    JsonGrammar,
+    JsonObjectStoppingCriteria,
+    JsonObjectTracker,
+    JsonSchemaLogitsProcessor,
+    build_turn_schema,
+)
+
+def _turn(**overrides):
+    turn = {
+        "narrator": "Rain hammers the gate.",
+        "speaker": "Eli",
+        "reply": "I never touched the ledger.",
+        "choices": [
+            {"id": "ask_ledger", "text": "Who touched the ledger?", "action_type": "ask"},
+            {"id": "travel_old_library", "text": "I should check the Old Library.", "action_type": "travel"},
+        ],
+        "state_updates": {},
+        "memory_summary": "Eli denied touching the ledger.",
+        "importance": 4,
+    }
+    turn.update(overrides)
+    return turn
+
+def test_grammar_accepts_a_valid_turn_with_and_without_whitespace():
+    grammar = JsonGrammar(build_turn_schema("Eli", 2))
+
+    assert grammar.accepts(json.dumps(_turn()))
+    assert grammar.accepts(json.dumps(_turn(), separators=(",", ":")))
+    assert grammar.accepts(json.dumps(_turn(state_updates={"time_of_day": "night", "day": 2}, tags=["ledger"]), indent=2))
+
+def test_grammar_rejects_wrong_speaker_action_type_and_choice_count():
+    grammar = JsonGrammar(build_turn_schema("Eli", 2))
+
+    assert not grammar.accepts(json.dumps(_turn(speaker="Alex")))
+    bad_action = _turn()
+    bad_action["choices"][0]["action_type"] = "dance"
+    assert not grammar.accepts(json.dumps(bad_action))
+    assert not grammar.accepts(json.dumps(_turn(choices=_turn()["choices"][:1])))
+    assert not grammar.accepts(json.dumps({key: value for key, value in _turn().items() if key != "reply"}))
+    assert not grammar.accepts(json.dumps({key: value for key, value in _turn().items() if key != "importance"}))
+    assert not grammar.accepts(json.dumps(_turn(importance=11)))
+
+def test_grammar_rejects_prefixes_that_can_never_become_valid():
+    grammar = JsonGrammar(build_turn_schema("Mara", 1))
+    state = grammar.initial_state()
+
+    assert grammar.advance(state, '```json') is None
+    assert grammar.advance(state, '{"speaker"') is None  # keys must follow schema order
+    partial = grammar.advance(state, '{"narrator": "", "speaker": "Ma')
+    assert partial is not None and not grammar.is_complete(partial)
+    assert grammar.advance(partial, "x") is None
+    assert grammar.advance(partial, 'ra"') is not None
+
+def test_grammar_handles_escapes_and_trailing_whitespace():
+    grammar = JsonGrammar(build_turn_schema("Eli", 1))
+    text = json.dumps(_turn(reply='He said "wait"\nthen ran.', choices=_turn()["choices"][:1]))
+
+    state = grammar.advance(grammar.initial_state(), text + "\n ")
+    assert state is not None and grammar.is_complete(state)
+    assert grammar.advance(state, "extra") is None
+
+def test_object_tracker_completes_on_outer_brace_and_ignores_braces_in_strings():
+    tracker = JsonObjectTracker()
+
+    assert not tracker.feed("Sure! ```json\n")
+    assert not tracker.feed('{"reply": "a } and a \\" {", "state_updates": {')
+    assert not tracker.feed("}")
+    assert tracker.feed('}\n``` Hope that helps')
+    assert tracker.depth == 0
+
+def test_field_streamer_emits_decoded_values_while_the_object_streams():
+    events = []
+    streamer = JsonFieldStreamer(
+        {"narrator", "reply"},
+        on_start=lambda key: events.append(("start", key)),
+        on_text=lambda key, text: events.append((key, text)),
+        on_end=lambda key: events.append(("end", key)),
+    )
+    turn = _turn(narrator='Rain "hammers" the {gate}.', reply="Caf\u00e9 \U0001F600\nclosed.")
+    text = "```json\n" + json.dumps(turn) + "\n```"
+
+    for start in range(0, len(text), 3):
+        streamer.feed(text[start : start + 3])
+
+    narrator = "".join(text for key, text in events if key == "narrator")
+    assert narrator == turn["narrator"]
+    assert "".join(text for key, text in events if key == "reply") == turn["reply"]
+    assert events[0] == ("start", "narrator") and ("end", "reply") in events
+    assert streamer.values["speaker"] == "Eli" and streamer.complete
+    # Strings nested inside choices are never mistaken for top-level fields
+    assert "text" not in streamer.values
+
+def test_resuming_replays_the_partial_output_into_the_grammar_and_stop_tracker():
+    grammar = JsonGrammar(build_turn_schema("Eli", 2))
+    text = json.dumps(_turn())
+    vocab = sorted(set(text)) #One token per character keeps the replay easy to follow
+    ids = [vocab.index(ch) for ch in text]
+    cut = len(text) // 2
+
+    processor = JsonSchemaLogitsProcessor(grammar, vocab, [len(vocab)]).resume_from(ids[:cut])
+    #The first call after resuming advances over the last replayed token itself
+    state = grammar.advance(processor.states[0], text[cut - 1 :])
+    assert state is not None and grammar.is_complete(state)
+
+    assert not JsonObjectStoppingCriteria(vocab).resume_from(ids[:cut]).trackers[0].complete
+    assert JsonObjectStoppingCriteria(vocab).resume_from(ids).trackers[0].complete
+
+def test_string_limits_shrink_to_fit_the_token_budget():
+    roomy = build_turn_schema("Eli", 2)["properties"]
+    tight = build_turn_schema("Eli", 2, max_new_tokens=192)["properties"]
+
+    assert roomy["reply"]["maxLength"] == 200 and roomy["tags"]["maxItems"] == 6
+    text_chars = sum(tight[field]["maxLength"] for field in ("narrator", "reply", "memory_summary"))
+    choice = tight["choices"]["items"]["properties"]
+    text_chars += 2 * (choice["id"]["maxLength"] + choice["text"]["maxLength"])
+    assert text_chars <= (192 - 40 - 2 * 20) * 4 #Fits what is left of the budget after the JSON structure
+    assert tight["reply"]["maxLength"] >= 40 and tight["tags"]["maxItems"] == 0
+    assert JsonGrammar(build_turn_schema("Eli", 2, max_new_tokens=192)).accepts(json.dumps(_turn()))
+
+def test_single_character_fallback_only_offers_tokens_the_grammar_allows():
+    grammar = JsonGrammar(build_turn_schema("Eli", 2))
+    vocab = ["```", "{", "}", "x", "\"", " ", None, '{"narrator"']
+    processor = JsonSchemaLogitsProcessor(grammar, vocab, [len(vocab)])
+
+    assert sorted(processor._single_char_tokens(grammar.initial_state())) == [1, 5] #"{" or leading whitespace
+    state = grammar.advance(grammar.initial_state(), "{")
+    assert sorted(processor._single_char_tokens(state)) == [4, 5] #Required keys first, so no "}" yet
+
+def test_integers_that_can_never_reach_the_minimum_are_rejected_at_their_first_digit():
+    grammar = JsonGrammar({"type": "object", "properties": {"importance": {"type": "integer", "minimum": 1, "maximum": 10}}, "required": ["importance"]})
+    state = grammar.initial_state()
+
+    assert grammar.advance(state, '{"importance": 0') is None #Decoding would otherwise be stuck with no valid next character
+    assert grammar.accepts('{"importance": 1}') and grammar.accepts('{"importance": 10}')
+    assert grammar.advance(state, '{"importance": 11') is None
+
+    day = JsonGrammar({"type": "object", "properties": {"day": {"type": "integer", "minimum": 20, "maximum": 999}}, "required": ["day"]})
+    assert day.advance(day.initial_state(), '{"day": 1') is not None  # 100-199 still fit
+    assert not day.accepts('{"day": 1}')
+    assert day.accepts('{"day": 25}') and day.accepts('{"day": 150}')
+
+def test_unicode_escapes_take_exactly_four_hex_digits():
+    grammar = JsonGrammar(build_turn_schema("Eli", 2))
+
+    assert grammar.accepts(json.dumps(_turn(reply="Café at dawn, — no later.")))  # json.dumps writes \\u00e9
+    assert grammar.accepts(json.dumps(_turn(reply="A sword \U0001F5E1.")))  # surrogate pair
+    prefix = grammar.advance(grammar.initial_state(), '{"narrator": "caf')
+    assert grammar.advance(prefix, "\\u00g") is None
+    assert grammar.advance(prefix, '\\u00e"') is None
+    assert grammar.advance(prefix, "\\u00E9") is not None
@@ -0,0 +1,58 @@
+'''
+tests/test_json_repair.py
+Unit tests for the local JSON repairs
+'''
+
+from src.json_repair import _repair_json_text, _repair_turn_fields
+
+def test_syntax_slips_are_fixed_and_named():
+    assert _repair_json_text('Sure! {"reply": "Fine, then.", "tags": ["a",],}') == (
+        {"reply": "Fine, then.", "tags": ["a"]},
+        ["leading_text", "trailing_comma"],
+    )
+    assert _repair_json_text("{'reply': 'It\\'s \"late\"', 'advance': True}") == (
+        {"reply": 'It\'s "late"', "advance": True},
+        ["single_quotes", "python_literals"],
+    )
+    assert _repair_json_text('{"a": 1} and another {') == ({"a": 1}, ["trailing_text"])
+    assert _repair_json_text("no object here") == (None, [])
+
+def test_truncated_objects_are_closed_dropping_an_incomplete_member():
+    assert _repair_json_text('{"reply": "Not now.", "memory_summary": "Eli refu') == (
+        {"reply": "Not now.", "memory_summary": "Eli refu"},
+        ["closed_truncated_object"],
+    )
+    #Half a line the player would read is dropped, not closed
+    assert _repair_json_text('{"narrator": "Rain", "reply": "Not no')[0] == {"narrator": "Rain"}
+    assert _repair_json_text('{"reply": "Fine.", "choices": [{"id": "a", "text": "Ask ab')[0] == {"reply": "Fine.", "choices": [{"id": "a"}]}
+    assert _repair_json_text('{"choices": [{"id": "a", "text": "Go."}, {"id": "b", "te')[0] == {
+        "choices": [{"id": "a", "text": "Go."}, {"id": "b"}]
+    }
+    assert _repair_json_text('{"a": 1, "b": tr')[0] == {"a": 1}
+    #A comma inside a string is not a member boundary
+    assert _repair_json_text('{"reply": "Well, fine", "b"')[0] == {"reply": "Well, fine"}
+
+def test_field_fixes_only_touch_obvious_slips():
+    parsed = {
+        "speaker": "eli",
+        "reply": "Eli: Not now.",
+        "narrator": None,
+        "choices": {"text": "Leave."},
+        "importance": "4",
+        "state_updates": {"day": "2"},
+    }
+    assert _repair_turn_fields(parsed, "Eli") == [
+        "speaker",
+        "reply_speaker_prefix",
+        "narrator_null",
+        "choices_object",
+        "importance_string",
+        "state_updates_day",
+    ]
+    assert parsed["speaker"] == "Eli" and parsed["reply"] == "Not now." and parsed["importance"] == 4
+
+    #Another NPC or the player as speaker means the reply is in the wrong voice - left for regeneration
+    for wrong_voice in ("Mara", "Alex", "you"):
+        turn = {"speaker": wrong_voice, "reply": "Not now."}
+        assert _repair_turn_fields(turn, "Eli") == [] and turn["speaker"] == wrong_voice
+    assert _repair_turn_fields({"speaker": "eli the courier"}, "Eli") == ["speaker"]
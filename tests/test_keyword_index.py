@@ -0,0 +1,55 @@
+'''
+tests/test_keyword_index.py
+Unit tests for the BM25 keyword index kept by the memory store
+'''
+
+import json
+
+from src.memory_retrieval import _score_memory_candidates
+from src.memory_store import MemoryStore
+
+def _event(event_id, summary, npc="Eli", **extra):
+    return {"event_id": event_id, "turn": 1, "current_npc": npc, "memory_summary": summary, **extra}
+
+def test_search_ranks_rare_terms_first_and_reads_the_journal_row(tmp_path):
+    store = MemoryStore(root=tmp_path)
+    store.append_turn(_event("a", "The ledger was left on the desk."))
+    store.append_turn(_event("b", "The ledger names a forged route through the archive."))
+    store.append_npc_memory("Eli", _event("b", "The ledger names a forged route through the archive."))
+    for turn in range(5):
+        store.append_turn(_event(f"filler_{turn}", "The ledger gathers dust."))
+
+    events = store.search_keywords(["ledger", "forged"], 2)
+
+    assert [event["event_id"] for event in events][0] == "b"
+    assert store.search_keywords(["unseen"], 3) == []
+    assert len(store.keyword_index().lengths) == 7  # the NPC copy of "b" is not indexed twice
+
+def test_index_is_rebuilt_from_existing_journals_and_survives_reloads(tmp_path):
+    (tmp_path / "turns.jsonl").write_text(json.dumps(_event("old", "Mara hid the shard.")) + "\n", encoding="utf-8")
+
+    store = MemoryStore(root=tmp_path)
+    assert [event["event_id"] for event in store.search_keywords(["shard"], 1)] == ["old"]
+    store.append_turn(_event("new", "Mara returned the shard to the vault."))
+
+    reloaded = MemoryStore(root=tmp_path)
+    assert {event["event_id"] for event in reloaded.search_keywords(["shard", "vault"], 5)} == {"old", "new"}
+
+def test_scoring_takes_overlap_from_postings_when_the_event_is_indexed(tmp_path):
+    store = MemoryStore(root=tmp_path)
+    event = _event("indexed", "The ledger route was forged.", tags=["find_clue_pointing_to_eli"])
+    store.append_turn(event)
+    query = {
+        "keywords": ["ledger", "route"],
+        "current_npc": "Eli",
+        "current_checkpoint_id": "find_clue_pointing_to_eli",
+    }
+
+    expected = _score_memory_candidates([event], query, turn=1)
+    # Blank the text so the score can only come from the index
+    (item,) = _score_memory_candidates(
+        [{**event, "memory_summary": "", "tags": []}], query, turn=1, keyword_index=store.keyword_index()
+    )
+
+    assert item["score"] == expected[0]["score"]
+    assert item["passes_filter"]
@@ -0,0 +1,157 @@
+'''
+tests/test_llm_runtime.py
+Unit tests for LocalLLM's bookkeeping that does not need a loaded model
+'''
+
+import contextlib
+import threading
+
+import pytest
+
+from src.llm_runtime import PREFIX_CACHE_MIN_TOKENS, LocalLLM
+
+def test_reused_prefix_tokens_are_tracked_per_thread():
+    llm = LocalLLM()
+    llm.last_reused_prefix_tokens = 120  # the game loop's turn
+
+    def reflection():
+        llm.last_reused_prefix_tokens = 0  # an unrelated prompt on the background worker
+
+    worker = threading.Thread(target=reflection)
+    worker.start()
+    worker.join()
+
+    assert llm.last_reused_prefix_tokens == 120
+
+class Ids:
+    #Just enough of a (1, n) input_ids tensor for the prefix cache: input_ids[0], input_ids[:, :n], input_ids[0, :n]
+    def __init__(self, ids):
+        self.ids = list(ids)
+
+    def __getitem__(self, key):
+        return Ids(self.ids[key[1]]) if isinstance(key, tuple) else self
+
+    def tolist(self):
+        return list(self.ids)
+
+class PrefixCache:
+    def __init__(self, ids):
+        self.ids = list(ids)
+
+    def crop(self, length):
+        self.ids = self.ids[:length]
+
+class PrefillModel:
+    #Records each prefix forward pass and returns a cache holding the ids it saw
+    def __init__(self):
+        self.prefills = []
+
+    def __call__(self, input_ids, use_cache=True):
+        self.prefills.append(len(input_ids.ids))
+        return type("Output", (), {"past_key_values": PrefixCache(input_ids.ids)})()
+
+class NoGradTorch:
+    @staticmethod
+    def no_grad():
+        return contextlib.nullcontext()
+
+@pytest.fixture
+def llm(monkeypatch):
+    monkeypatch.delenv("LOCAL_PREFIX_CACHE", raising=False)
+    llm = LocalLLM()
+    llm.model = PrefillModel()
+    llm.torch = NoGradTorch()
+    return llm
+
+def _prompt(shared, tail, length=PREFIX_CACHE_MIN_TOKENS * 2):
+    return Ids(list(range(shared)) + [tail + index for index in range(length - shared)])
+
+def test_the_first_prompt_has_nothing_to_reuse(llm):
+    assert llm._prefix_cache_for(_prompt(0, 1000)) is None
+    assert llm.model.prefills == [] and llm.last_reused_prefix_tokens == 0
+
+def test_the_shared_prefix_of_two_prompts_is_cached_and_handed_out_as_a_copy(llm):
+    llm._prefix_cache_for(_prompt(50, 1000))
+    cache = llm._prefix_cache_for(_prompt(50, 2000))
+
+    assert llm.model.prefills == [50]
+    assert cache.ids == list(range(50)) and cache is not llm._prefix_cache
+    assert llm.last_reused_prefix_tokens == 50
+
+    llm._prefix_cache_for(_prompt(50, 3000))
+    assert llm.model.prefills == [50] #Served from the cache, no second prefill
+
+def test_a_prompt_that_diverges_earlier_crops_the_cache(llm):
+    llm._prefix_cache_for(_prompt(50, 1000))
+    llm._prefix_cache_for(_prompt(50, 2000))
+
+    cache = llm._prefix_cache_for(_prompt(40, 3000))
+
+    assert llm.model.prefills == [50]
+    assert llm._prefix_ids == list(range(40)) and cache.ids == list(range(40))
+    assert llm.last_reused_prefix_tokens == 40
+
+def test_an_unrelated_prompt_keeps_the_cache_for_the_next_turn(llm):
+    llm._prefix_cache_for(_prompt(50, 1000))
+    llm._prefix_cache_for(_prompt(50, 2000))
+
+    assert llm._prefix_cache_for(_prompt(PREFIX_CACHE_MIN_TOKENS - 1, 5000)) is None  # e.g. a reflection prompt
+    assert llm.last_reused_prefix_tokens == 0 and llm._prefix_ids == list(range(50))
+
+    llm._prefix_cache_for(_prompt(50, 6000))
+    assert llm.model.prefills == [50] and llm.last_reused_prefix_tokens == 50
+
+class FakeTorch:
+    #Device and dtype resolution only touch torch.cuda.is_available() and the dtype attributes
+    float16, bfloat16, float32 = "float16", "bfloat16", "float32"
+
+    def __init__(self, cuda):
+        self.cuda = type("Cuda", (), {"is_available": staticmethod(lambda: cuda)})()
+
+@pytest.mark.parametrize(
+    "requested, cuda, device, dtype",
+    [
+        ("auto", True, "cuda", "float16"),
+        ("auto", False, "cpu", "float32"),  # no GPU falls back to the CPU path in full precision
+        ("cpu", True, "cpu", "float32"),
+    ],
+)
+def test_device_and_dtype_follow_local_device_and_cuda_availability(monkeypatch, requested, cuda, device, dtype):
+    monkeypatch.setenv("LOCAL_DEVICE", requested)
+    monkeypatch.delenv("LOCAL_DTYPE", raising=False)
+    llm = LocalLLM()
+    torch = FakeTorch(cuda)
+
+    llm.device = llm._resolve_device(torch)
+    assert (llm.device, llm._resolve_dtype(torch)) == (device, dtype)
+
+def test_explicit_dtype_and_threads_are_used(monkeypatch):
+    monkeypatch.setenv("LOCAL_DTYPE", "BFloat16")
+    monkeypatch.setenv("LOCAL_NUM_THREADS", "4")
+    llm = LocalLLM(device="cpu")
+
+    assert llm._resolve_dtype(FakeTorch(False)) == "bfloat16"
+    assert llm._resolve_num_threads() == 4
+
+@pytest.mark.parametrize(
+    "env",
+    [
+        {"LOCAL_DEVICE": "cuda"},  # requested but unavailable
+        {"LOCAL_DEVICE": "tpu"},
+        {"LOCAL_DTYPE": "int4"},
+        {"LOCAL_NUM_THREADS": "many"},
+        {"LOCAL_NUM_THREADS": "0"},
+    ],
+)
+def test_bad_settings_stop_startup_instead_of_being_ignored(monkeypatch, env):
+    for name in ("LOCAL_DEVICE", "LOCAL_DTYPE", "LOCAL_NUM_THREADS"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    llm = LocalLLM()
+    torch = FakeTorch(False)
+
+    with pytest.raises(RuntimeError):
+        llm.device = llm._resolve_device(torch)
+        llm._resolve_dtype(torch)
+        llm._resolve_num_threads()
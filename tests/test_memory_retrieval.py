@@ -0,0 +1,128 @@
+'''
+tests/test_memory_retrieval.py
+Unit tests for memory scoring, using fixed vectors so no embedding model is needed
+'''
+
+import numpy as np
+import pytest
+
+import src.memory_retrieval as memory_retrieval
+from src.memory_retrieval import _event_terms, _merge_candidates, _retrieve_memories, _score_memory_candidates
+from src.memory_store import MemoryStore
+
+QUERY = {
+    "keywords": ["ledger", "route"],
+    "active_quest_ids": ["echo_shard"],
+    "current_npc": "Eli",
+    "current_checkpoint_id": "find_clue_pointing_to_eli",
+    "current_checkpoint_goal": "",
+    "next_checkpoint_id": "",
+}
+
+def test_batch_scores_combine_semantic_keyword_recency_and_importance():
+    events = [
+        {"event_id": "semantic", "turn": 9, "importance": 5, "current_npc": "Mara", "memory_summary": "Nothing shared."},
+        {"event_id": "keyword", "turn": 8, "importance": 10, "current_npc": "Mara", "memory_summary": "The ledger was moved."},
+        {"event_id": "filtered", "turn": 0, "importance": True, "current_npc": "Mara", "event_type": "fallback"},
+    ]
+    embeddings = [[2.0, 0.0], None, [0.0, 1.0]]
+
+    items = _score_memory_candidates(events, QUERY, turn=10, query_embedding=[1.0, 0.0], embeddings=embeddings)
+
+    by_id = {item["event_id"]: item for item in items}
+    assert by_id["semantic"]["score"] == pytest.approx(2.0 + 1 / 2 + 0.5)
+    assert by_id["keyword"]["score"] == pytest.approx(1.25 + 1 / 3 + 1.0)
+    assert by_id["filtered"]["score"] == pytest.approx(0.0 + 1 / 11 + 0.3 * 0.4)
+    assert [item["passes_filter"] for item in items] == [True, True, False]
+
+def test_batch_scores_apply_constraint_bonuses_without_embeddings():
+    event = {
+        "event_id": "bonus",
+        "turn": 10,
+        "importance": 0,
+        "current_npc": "Eli",
+        "event_type": "promise",
+        "quest_ids": ["echo_shard"],
+        "tags": ["find_clue_pointing_to_eli"],
+        "rule_effects": {"milestones": ["find_clue_pointing_to_eli"]},
+    }
+
+    (item,) = _score_memory_candidates([event], QUERY, turn=10)
+
+    assert item["score"] == pytest.approx(1.0 + 1.5 + 0.35 + 1.0 + 1.5 + 0.75)
+    assert _score_memory_candidates([], QUERY, turn=1) == []
+
+def test_stored_terms_are_used_instead_of_the_raw_text():
+    event = {
+        "event_id": "stored",
+        "turn": 4,
+        "current_npc": "Eli",
+        "memory_summary": "Eli forged the ledger route.",
+        "quest_ids": [" echo_shard ", ""],
+        "rule_effects": {"milestones": ["find_clue_pointing_to_eli"]},
+    }
+    terms = _event_terms(event)
+    assert terms["quest_ids"] == ["echo_shard"] and terms["npc"] == "eli"
+
+    expected = _score_memory_candidates([event], QUERY, turn=5)
+    # Once terms are stored the scorer never looks at the raw fields again
+    (item,) = _score_memory_candidates([{"event_id": "stored", "turn": 4, "terms": terms}], QUERY, turn=5)
+    assert item["score"] == pytest.approx(expected[0]["score"])
+
+def test_merge_keys_candidates_by_id_and_records_every_source():
+    npc_turns = [{"event_id": "a", "current_npc": "Eli"}, {"event_id": "f", "current_npc": "Eli", "event_type": "fallback"}]
+    recent = [
+        {"event_id": "a", "current_npc": "Eli"},
+        {"event_id": "m", "current_npc": "Mara"},
+        {"event_id": "t", "current_npc": "Mara", "event_type": "travel"},
+        {"turn": 2, "current_npc": "Eli"},
+    ]
+    hits = [{"event_id": "t", "current_npc": "Mara", "event_type": "travel"}]
+
+    merged = _merge_candidates(
+        [("npc", npc_turns), ("global", recent), ("index", hits)],
+        "Eli",
+        lambda event: event.get("event_type") == "fallback",
+    )
+
+    assert [(item["event"].get("event_id"), item["sources"]) for item in merged] == [
+        ("a", ["npc", "global"]),
+        ("t", ["global", "index"]),
+        (None, ["global"]),
+    ]
+
+def test_vectors_from_another_backend_fall_back_to_keyword_overlap():
+    event = {"event_id": "old", "turn": 9, "importance": 0, "current_npc": "Mara", "memory_summary": "The ledger moved."}
+
+    (item,) = _score_memory_candidates([event], QUERY, turn=10, query_embedding=[1.0, 0.0], embeddings=[[1.0, 0.0, 0.0]])
+
+    assert item["score"] == pytest.approx(1.25 + 1 / 2)
+
+@pytest.mark.parametrize("backend, query_vector", [("hashing", np.ones(4)), ("torch", np.ones(3))])
+def test_whole_history_keyword_candidates_when_vectors_cannot_find_them(tmp_path, monkeypatch, backend, query_vector):
+    #hashing: vectors carry no meaning; torch: the sidecar was written by another backend and cannot be searched
+    store = MemoryStore(root=tmp_path)
+    old = {"event_id": "old", "turn": 0, "importance": 9, "current_npc": "Eli", "memory_summary": "Eli forged the ledger."}
+    old["embedding_index"] = store.append_embedding(np.array([0.0, 0.0, 0.0, 1.0]))
+    store.append_turn(old)
+    store.append_npc_memory("Eli", old)
+    for turn in range(1, 31):  # pushes the old event out of both recent windows
+        row = {"event_id": f"t{turn}", "turn": turn, "importance": 1, "current_npc": "Eli", "memory_summary": "Rain again."}
+        store.append_turn(row)
+        store.append_npc_memory("Eli", row)
+    monkeypatch.setattr(memory_retrieval, "embed", lambda text: query_vector)
+    monkeypatch.setattr(memory_retrieval, "embedding_backend", lambda: backend)
+
+    _, retrieval = _retrieve_memories(
+        {"id": "ask_ledger", "text": "Ask about the ledger."},
+        memory_store=store,
+        current_npc="Eli",
+        current_location="Market Gate",
+        world_state={},
+        turn=31,
+        count_tokens=lambda text: len(text.split()),
+        is_fallback_event=lambda event: False,
+    )
+
+    selected = {item["event_id"]: item for item in retrieval["selected"]}
+    assert "keyword" in selected["old"]["sources"]
@@ -0,0 +1,158 @@
+'''
+tests/test_memory_store.py
+Unit tests for the JSONL memory journals
+'''
+
+import json
+
+import numpy as np
+
+import src.memory_store as memory_store_module
+from src.memory_store import MemoryStore
+
+def _write_rows(store, count, npc="Eli"):
+    for turn in range(count):
+        row = {"event_id": f"turn_{turn}", "turn": turn, "memory_summary": f"Summary {turn} " + "x" * 50}
+        store.append_turn(row)
+        store.append_npc_memory(npc, row)
+
+def test_tail_reads_return_the_last_rows_oldest_first_across_block_boundaries(tmp_path, monkeypatch):
+    monkeypatch.setattr(memory_store_module, "TAIL_BLOCK_BYTES", 37)  # force many small backward reads
+    store = MemoryStore(root=tmp_path)
+    _write_rows(store, 200)
+
+    recent = store.load_recent_turns(5)
+    assert [row["turn"] for row in recent] == [195, 196, 197, 198, 199]
+    assert [row["turn"] for row in store.load_npc_turns("Eli", 3)] == [197, 198, 199]
+    assert len(store.load_recent_turns(500)) == 200
+    assert store.load_last_turn()["turn"] == 199
+    assert store.load_recent_turns(0) == []
+
+def test_tail_reads_skip_blank_and_corrupt_lines(tmp_path):
+    store = MemoryStore(root=tmp_path)
+    path = tmp_path / "turns.jsonl"
+    path.write_text(
+        json.dumps({"turn": 1}) + "\n\n" + "{not json\n" + json.dumps({"turn": 2}) + "\n" + '{"turn": 3, "trunc',
+        encoding="utf-8",
+    )
+
+    assert [row["turn"] for row in store.load_recent_turns(5)] == [1, 2]
+    assert store.load_last_turn() == {"turn": 2}
+    assert MemoryStore(root=tmp_path / "missing").load_recent_turns(3) == []
+
+def test_write_through_cache_serves_reads_without_touching_disk(tmp_path):
+    store = MemoryStore(root=tmp_path, cache_rows=10)
+    _write_rows(store, 4)
+    assert [row["turn"] for row in store.load_npc_turns("Eli", 3)] == [1, 2, 3]  # first read fills the cache
+
+    store.append_npc_memory("Eli", {"event_id": "turn_4", "turn": 4})
+    (tmp_path / "eli.jsonl").write_text("", encoding="utf-8")  # anything read now must come from memory
+
+    assert [row["turn"] for row in store.load_npc_turns("Eli", 3)] == [2, 3, 4]
+    assert [row["turn"] for row in MemoryStore(root=tmp_path, cache_rows=0).load_npc_turns("Eli", 3)] == []
+
+    store.reset()
+    assert store.load_npc_turns("Eli", 3) == []
+
+def test_embeddings_go_to_the_sidecar_and_rows_only_keep_an_index(tmp_path):
+    store = MemoryStore(root=tmp_path)
+    first = store.append_embedding([1.0, 0.0, 0.0])
+    second = store.append_embedding([0.0, 0.5, 0.5])
+    assert (first, second) == (0, 1)
+    assert store.append_embedding(None) is None
+    assert store.append_embedding([1.0, 2.0]) is None  # wrong width for this store
+
+    store.append_turn({"event_id": "a", "turn": 1, "embedding_index": second})
+    assert "embedding" not in json.loads((tmp_path / "turns.jsonl").read_text(encoding="utf-8"))
+    vectors = MemoryStore(root=tmp_path).load_event_embeddings(store.load_recent_turns(1) + [{"event_id": "none"}])
+    assert vectors[0].tolist() == [0.0, 0.5, 0.5]
+    assert vectors[1] is None
+
+def test_migration_moves_inline_embeddings_and_shares_vectors_between_journals(tmp_path):
+    legacy = {"event_id": "turn_1_abc", "turn": 1, "embedding": [0.25, 0.75]}
+    for name in ("turns.jsonl", "eli.jsonl"):
+        (tmp_path / name).write_text(json.dumps(legacy) + "\n" + json.dumps({"turn": 0}) + "\n", encoding="utf-8")
+    store = MemoryStore(root=tmp_path)
+
+    assert store.migrate_inline_embeddings() == 2
+    assert store.migrate_inline_embeddings() == 0
+    turn_row = store.load_recent_turns(2)[0]
+    npc_row = store.load_npc_turns("Eli", 2)[0]
+    assert "embedding" not in turn_row
+    assert turn_row["embedding_index"] == npc_row["embedding_index"] == 0
+    assert store.load_event_embeddings([turn_row])[0].tolist() == [0.25, 0.75]
+
+def test_similar_events_are_found_across_the_whole_history(tmp_path):
+    store = MemoryStore(root=tmp_path, cache_rows=4)
+    for turn in range(30):
+        vector = [0.0] * 4
+        vector[turn % 4] = 1.0
+        vector[3] += turn / 100
+        row = {"event_id": f"turn_{turn}", "turn": turn, "embedding_index": store.append_embedding(vector)}
+        store.append_turn(row)
+        store.append_npc_memory("Eli", row)
+
+    events = store.search_similar_events([0.0, 1.0, 0.0, 0.0], 3)
+    assert [event["turn"] for event in events] == [1, 5, 9]
+
+    (tmp_path / "embeddings_loc.jsonl").unlink()  # locator is rebuilt from the journals when missing
+    assert [event["turn"] for event in MemoryStore(root=tmp_path).search_similar_events([0.0, 1.0, 0.0, 0.0], 1)] == [1]
+
+def test_backfill_embeds_rows_without_vectors_in_one_batch(tmp_path):
+    store = MemoryStore(root=tmp_path)
+    row = {"event_id": "turn_1", "turn": 1, "memory_summary": "Eli hid the ledger."}
+    store.append_turn(row)
+    store.append_npc_memory("Eli", row)
+    store.append_turn({"event_id": "turn_2", "turn": 2, "memory_summary": "", "embedding_index": None})
+    calls = []
+
+    def embed_many(texts):
+        calls.append(texts)
+        return np.ones((len(texts), 3), dtype=np.float32)
+
+    assert store.backfill_embeddings(embed_many) == 2  # both journal copies of turn_1
+    assert calls == [["Eli hid the ledger."]]
+    assert store.load_npc_turns("Eli", 1)[0]["embedding_index"] == 0
+    assert [event["event_id"] for event in store.search_similar_events([1.0, 1.0, 1.0], 1)] == ["turn_1"]
+    assert store.backfill_embeddings(embed_many) == 0
+    assert store.append_embeddings(np.zeros((2, 3))) == [1, 2]
+
+def test_backfill_leaves_journals_alone_when_nothing_was_stored_and_keeps_broken_lines(tmp_path):
+    store = MemoryStore(root=tmp_path)
+    store.append_embedding(np.ones(4))  # the sidecar is 4 wide
+    store.append_turn({"event_id": "turn_1", "turn": 1, "memory_summary": "Eli hid the ledger."})
+    journal = tmp_path / "turns.jsonl"
+    with journal.open("a", encoding="utf-8") as f:
+        f.write('{"event_id": "turn_2", "memory_sum\n')  # half-written line from a crash
+    before = journal.read_bytes()
+
+    assert store.backfill_embeddings(lambda texts: np.ones((len(texts), 3), dtype=np.float32)) == 0
+    assert journal.read_bytes() == before
+
+    assert store.backfill_embeddings(lambda texts: np.ones((len(texts), 4), dtype=np.float32)) == 1
+    assert '{"event_id": "turn_2", "memory_sum' in journal.read_text(encoding="utf-8").splitlines()
+
+def test_switching_embedding_backends_reembeds_the_whole_store(tmp_path):
+    store = MemoryStore(root=tmp_path)
+    hashed = store.append_embeddings(np.ones((2, 256), dtype=np.float32))  # saved with the hashing fallback
+    for turn, index in enumerate(hashed, start=1):
+        row = {"event_id": f"turn_{turn}", "turn": turn, "memory_summary": f"Summary {turn}", "embedding_index": index}
+        store.append_turn(row)
+        store.append_npc_memory("Eli", row)
+    store.append_turn({"event_id": "turn_3", "turn": 3, "memory_summary": "Summary 3"})
+
+    #MiniLM is installed now: its vectors do not fit and backfilling cannot help
+    assert store.append_embedding(np.ones(384)) is None
+    assert store.mismatched_embeddings == 1
+    assert store.backfill_embeddings(lambda texts: np.ones((len(texts), 384), dtype=np.float32)) == 0
+
+    def minilm(texts):
+        return np.stack([np.eye(384, dtype=np.float32)[int(text.split()[-1])] for text in texts])
+
+    assert store.reembed_embeddings(minilm) == 3
+    reloaded = MemoryStore(root=tmp_path)
+    assert reloaded.embedding_dim() == 384
+    vectors = reloaded.load_event_embeddings(reloaded.load_all_turns())
+    assert [int(np.argmax(vector)) for vector in vectors] == [1, 2, 3]
+    assert [event["event_id"] for event in reloaded.search_similar_events(np.eye(384)[2], 1)] == ["turn_2"]
+    assert reloaded.append_embedding(np.ones(384)) == 3
@@ -0,0 +1,123 @@
+'''
+tests/test_output_validator.py
+Unit tests for the generate-and-validate loop
+'''
+
+import json
+
+import src.output_validator as output_validator
+from src.output_validator import _generate_valid_json
+
+VALID_TURN = {
+    "narrator": "Rain drums on the stalls.",
+    "speaker": "Eli",
+    "reply": "The shard was moved at dawn.",
+    "choices": [
+        {"id": "ask_dawn", "text": "Ask who moved it at dawn.", "action_type": "ask"},
+        {"id": "check_stall", "text": "Check the market stall.", "action_type": "investigate"},
+    ],
+    "state_updates": {},
+    "memory_summary": "Eli said the shard moved at dawn.",
+    "importance": 4,
+    "event_type": "dialogue",
+    "tags": [],
+}
+
+class FakeLLM:
+    #Hands out the scripted completions in order and records how each call was made
+    max_new_tokens = 192
+
+    def __init__(self, outputs):
+        self.outputs = list(outputs)
+        self.calls = []
+
+    def generate(self, messages, **kwargs):
+        self.calls.append(1)
+        return self.outputs.pop(0)
+
+    def generate_many(self, messages, count, **kwargs):
+        self.calls.append(count)
+        batch, self.outputs = self.outputs[:count], self.outputs[count:]
+        return batch
+
+def _generate(llm):
+    return _generate_valid_json(
+        llm,
+        "prompt",
+        current_npc="Eli",
+        current_location="Market Gate",
+        current_player_choice={"id": "greet", "text": "Greet Eli."},
+        last_choices=[],
+        story_suggestions=[],
+        forced_choices=[],
+        required_choice_count=2,
+        world_state={},
+        arc_state={},
+    )
+
+def test_the_first_valid_candidate_of_a_batch_wins_without_a_retry(monkeypatch):
+    monkeypatch.setattr(output_validator, "JSON_CANDIDATES_PER_ATTEMPT", 3)
+    wrong_speaker = json.dumps(dict(VALID_TURN, speaker="Mara"))
+    llm = FakeLLM(["not json", wrong_speaker, json.dumps(VALID_TURN)])
+
+    raw, parsed, errors = _generate(llm)
+
+    assert llm.calls == [3]
+    assert json.loads(raw) == VALID_TURN and parsed["reply"] == VALID_TURN["reply"]
+    assert errors == ["json_candidate_3_of_3"]
+
+def test_a_batch_with_no_valid_candidate_falls_through_to_the_next_attempt(monkeypatch):
+    monkeypatch.setattr(output_validator, "JSON_CANDIDATES_PER_ATTEMPT", 2)
+    llm = FakeLLM(["not json", "{}", json.dumps(VALID_TURN), "unused"])
+
+    _, _, errors = _generate(llm)
+
+    assert llm.calls == [2, 2]
+    assert errors == ["json_retry_attempt_2"]
+
+def test_single_candidate_mode_keeps_plain_generate_calls():
+    llm = FakeLLM([json.dumps(VALID_TURN)])
+    _, _, errors = _generate(llm)
+    assert llm.calls == [1] and errors == []
+
+def test_mechanical_slips_are_repaired_locally_instead_of_regenerated():
+    truncated = json.dumps(dict(VALID_TURN, speaker="eli"))
+    truncated = "```json\n" + truncated[: truncated.index('"tags"')].rstrip().rstrip(",") + ",\n"
+    llm = FakeLLM([truncated])
+
+    _, parsed, errors = _generate(llm)
+
+    assert llm.calls == [1]
+    assert parsed["speaker"] == "Eli" and parsed["reply"] == VALID_TURN["reply"]
+    assert errors == [
+        "json_local_repair_markdown_fence",
+        "json_local_repair_closed_truncated_object",
+        "json_local_repair_speaker",
+    ]
+
+class TruncatingLLM(FakeLLM):
+    #generate() stops at max_new_tokens halfway through the object, continue_generation() finishes it
+    def __init__(self, full_text, cut):
+        super().__init__([full_text[:cut]])
+        self.full_text = full_text
+        self.last_truncated = False
+        self.continued = 0
+
+    def generate(self, messages, **kwargs):
+        self.last_truncated = True
+        return super().generate(messages, **kwargs)
+
+    def continue_generation(self, max_new_tokens=None, stop_event=None, on_text=None):
+        self.continued += 1
+        self.last_truncated = False
+        return self.full_text
+
+def test_a_truncated_turn_is_continued_instead_of_repaired_or_regenerated():
+    full = json.dumps(VALID_TURN)
+    llm = TruncatingLLM(full, cut=full.index('"choices"'))
+
+    _, parsed, errors = _generate(llm)
+
+    assert llm.calls == [1] and llm.continued == 1
+    assert parsed["choices"][0]["id"] == "ask_dawn" #Kept, where closing the object would have dropped them
+    assert errors == ["json_continued_1"]
@@ -0,0 +1,62 @@
+'''
+tests/test_speculation.py
+Unit tests for speculative pre-generation of the next turn
+'''
+
+import threading
+
+from src.speculation import SpeculativeTurns
+from src.state_manager import StateManager
+
+CHOICES = [
+    {"id": "ask_eli", "text": "Ask Eli about the ledger.", "action_type": "ask"},
+    {"id": "go_library", "text": "Go to the library.", "action_type": "travel"},
+]
+
+def test_picked_choice_is_served_and_the_others_are_cancelled():
+    speculation = SpeculativeTurns()
+    events = {}
+
+    def run_turn(choice, cancel_event):
+        events[choice["id"]] = cancel_event
+        if choice["id"] == "ask_eli":
+            cancel_event.wait(5)  # a long generation that only ends when cancelled
+            return None
+        return {"turn_for": choice["id"]}
+
+    speculation.start(CHOICES, run_turn)
+    result = speculation.take(dict(CHOICES[1]))
+
+    assert result == {"turn_for": "go_library"}
+    assert not events["go_library"].is_set()
+    assert "ask_eli" not in events or events["ask_eli"].is_set()  # skipped, or stopped mid-generation
+    assert (speculation.hits, speculation.misses) == (1, 0)
+    assert speculation.take(CHOICES[0]) is None  # nothing speculated any more
+    assert speculation.close(timeout=5)
+
+def test_unknown_choice_is_a_miss_and_waits_for_nothing():
+    speculation = SpeculativeTurns()
+    started = threading.Event()
+
+    def run_turn(choice, cancel_event):
+        started.set()
+        cancel_event.wait(5)
+        return None
+
+    speculation.start(CHOICES[:1], run_turn)
+    started.wait(5)
+    assert speculation.take({"id": "other", "text": "Leave."}) is None
+    assert speculation.misses == 1
+    assert speculation.close(timeout=5)
+
+def test_state_snapshot_is_independent_until_adopted(tmp_path):
+    state = StateManager({"active_quests": {"echo_shard": "active"}}, None, None, current_npc="Eli", current_location="Market Gate")
+
+    snapshot = state.snapshot()
+    snapshot.turn += 1
+    snapshot.current_npc = "Mara"
+    snapshot.world_state["active_quests"]["echo_shard"] = "completed"
+
+    assert (state.turn, state.current_npc, state.world_state["active_quests"]["echo_shard"]) == (0, "Eli", "active")
+    state.adopt(snapshot)
+    assert (state.turn, state.current_npc, state.world_state["active_quests"]["echo_shard"]) == (1, "Mara", "completed")
@@ -0,0 +1,65 @@
+'''
+tests/test_turn_stream.py
+Unit tests for typing the narrator and reply while the turn JSON is still being generated
+'''
+
+import json
+
+import pytest
+
+import src.text_fx as text_fx
+from src.choice_loop import TurnStream
+from src.output_validator import _line_survives_validation
+
+@pytest.fixture(autouse=True)
+def instant_typing(monkeypatch):
+    monkeypatch.setattr(text_fx, "DEFAULT_CHAR_DELAY_SECONDS", "0")
+    monkeypatch.setattr(text_fx, "DEFAULT_LINE_PAUSE_SECONDS", "0")
+
+def _feed(stream, turn):
+    raw = json.dumps(turn)
+    for start in range(0, len(raw), 4):
+        stream.feed(raw[start : start + 4])
+    stream.close()
+
+def _check(world_state=None):
+    def check(field, text, speaker):
+        return _line_survives_validation(
+            field,
+            text,
+            speaker,
+            current_npc="Eli",
+            current_player_choice={"id": "greet", "text": "Greet Eli."},
+            world_state=world_state or {},
+        )
+
+    return check
+
+def test_each_line_is_typed_once_its_value_closes(capsys):
+    markers = []
+    stream = TurnStream(lambda: markers.append("marker"), "Eli", story_bridge="The gate creaks.", check=_check())
+
+    _feed(stream, {"narrator": "Rain falls.", "speaker": "Eli", "reply": "Not now.", "choices": []})
+
+    assert markers == ["marker"]
+    assert stream.shown == {"narrator": "Narrator: The gate creaks. Rain falls.", "reply": "Eli: Not now."}
+    assert capsys.readouterr().out == "Narrator: The gate creaks. Rain falls.\nEli: Not now.\n"
+
+def test_a_line_validation_would_reject_is_held_along_with_everything_after_it(capsys):
+    stream = TurnStream(lambda: print("marker"), "Eli", check=_check())
+    _feed(stream, {"narrator": "Rain falls.", "speaker": "Mara", "reply": "Not now.", "choices": []})
+
+    assert stream.held and stream.shown == {"narrator": "Narrator: Rain falls."} #Wrong voice never reaches the player
+    assert capsys.readouterr().out == "marker\nNarrator: Rain falls.\n"
+
+    repeat = TurnStream(lambda: None, "Eli", check=_check({"last_narrator": "Rain falls."}))
+    _feed(repeat, {"narrator": "Rain falls.", "speaker": "Eli", "reply": "Not now.", "choices": []})
+    assert repeat.typewriter is None and repeat.shown == {} #The stock narrator replaces it, so the reply waits too
+
+def test_nothing_is_printed_before_the_first_line_closes(capsys):
+    stream = TurnStream(lambda: print("marker"), "Eli", check=_check())
+    stream.feed('{"narrator": "Rain fa')
+    stream.close()
+
+    assert stream.typewriter is None and stream.shown == {}
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,40 @@
+'''
+tests/test_vector_index.py
+Unit tests for the NumPy IVF index over the embedding sidecar
+'''
+
+import numpy as np
+
+from src.vector_index import IVF_MIN_TRAIN_ROWS, IVFIndex
+
+def _clustered_vectors(count, dim=16, seed=3):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(8, dim))
+    rows = centres[rng.integers(0, 8, count)] + 0.05 * rng.normal(size=(count, dim))
+    return (rows / np.linalg.norm(rows, axis=1, keepdims=True)).astype(np.float32)
+
+def test_small_stores_are_searched_exactly(tmp_path):
+    matrix = _clustered_vectors(20)
+    index = IVFIndex(tmp_path, lambda: matrix)
+
+    hits = index.search(matrix[7], 3)
+    assert hits[0][0] == 7
+    assert hits[0][1] > 0.999
+    assert index.centroids is None
+
+def test_index_trains_files_new_rows_and_reloads_from_disk(tmp_path):
+    state = {"matrix": _clustered_vectors(IVF_MIN_TRAIN_ROWS + 40)}
+    index = IVFIndex(tmp_path, lambda: state["matrix"])
+    index.add()
+    assert index.centroids is not None
+    assert sum(len(rows) for rows in index.lists) == state["matrix"].shape[0]
+
+    extra = _clustered_vectors(5, seed=9)
+    state["matrix"] = np.vstack([state["matrix"], extra])
+    index.add()
+    assert index.search(extra[2], 1)[0][0] == state["matrix"].shape[0] - 3
+
+    reloaded = IVFIndex(tmp_path, lambda: state["matrix"])
+    assert reloaded.search(state["matrix"][100], 1)[0][0] == 100
+    assert reloaded.assigned == state["matrix"].shape[0]
+    assert reloaded.search(np.zeros(16), 1) == []